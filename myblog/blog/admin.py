@@ -48,18 +48,10 @@ class CategoryAdmin(admin.ModelAdmin):
     """分类管理"""
     list_display = ('name', 'description', 'post_count')
 
-    def post_count(self, obj):
-        return obj.posts.count()
-    post_count.short_description = '文章数'
-
 class TagAdmin(admin.ModelAdmin):
     """标签管理"""
     list_display = ('name', 'description', 'post_count')
 
-    def post_count(self, obj):
-        return obj.posts.count()
-    post_count.short_description = '文章数'
-
 # 注册模型
 admin.site.register(Post, PostAdmin)
 admin.site.register(Comment, CommentAdmin)
@@ -97,8 +89,7 @@ class PrivateChatSessionAdmin(admin.ModelAdmin):
     message_count.short_description = '消息数'
 
     def last_message_time(self, obj):
-        last_msg = obj.messages.last()
-        return last_msg.created_at if last_msg else None
+        return obj.last_message_at
 
     last_message_time.short_description = '最后消息时间'
 
@@ -0,0 +1,206 @@
+"""
+用户代理维度
+访问记录只保存指向 UserAgent 维度表的外键，完整的 User-Agent 字符串按 SHA-1 摘要去重后只存一份
+
+- 分类（浏览器、操作系统、设备、爬虫）由 parse_user_agent 计算，结果在进程内按字符串缓存，
+  每个不同的 User-Agent 只解析一次，写入维度表后不再重复计算
+- 访问记录在缓冲区批量写入前由 assign_agents 统一解析外键：已知摘要直接命中进程内缓存，
+  新出现的 User-Agent 一次批量插入
+- 从旧版表结构（访问记录表上的 user_agent 列）升级时，先添加 agent_id 列，执行
+  intern_user_agents 命令回填外键（intern_legacy_user_agents），最后再删除 user_agent 列
+"""
+
+import hashlib
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+
+from .models import UserAgent, VisitStatistics
+
+LEGACY_COLUMN = 'user_agent'
+
+ParsedAgent = namedtuple('ParsedAgent', 'browser_family os_family device_type is_bot')
+
+BOT_PATTERN = re.compile(
+    r'bot\b|bot/|crawl|spider|slurp|archiver|curl/|wget/|python-requests|python-urllib|'
+    r'go-http-client|okhttp|java/|httpclient|headless|facebookexternalhit|bytespider|feedfetcher',
+    re.IGNORECASE,
+)
+
+# 按从具体到宽泛的顺序判断：Edge、Opera、三星浏览器和微信内置浏览器的 UA 中都包含 Chrome，
+# Chrome 的 UA 中又包含 Safari
+BROWSER_RULES = (
+    ('Edge', ('Edg/', 'EdgA/', 'EdgiOS/', 'Edge/')),
+    ('Opera', ('OPR/', 'Opera')),
+    ('微信', ('MicroMessenger',)),
+    ('Samsung', ('SamsungBrowser',)),
+    ('Firefox', ('Firefox/', 'FxiOS/')),
+    ('Chrome', ('Chrome/', 'CriOS/', 'Chromium/')),
+    ('Safari', ('Safari/',)),
+)
+
+# Android 的 UA 中包含 Linux，iOS 的 UA 中包含 Mac OS X
+OS_RULES = (
+    ('Windows', ('Windows NT', 'Windows Phone')),
+    ('Android', ('Android',)),
+    ('iOS', ('iPhone', 'iPad', 'iPod')),
+    ('macOS', ('Macintosh', 'Mac OS X')),
+    ('Chrome OS', ('CrOS',)),
+    ('Linux', ('Linux', 'X11')),
+)
+
+OTHER = '其他'
+
+
+def _match(user_agent, rules):
+    for family, markers in rules:
+        if any(marker in user_agent for marker in markers):
+            return family
+    return OTHER
+
+
+@lru_cache(maxsize=4096)
+def parse_user_agent(user_agent):
+    """解析 User-Agent，返回 ParsedAgent；结果按字符串缓存"""
+    user_agent = user_agent or ''
+    os_family = _match(user_agent, OS_RULES)
+    if BOT_PATTERN.search(user_agent):
+        return ParsedAgent('爬虫', os_family, 'bot', True)
+
+    browser_family = _match(user_agent, BROWSER_RULES)
+    if 'iPad' in user_agent or 'Tablet' in user_agent or \
+            (os_family == 'Android' and 'Mobile' not in user_agent):
+        device_type = 'tablet'
+    elif 'Mobi' in user_agent or os_family in ('Android', 'iOS'):
+        device_type = 'mobile'
+    elif os_family in ('Windows', 'macOS', 'Linux', 'Chrome OS'):
+        device_type = 'desktop'
+    else:
+        device_type = 'other'
+    return ParsedAgent(browser_family, os_family, device_type, False)
+
+
+def classify_browser(user_agent):
+    """根据 User-Agent 判断浏览器类别"""
+    return parse_user_agent(user_agent).browser_family
+
+
+def agent_hash(user_agent):
+    return hashlib.sha1((user_agent or '').encode('utf-8')).hexdigest()
+
+
+class AgentInterner:
+    """
+    把 User-Agent 字符串映射为维度表 ID
+    进程内缓存摘要到 ID 的映射（超过 AGENT_CACHE_SIZE 时清空重建），只有未见过的摘要才访问数据库
+    """
+
+    def __init__(self):
+        self.max_size = getattr(settings, 'AGENT_CACHE_SIZE', 10000)
+        self._lock = threading.Lock()
+        self._ids = {}
+
+    def intern(self, user_agents):
+        """返回 {User-Agent: 维度表 ID}，新出现的 User-Agent 批量写入维度表"""
+        hashes = {user_agent: agent_hash(user_agent) for user_agent in set(user_agents)}
+        with self._lock:
+            known = {digest: self._ids[digest] for digest in hashes.values() if digest in self._ids}
+
+        missing = {digest: user_agent for user_agent, digest in hashes.items() if digest not in known}
+        if missing:
+            found = dict(UserAgent.objects.filter(ua_hash__in=missing).values_list('ua_hash', 'id'))
+            new = [digest for digest in missing if digest not in found]
+            if new:
+                # 其他进程可能同时插入同一个 User-Agent，忽略冲突后重新读取 ID
+                UserAgent.objects.bulk_create([
+                    UserAgent(ua_hash=digest, user_agent=missing[digest], **parse_user_agent(missing[digest])._asdict())
+                    for digest in new
+                ], ignore_conflicts=True)
+                found.update(UserAgent.objects.filter(ua_hash__in=new).values_list('ua_hash', 'id'))
+            known.update(found)
+            with self._lock:
+                if len(self._ids) + len(found) > self.max_size:
+                    self._ids.clear()
+                self._ids.update(found)
+
+        return {user_agent: known[digest] for user_agent, digest in hashes.items()}
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+
+
+interner = AgentInterner()
+
+
+def assign_agents(visits):
+    """
+    为一批未保存的访问记录设置 agent 外键
+    访问记录的原始 User-Agent 由中间件暂存在 raw_user_agent 属性中
+    """
+    pending = [visit for visit in visits if visit.agent_id is None and hasattr(visit, 'raw_user_agent')]
+    if not pending:
+        return
+    ids = interner.intern(visit.raw_user_agent for visit in pending)
+    for visit in pending:
+        visit.agent_id = ids[visit.raw_user_agent]
+
+
+def reclassify(batch_size=1000):
+    """分类规则变化后重新解析维度表中的全部 User-Agent，返回分类发生变化的行数"""
+    parse_user_agent.cache_clear()
+    fields = list(ParsedAgent._fields)
+    changed = []
+    updated = 0
+    for agent in UserAgent.objects.only('id', 'user_agent', *fields).iterator(chunk_size=batch_size):
+        parsed = parse_user_agent(agent.user_agent)
+        if tuple(getattr(agent, field) for field in fields) != parsed:
+            for field, value in parsed._asdict().items():
+                setattr(agent, field, value)
+            changed.append(agent)
+        if len(changed) >= batch_size:
+            UserAgent.objects.bulk_update(changed, fields)
+            updated += len(changed)
+            changed = []
+    if changed:
+        UserAgent.objects.bulk_update(changed, fields)
+        updated += len(changed)
+    return updated
+
+
+def has_legacy_column():
+    """访问记录表上是否还有旧版的 user_agent 列"""
+    with connection.cursor() as cursor:
+        columns = connection.introspection.get_table_description(cursor, VisitStatistics._meta.db_table)
+    return any(column.name == LEGACY_COLUMN for column in columns)
+
+
+def intern_legacy_user_agents(batch_size=1000):
+    """
+    把旧版 user_agent 列中的字符串写入维度表，并回填访问记录的 agent 外键，返回回填的记录数
+    按主键分批处理，只处理 agent_id 为空的记录，中断后可以重复执行
+    """
+    quote = connection.ops.quote_name
+    sql = (
+        f'SELECT {quote("id")}, {quote(LEGACY_COLUMN)} FROM {quote(VisitStatistics._meta.db_table)} '
+        f'WHERE {quote("agent_id")} IS NULL AND {quote("id")} > %s ORDER BY {quote("id")} LIMIT %s'
+    )
+    updated = 0
+    last_id = 0
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [last_id, batch_size])
+            rows = cursor.fetchall()
+        if not rows:
+            return updated
+        ids = interner.intern((user_agent or '')[:500] for _, user_agent in rows)
+        VisitStatistics.objects.bulk_update(
+            [VisitStatistics(id=visit_id, agent_id=ids[(user_agent or '')[:500]]) for visit_id, user_agent in rows],
+            ['agent'],
+        )
+        updated += len(rows)
+        last_id = rows[-1][0]
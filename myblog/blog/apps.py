@@ -6,4 +6,8 @@ class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
 
+    def ready(self):
+        # 注册信号处理
+        from . import signals  # noqa: F401
+
 
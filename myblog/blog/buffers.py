@@ -0,0 +1,275 @@
+"""
+后台缓冲写入
+将高频写操作先缓存在进程内，再由后台线程批量写入数据库
+"""
+
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundFlusher:
+    """
+    后台刷写线程基类
+    按固定间隔或被主动唤醒时调用 flush()，进程退出时做最后一次刷写
+    """
+    thread_name = 'blog-flusher'
+
+    def __init__(self, flush_interval=5):
+        self.flush_interval = flush_interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        """按需启动后台线程（兼容 gunicorn 预加载后 fork 的情况）"""
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def _run(self):
+        """后台线程主循环"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('%s 刷写失败', self.thread_name)
+            finally:
+                # 后台线程持有独立的数据库连接，每轮结束后释放
+                connection.close()
+
+    def wakeup(self):
+        """唤醒后台线程立即刷写"""
+        self._wakeup.set()
+
+    def flush(self):
+        """将缓冲内容写入存储，由子类实现"""
+        raise NotImplementedError
+
+    def shutdown(self, timeout=5):
+        """停止后台线程并刷写剩余数据"""
+        if self._pid != os.getpid():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('%s 退出时刷写失败', self.thread_name)
+
+
+class VisitBuffer(BackgroundFlusher):
+    """
+    访问记录缓冲区
+    收集未保存的 VisitStatistics 实例，达到批量大小或时间间隔后通过 bulk_create 写入
+    """
+    thread_name = 'visit-buffer'
+
+    def __init__(self):
+        super().__init__(flush_interval=getattr(settings, 'VISIT_BUFFER_FLUSH_INTERVAL', 5))
+        self.enabled = getattr(settings, 'VISIT_BUFFER_ENABLED', True)
+        self.batch_size = getattr(settings, 'VISIT_BUFFER_BATCH_SIZE', 500)
+        self.full_policy = getattr(settings, 'VISIT_BUFFER_FULL_POLICY', 'drop')
+        self.block_timeout = getattr(settings, 'VISIT_BUFFER_BLOCK_TIMEOUT', 1)
+        self._queue = queue.Queue(maxsize=getattr(settings, 'VISIT_BUFFER_MAX_SIZE', 10000))
+        self._stats_lock = threading.Lock()
+        self._stats = {'buffered': 0, 'flushed': 0, 'dropped': 0, 'failed': 0}
+
+    def _incr(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def add(self, visit):
+        """
+        添加一条访问记录
+        缓冲区已满时按 VISIT_BUFFER_FULL_POLICY 丢弃或阻塞等待，返回是否成功入队
+        """
+        if not self.enabled:
+            self._write([visit])
+            return True
+
+        self._ensure_started()
+        try:
+            if self.full_policy == 'block':
+                self._queue.put(visit, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(visit)
+        except queue.Full:
+            self._incr('dropped')
+            return False
+
+        self._incr('buffered')
+        if self._queue.qsize() >= self.batch_size:
+            self.wakeup()
+        return True
+
+    def _drain(self):
+        """从队列中取出至多一个批次的记录"""
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """批量写入数据库，并更新每日独立访客草图"""
+        from .agents import assign_agents
+        from .models import VisitStatistics
+        from .visitors import record_visitors
+
+        try:
+            assign_agents(batch)
+            VisitStatistics.objects.bulk_create(batch, batch_size=self.batch_size)
+        except Exception:
+            self._incr('failed', len(batch))
+            logger.exception('批量写入访问统计失败，丢弃 %d 条记录', len(batch))
+            return
+        self._incr('flushed', len(batch))
+
+        try:
+            record_visitors(batch)
+        except Exception:
+            logger.exception('更新独立访客草图失败')
+
+    def flush(self):
+        """写出缓冲区中的全部记录"""
+        with self._flush_lock:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    break
+                self._write(batch)
+
+    def get_stats(self):
+        """获取缓冲区计数器"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+
+visit_buffer = VisitBuffer()
+
+
+class ViewCountBuffer(BackgroundFlusher):
+    """
+    文章浏览数写缓冲
+    在进程内累加每篇文章的增量，定期用 F('view_count') + n 批量写回；
+    增量相同的文章合并为一条 UPDATE。各 worker 进程只提交自己的增量，
+    数据库端做加法，多进程同时刷写也不会丢失计数
+    """
+    thread_name = 'view-count-buffer'
+
+    def __init__(self):
+        super().__init__(flush_interval=getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10))
+        self.enabled = getattr(settings, 'VIEW_COUNT_BUFFER_ENABLED', True)
+        self.max_pending = getattr(settings, 'VIEW_COUNT_MAX_PENDING', 1000)
+        self.merge_pending_on_read = getattr(settings, 'VIEW_COUNT_MERGE_PENDING', True)
+        self._pending = Counter()
+        # 正在写回的增量，写入提交前读取时仍需合并，避免计数短暂回退
+        self._inflight = Counter()
+        self._lock = threading.Lock()
+        self._stats = {'incremented': 0, 'flushed': 0, 'updates': 0, 'failed': 0}
+
+    def incr(self, post_id, amount=1):
+        """记录文章的浏览增量"""
+        if not self.enabled:
+            self._write({post_id: amount})
+            return
+
+        self._ensure_started()
+        with self._lock:
+            self._pending[post_id] += amount
+            self._stats['incremented'] += amount
+            pending_posts = len(self._pending)
+        if pending_posts >= self.max_pending:
+            self.wakeup()
+
+    def pending(self, post_id):
+        """本进程中尚未写回的增量"""
+        with self._lock:
+            return self._pending.get(post_id, 0) + self._inflight.get(post_id, 0)
+
+    def merge_pending(self, posts):
+        """
+        将本进程尚未写回的增量合并到文章实例的 view_count 上，便于页面立即看到最新计数
+        VIEW_COUNT_MERGE_PENDING 关闭时不做处理；其他进程的增量要等到它们刷写后才可见
+        """
+        if not self.merge_pending_on_read:
+            return posts
+        with self._lock:
+            if not self._pending and not self._inflight:
+                return posts
+            for post in posts:
+                post.view_count += self._pending.get(post.pk, 0) + self._inflight.get(post.pk, 0)
+        return posts
+
+    def _write(self, deltas):
+        """按增量分组批量更新，返回写回的浏览次数"""
+        from .models import Post
+
+        groups = defaultdict(list)
+        for post_id, delta in deltas.items():
+            groups[delta].append(post_id)
+
+        with transaction.atomic():
+            for delta, post_ids in groups.items():
+                Post.objects.filter(pk__in=post_ids).update(view_count=F('view_count') + delta)
+        with self._lock:
+            self._stats['updates'] += len(groups)
+            self._stats['flushed'] += sum(deltas.values())
+
+    def flush(self):
+        """写回全部增量，失败时放回缓冲区等待下次重试"""
+        with self._flush_lock:
+            with self._lock:
+                deltas, self._pending = self._pending, Counter()
+                self._inflight = deltas
+            if not deltas:
+                return
+            try:
+                self._write(deltas)
+            except Exception:
+                with self._lock:
+                    self._pending.update(deltas)
+                    self._stats['failed'] += 1
+                logger.exception('写回文章浏览数失败，%d 篇文章的增量将在下次重试', len(deltas))
+            finally:
+                with self._lock:
+                    self._inflight = Counter()
+
+    def get_stats(self):
+        """获取缓冲区计数器"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = sum(self._pending.values())
+        return stats
+
+
+view_count_buffer = ViewCountBuffer()
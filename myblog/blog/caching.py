@@ -0,0 +1,148 @@
+"""
+页面缓存
+为匿名用户缓存完整响应，为公共侧边栏缓存模板片段
+
+失效策略：所有缓存键都带有一个全局内容版本号，文章、评论、分类、标签
+发生变化时递增版本号（见 signals.py），旧版本的缓存自然过期，无需逐个删除
+
+防击穿：缓存条目带有逻辑过期时间，物理过期时间更长；
+过期或缺失时只有拿到重建锁的请求负责重新生成，其他请求返回旧值或短暂等待
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+from . import metrics
+
+VERSION_KEY = 'blog:content_version'
+
+
+def get_version(key=VERSION_KEY):
+    """当前版本号，key 默认为全局内容版本号，也可以是单个对象的版本号"""
+    version = cache.get(key)
+    if version is None:
+        # 用时间戳初始化，缓存被清空后也不会与旧版本号重复
+        cache.add(key, int(time.time()), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump_version(key=VERSION_KEY):
+    """递增版本号，默认使所有页面缓存和片段缓存失效"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_version(key)
+        cache.incr(key)
+
+
+def get_or_build(key, builder, timeout):
+    """
+    带防击穿保护的缓存读取
+    builder 返回 None 时表示结果不应缓存
+    """
+    stale_timeout = getattr(settings, 'PAGE_CACHE_STALE_TIMEOUT', 60)
+    lock_timeout = getattr(settings, 'PAGE_CACHE_LOCK_TIMEOUT', 10)
+    wait_timeout = getattr(settings, 'PAGE_CACHE_LOCK_WAIT', 2)
+
+    entry = cache.get(key)
+    now = time.time()
+    name = key.split(':', 1)[0]
+    if entry is not None and entry['fresh_until'] > now:
+        metrics.cache_requests.inc(cache=name, result='hit')
+        return entry['value']
+    metrics.cache_requests.inc(cache=name, result='miss' if entry is None else 'stale')
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = builder()
+            if value is not None:
+                cache.set(key, {'value': value, 'fresh_until': now + timeout},
+                          timeout + stale_timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    # 其他请求正在重建：有旧值先返回旧值，冷启动时短暂等待重建结果
+    if entry is not None:
+        return entry['value']
+    deadline = now + wait_timeout
+    while time.time() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry['value']
+    return builder()
+
+
+def _is_cacheable_request(request):
+    """只缓存匿名用户的 GET/HEAD 请求，且没有待显示的提示消息"""
+    if not getattr(settings, 'PAGE_CACHE_ENABLED', True):
+        return False
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    storage = getattr(request, '_messages', None)
+    # len() 不会把消息标记为已读
+    return storage is None or len(storage) == 0
+
+
+def _serialize_response(request, response):
+    """可缓存的响应转换为字典，不可缓存时返回 None"""
+    if response.status_code != 200 or response.streaming:
+        return None
+    # 响应中用到了 CSRF token 或设置了 Cookie，属于当前访客，不能共享
+    if request.META.get('CSRF_COOKIE_USED') or response.cookies:
+        return None
+    return {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+    }
+
+
+def cache_anonymous_page(timeout=None, on_hit=None):
+    """
+    视图装饰器：缓存匿名用户看到的完整响应
+    缓存键由内容版本号和完整路径（含查询参数）组成；
+    on_hit(request, *args, **kwargs) 在命中缓存时调用，用于保留浏览计数等副作用
+    """
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request):
+                return view_func(request, *args, **kwargs)
+
+            page_timeout = timeout or getattr(settings, 'PAGE_CACHE_TIMEOUT', 300)
+            path_hash = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+            key = f'page:{get_version()}:{view_func.__name__}:{path_hash}'
+
+            rendered = {}
+
+            def build():
+                response = view_func(request, *args, **kwargs)
+                rendered['response'] = response
+                if hasattr(response, 'render') and callable(response.render):
+                    response = response.render()
+                return _serialize_response(request, response)
+
+            cached = get_or_build(key, build, page_timeout)
+            if 'response' in rendered:
+                # 本次请求执行了视图，直接返回原始响应
+                return rendered['response']
+            if cached is None:
+                return view_func(request, *args, **kwargs)
+
+            if on_hit is not None:
+                on_hit(request, *args, **kwargs)
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+            response['X-Page-Cache'] = 'hit'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,163 @@
+"""
+聊天室消息存储后端
+通过 CHAT_BACKEND 配置选择实现：
+- DatabaseChatBackend：数据库存储，多个 worker 进程共享消息
+- MemoryChatBackend：进程内环形缓冲区，仅适合单进程开发环境
+"""
+
+import itertools
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+class BaseChatBackend:
+    """聊天存储后端基类"""
+
+    def __init__(self):
+        self.ttl = getattr(settings, 'CHAT_MESSAGE_TTL', 3600)
+        self.max_messages = getattr(settings, 'CHAT_MAX_MESSAGES', 60)
+
+    def cutoff(self):
+        """早于该时间的消息视为过期"""
+        return timezone.now() - timedelta(seconds=self.ttl)
+
+    def append(self, user, content):
+        """追加一条消息，返回序列化后的消息"""
+        raise NotImplementedError
+
+    def read(self, since_id=None, limit=50):
+        """
+        读取消息，返回 (按 ID 升序的消息列表, 之后是否还有更多消息)
+        since_id 为空时返回最新的 limit 条；否则返回 ID 大于 since_id 的最早 limit 条，
+        has_more 时客户端以最后一条的 ID 继续读取，不会跳过积压的消息
+        """
+        raise NotImplementedError
+
+    def latest_id(self):
+        """当前最新消息的 ID，没有消息时返回 0"""
+        raise NotImplementedError
+
+
+class MemoryChatBackend(BaseChatBackend):
+    """
+    进程内环形缓冲区
+    ID 单调递增，追加和过期清理都是 O(1) 均摊
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._messages = deque(maxlen=self.max_messages)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        cutoff = self.cutoff()
+        while self._messages and self._messages[0]['created_at'] < cutoff:
+            self._messages.popleft()
+
+    def append(self, user, content):
+        with self._lock:
+            self._expire()
+            now = timezone.now()
+            message = {
+                'id': next(self._ids),
+                'user_id': user.id,
+                'username': user.username,
+                'avatar': '',
+                'content': content,
+                'timestamp': now.isoformat(),
+                'created_at': now,
+            }
+            self._messages.append(message)
+        return self._serialize(message)
+
+    def read(self, since_id=None, limit=50):
+        cutoff = self.cutoff()
+        with self._lock:
+            messages = [
+                message for message in self._messages
+                if message['created_at'] >= cutoff and (since_id is None or message['id'] > since_id)
+            ]
+        if since_id is None:
+            return [self._serialize(message) for message in messages[-limit:]], False
+        return [self._serialize(message) for message in messages[:limit]], len(messages) > limit
+
+    def latest_id(self):
+        with self._lock:
+            return self._messages[-1]['id'] if self._messages else 0
+
+    @staticmethod
+    def _serialize(message):
+        return {key: value for key, value in message.items() if key != 'created_at'}
+
+
+class DatabaseChatBackend(BaseChatBackend):
+    """
+    数据库存储
+    自增主键保证 ID 单调且不会复用；过期清理在写入时按间隔执行一次，读取时只按时间过滤
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.expire_interval = getattr(settings, 'CHAT_EXPIRE_INTERVAL', 60)
+        self._last_expire = 0.0
+
+    def _maybe_expire(self, latest_id):
+        """删除过期消息和超出数量上限的消息"""
+        from .models import ChatMessage
+
+        now = time.monotonic()
+        if self._last_expire and now - self._last_expire < self.expire_interval:
+            return
+        self._last_expire = now
+
+        ChatMessage.objects.filter(created_at__lt=self.cutoff()).delete()
+        ChatMessage.objects.filter(id__lte=latest_id - self.max_messages).delete()
+
+    def append(self, user, content):
+        from .models import ChatMessage
+
+        message = ChatMessage.objects.create(user=user, username=user.username, content=content)
+        self._maybe_expire(message.id)
+        return message.to_dict()
+
+    def read(self, since_id=None, limit=50):
+        from .models import ChatMessage
+
+        limit = min(limit, self.max_messages)
+        queryset = ChatMessage.objects.filter(created_at__gte=self.cutoff())
+        if since_id is None:
+            messages = list(queryset.order_by('-id')[:limit])
+            messages.reverse()
+            return [message.to_dict() for message in messages], False
+
+        messages = list(queryset.filter(id__gt=since_id).order_by('id')[:limit + 1])
+        return [message.to_dict() for message in messages[:limit]], len(messages) > limit
+
+    def latest_id(self):
+        from .models import ChatMessage
+
+        return ChatMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_chat_backend():
+    """获取当前配置的聊天后端（进程内单例）"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend_class = import_string(
+                    getattr(settings, 'CHAT_BACKEND', 'blog.chat_backends.DatabaseChatBackend')
+                )
+                _backend = backend_class()
+    return _backend
@@ -0,0 +1,73 @@
+"""
+评论树
+一条查询按 (thread_id, path) 读出文章的全部评论（先序遍历顺序），在 Python 中 O(n) 组装成树，
+按顶层评论（楼层）分页
+
+整棵树以字典列表的形式按文章缓存，缓存键带有文章自己的评论版本号；
+评论新增、修改或删除的事务提交后递增版本号（见 signals.py），不影响其他文章的缓存
+"""
+
+from django.conf import settings
+from django.core.paginator import Paginator
+
+from . import caching
+from .models import Comment
+
+FIELDS = ('id', 'parent_id', 'thread_id', 'depth', 'content', 'created_at',
+          'author_id', 'author__username')
+
+
+def version_key(post_id):
+    return f'blog:comments_version:{post_id}'
+
+
+def invalidate(post_id):
+    """文章的评论发生变化，使其评论树缓存失效"""
+    caching.bump_version(version_key(post_id))
+
+
+def load_comments(post_id):
+    """一条查询读出文章的全部显示中的评论，按楼层倒序、楼层内按先序遍历排列"""
+    return list(
+        Comment.objects.filter(post_id=post_id, is_active=True)
+        .order_by('-thread_id', 'path')
+        .values(*FIELDS)
+    )
+
+
+def get_comments(post_id):
+    """文章的评论（扁平列表，带缓存）"""
+    key = f'comments:{post_id}:{caching.get_version(version_key(post_id))}'
+    return caching.get_or_build(
+        key, lambda: load_comments(post_id), getattr(settings, 'COMMENT_CACHE_TIMEOUT', 600)
+    )
+
+
+def build_tree(rows):
+    """
+    将先序排列的评论组装成树，返回顶层评论列表
+    每条评论增加 replies 列表；父评论被隐藏的回复连同其子树一起隐藏
+    """
+    nodes = {}
+    roots = []
+    for row in rows:
+        node = dict(row, replies=[])
+        node['author_username'] = node.pop('author__username')
+        if row['parent_id'] is None:
+            roots.append(node)
+        elif row['parent_id'] in nodes:
+            nodes[row['parent_id']]['replies'].append(node)
+        else:
+            continue
+        nodes[row['id']] = node
+    return roots, len(nodes)
+
+
+def get_comment_page(post_id, page_number=None):
+    """
+    按楼层分页的评论树，返回 (page_obj, 评论总数)
+    page_obj 的每一项是一个顶层评论，回复在 replies 中
+    """
+    roots, total = build_tree(get_comments(post_id))
+    per_page = getattr(settings, 'COMMENT_THREADS_PER_PAGE', 20)
+    return Paginator(roots, per_page).get_page(page_number), total
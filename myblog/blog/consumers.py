@@ -0,0 +1,148 @@
+"""
+WebSocket 消费者
+公共聊天室和私聊的实时推送，消息存储仍复用 HTTP 接口的后端和模型
+"""
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth.models import User
+
+from . import realtime
+from .chat_backends import get_chat_backend
+from .models import PrivateChatSession
+
+MAX_PRIVATE_MESSAGE_LENGTH = 1000
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    公共聊天室
+    客户端发送 {"message": "..."}，服务端推送 {"type": "message", "message": {...}}
+    """
+
+    async def connect(self):
+        await self.channel_layer.group_add(realtime.PUBLIC_CHAT_GROUP, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(realtime.PUBLIC_CHAT_GROUP, self.channel_name)
+
+    async def receive_json(self, content, **kwargs):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            await self.send_json({'type': 'error', 'error': '请先登录'})
+            return
+
+        message_content = str(content.get('message', '')).strip()
+        if not message_content:
+            await self.send_json({'type': 'error', 'error': '消息内容不能为空'})
+            return
+
+        await database_sync_to_async(self.save_message)(user, message_content)
+
+    def save_message(self, user, content):
+        message = get_chat_backend().append(user, content)
+        realtime.notify_chat_message(message)
+        return message
+
+    async def chat_message(self, event):
+        await self.send_json({'type': 'message', 'message': event['message']})
+
+
+class PrivateChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    私聊会话
+    客户端发送 {"type": "send", "content": "..."} 或 {"type": "read"}；
+    服务端推送 message / read_receipt / unread_count 事件
+    """
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.session = await database_sync_to_async(self.get_session)(
+            self.scope['url_route']['kwargs']['user_id']
+        )
+        if self.session is None:
+            await self.close()
+            return
+
+        self.groups_joined = [
+            realtime.private_session_group(self.session.id),
+            realtime.private_user_group(self.user.id),
+        ]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        for group in getattr(self, 'groups_joined', []):
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    def get_session(self, other_user_id):
+        other_user = User.objects.filter(pk=other_user_id).first()
+        if other_user is None or other_user == self.user:
+            return None
+        self.other_user = other_user
+        session, _ = PrivateChatSession.get_or_create_between(self.user, other_user)
+        return session
+
+    async def receive_json(self, content, **kwargs):
+        action = content.get('type')
+        if action == 'send':
+            text = str(content.get('content', '')).strip()
+            if not text:
+                await self.send_json({'type': 'error', 'error': '消息内容不能为空'})
+            elif len(text) > MAX_PRIVATE_MESSAGE_LENGTH:
+                await self.send_json({'type': 'error', 'error': '消息内容过长'})
+            else:
+                await database_sync_to_async(self.save_message)(text)
+        elif action == 'read':
+            await database_sync_to_async(self.mark_read)()
+
+    def save_message(self, content):
+        message = self.session.send_message(self.user, content)
+        realtime.notify_private_message(message)
+
+    def mark_read(self):
+        if self.session.mark_read(self.user):
+            realtime.notify_messages_read(self.session, self.user)
+
+    async def private_message(self, event):
+        message = dict(event['message'])
+        message['is_own'] = message['sender_id'] == self.user.id
+        await self.send_json({'type': 'message', 'message': message})
+
+    async def read_receipt(self, event):
+        await self.send_json({
+            'type': 'read_receipt',
+            'reader_id': event['reader_id'],
+            'last_read_id': event['last_read_id'],
+        })
+
+    async def unread_count(self, event):
+        await self.send_json({'type': 'unread_count', 'total_unread': event['total_unread']})
+
+
+class NotificationConsumer(AsyncJsonWebsocketConsumer):
+    """用户个人通知：导航栏的私聊未读数"""
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        self.group_name = realtime.private_user_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        total_unread = await database_sync_to_async(realtime.unread_count_for)(self.user.id)
+        await self.send_json({'type': 'unread_count', 'total_unread': total_unread})
+
+    async def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def unread_count(self, event):
+        await self.send_json({'type': 'unread_count', 'total_unread': event['total_unread']})
@@ -1,5 +1,11 @@
 from datetime import datetime
 
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from . import caching, realtime
+from .sidebar import get_sidebar_data
+
 
 def static_template_context(request):
     """
@@ -11,4 +17,25 @@ def static_template_context(request):
         'site_name': '我的博客',
         'current_year': year_str1,
         'STATIC_URL': '/static/',  # 确保静态模板中能正确引用静态文件
-    }
\ No newline at end of file
+    }
+
+
+def sidebar(request):
+    """
+    侧边栏公共数据
+    数据在模板首次访问时才读取（缓存读取），侧边栏片段缓存命中时完全不会读取
+    """
+    return {
+        'sidebar': SimpleLazyObject(get_sidebar_data),
+        # 传入函数，模板只在渲染缓存片段时才读取版本号
+        'cache_version': caching.get_version,
+        'sidebar_cache_timeout': getattr(settings, 'SIDEBAR_CACHE_TIMEOUT', 600),
+    }
+
+
+def websocket(request):
+    """
+    是否启用 WebSocket
+    为 False 时页面脚本直接使用 HTTP 轮询，不再尝试连接 /ws/
+    """
+    return {'websocket_enabled': realtime.channels_enabled()}
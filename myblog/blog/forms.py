@@ -61,21 +61,30 @@ class PostForm(forms.ModelForm):
         }
 
 class CommentForm(forms.ModelForm):
-    """评论表单"""
+    """评论表单，parent 为空时发表顶层评论，否则回复该评论"""
     class Meta:
         model = Comment
-        fields = ['content']
+        fields = ['content', 'parent']
         widgets = {
             'content': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 3,
                 'placeholder': '写下你的评论...'
             }),
+            'parent': forms.HiddenInput(),
         }
         labels = {
             'content': '评论',
         }
 
+    def __init__(self, *args, post=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 只能回复同一篇文章下显示中的评论
+        queryset = Comment.objects.filter(is_active=True)
+        if post is not None:
+            queryset = queryset.filter(post=post)
+        self.fields['parent'].queryset = queryset
+
 class CategoryForm(forms.ModelForm):
     """分类表单"""
     class Meta:
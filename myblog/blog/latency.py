@@ -0,0 +1,239 @@
+"""
+路由响应时间统计
+访问统计中间件把每个请求的耗时按解析后的 URL 名称（而不是原始路径）记入固定桶直方图，
+直方图在进程内累加，由后台线程按 LATENCY_PERIOD 秒的时间段合并进 RouteLatency 表
+
+桶边界固定，直方图之间直接按桶相加即可合并（跨 worker、跨时间段），
+查询任意时间窗口时合并对应时间段，再从合并后的直方图估算 p50/p95/p99
+"""
+
+import bisect
+import logging
+import struct
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .buffers import BackgroundFlusher
+from .models import RouteLatency
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+
+UNRESOLVED_ROUTE = '<unresolved>'
+
+# 桶上界（毫秒），最后一个桶收集超过 10 秒的请求
+BUCKET_BOUNDS = (5, 10, 25, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 1500, 2500, 5000, 10000)
+
+# 面板可选的统计窗口
+WINDOWS = {
+    '1h': timedelta(hours=1),
+    '6h': timedelta(hours=6),
+    '24h': timedelta(days=1),
+    '7d': timedelta(days=7),
+}
+DEFAULT_WINDOW = '1h'
+
+
+class LatencyHistogram:
+    """固定桶的响应时间直方图"""
+
+    def __init__(self, counts=None):
+        size = len(BUCKET_BOUNDS) + 1
+        if counts is None:
+            counts = [0] * size
+        elif len(counts) != size:
+            raise ValueError('桶数量与桶边界不匹配')
+        self.counts = list(counts)
+
+    def add(self, milliseconds, count=1):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, milliseconds)] += count
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, q):
+        """估算第 q 分位数（0 < q <= 1），在命中的桶内按线性插值；超出最大边界时返回最大边界"""
+        total = self.count()
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if index == len(BUCKET_BOUNDS):
+                    return float(BUCKET_BOUNDS[-1])
+                lower = BUCKET_BOUNDS[index - 1] if index else 0
+                upper = BUCKET_BOUNDS[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return float(BUCKET_BOUNDS[-1])
+
+    def to_bytes(self):
+        return struct.pack(f'>{len(self.counts)}Q', *self.counts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        return cls(struct.unpack(f'>{len(data) // 8}Q', data))
+
+
+def route_name(request):
+    """
+    请求解析后的 URL 名称（带命名空间，未命名的路由为视图函数路径），
+    未匹配任何路由时返回 UNRESOLVED_ROUTE，避免按原始路径产生无限多的键
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED_ROUTE
+    return match.view_name
+
+
+def period_start(moment=None):
+    """时间所在时间段的起点"""
+    period = getattr(settings, 'LATENCY_PERIOD', 300)
+    timestamp = (moment or timezone.now()).timestamp()
+    return datetime.fromtimestamp(timestamp - timestamp % period, tz=dt_timezone.utc)
+
+
+class LatencyRecorder(BackgroundFlusher):
+    """
+    在进程内累加各路由的直方图，后台线程定期合并进数据库
+    合并使用版本号做乐观并发控制，多个 worker 同时写同一时间段时冲突重试
+    """
+    thread_name = 'latency-recorder'
+
+    def __init__(self):
+        super().__init__(flush_interval=getattr(settings, 'LATENCY_FLUSH_INTERVAL', 10))
+        self.enabled = getattr(settings, 'LATENCY_ENABLED', True)
+        self._lock = threading.Lock()
+        self._pending = self._new_pending()
+        self._stats = {'recorded': 0, 'flushed': 0, 'failed': 0}
+
+    @staticmethod
+    def _new_pending():
+        return defaultdict(lambda: [LatencyHistogram(), 0, 0.0])
+
+    def record(self, route, seconds, status_code):
+        """记录一个请求的耗时"""
+        if not self.enabled:
+            return
+        milliseconds = seconds * 1000
+        key = (route[:200], period_start())
+        self._ensure_started()
+        with self._lock:
+            entry = self._pending[key]
+            entry[0].add(milliseconds)
+            if status_code >= 500:
+                entry[1] += 1
+            entry[2] += milliseconds
+            self._stats['recorded'] += 1
+
+    def _merge(self, route, period, histogram, errors, total_ms):
+        for _ in range(MAX_RETRIES):
+            row = RouteLatency.objects.filter(route=route, period=period)\
+                .values_list('histogram', 'version').first()
+            if row is None:
+                try:
+                    with transaction.atomic():
+                        RouteLatency.objects.create(
+                            route=route, period=period, request_count=histogram.count(),
+                            error_count=errors, total_ms=total_ms, histogram=histogram.to_bytes(),
+                        )
+                    return
+                except IntegrityError:
+                    continue
+
+            stored, version = row
+            merged = LatencyHistogram.from_bytes(stored)
+            merged.merge(histogram)
+            updated = RouteLatency.objects.filter(route=route, period=period, version=version).update(
+                histogram=merged.to_bytes(), request_count=merged.count(),
+                error_count=F('error_count') + errors, total_ms=F('total_ms') + total_ms,
+                version=version + 1,
+            )
+            if updated:
+                return
+        raise RuntimeError(f'合并 {route} 的响应时间失败：并发冲突过多')
+
+    def flush(self):
+        """合并全部待写入的直方图，失败的时间段放回缓冲区等待下次重试"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, self._new_pending()
+            failed = {}
+            for (route, period), (histogram, errors, total_ms) in pending.items():
+                try:
+                    self._merge(route, period, histogram, errors, total_ms)
+                except Exception:
+                    logger.exception('写入 %s 的响应时间失败', route)
+                    failed[(route, period)] = (histogram, errors, total_ms)
+            with self._lock:
+                for key, (histogram, errors, total_ms) in failed.items():
+                    entry = self._pending[key]
+                    entry[0].merge(histogram)
+                    entry[1] += errors
+                    entry[2] += total_ms
+                self._stats['flushed'] += sum(entry[0].count() for key, entry in pending.items() if key not in failed)
+                self._stats['failed'] += len(failed)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = sum(entry[0].count() for entry in self._pending.values())
+        return stats
+
+
+latency_recorder = LatencyRecorder()
+
+
+def summarize(window=DEFAULT_WINDOW):
+    """
+    合并时间窗口内各路由的直方图
+    返回按 p95 倒序排列的 [{route, count, errors, mean, p50, p95, p99}]，耗时单位为毫秒
+    """
+    since = period_start(timezone.now() - WINDOWS[window])
+    merged = defaultdict(lambda: [LatencyHistogram(), 0, 0.0])
+    rows = RouteLatency.objects.filter(period__gte=since)\
+        .values_list('route', 'histogram', 'error_count', 'total_ms').iterator()
+    for route, histogram, errors, total_ms in rows:
+        entry = merged[route]
+        entry[0].merge(LatencyHistogram.from_bytes(histogram))
+        entry[1] += errors
+        entry[2] += total_ms
+
+    result = []
+    for route, (histogram, errors, total_ms) in merged.items():
+        count = histogram.count()
+        if not count:
+            continue
+        result.append({
+            'route': route,
+            'count': count,
+            'errors': errors,
+            'mean': round(total_ms / count, 1),
+            'p50': round(histogram.percentile(0.5), 1),
+            'p95': round(histogram.percentile(0.95), 1),
+            'p99': round(histogram.percentile(0.99), 1),
+        })
+    result.sort(key=lambda item: item['p95'], reverse=True)
+    return result
+
+
+def prune(days=None):
+    """删除超出保留期的响应时间记录，返回删除的行数"""
+    days = getattr(settings, 'LATENCY_RETENTION_DAYS', 7) if days is None else days
+    if not days:
+        return 0
+    count, _ = RouteLatency.objects.filter(period__lt=timezone.now() - timedelta(days=days)).delete()
+    return count
@@ -0,0 +1,37 @@
+"""
+管理命令：回填访问记录的用户代理外键
+从旧版表结构升级时使用，顺序为：
+1. 在访问记录表上添加可为空的 agent_id 列（以及 blog_useragent 表）
+2. 执行本命令，把 user_agent 列中的字符串写入维度表并填入 agent_id
+3. 确认无误后删除 user_agent 列（可以加 --drop-column 由本命令完成）
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ...agents import LEGACY_COLUMN, has_legacy_column, intern_legacy_user_agents
+from ...models import VisitStatistics
+
+
+class Command(BaseCommand):
+    help = '把访问记录中旧版 user_agent 列的字符串写入用户代理维度表，并回填 agent 外键'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批处理的访问记录数')
+        parser.add_argument('--drop-column', action='store_true',
+                            help='回填完成后删除旧的 user_agent 列')
+
+    def handle(self, *args, **options):
+        if not has_legacy_column():
+            raise CommandError(f'访问记录表上没有 {LEGACY_COLUMN} 列，无需回填')
+
+        updated = intern_legacy_user_agents(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已回填 {updated} 条访问记录的用户代理'))
+
+        if options['drop_column']:
+            quote = connection.ops.quote_name
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'ALTER TABLE {quote(VisitStatistics._meta.db_table)} DROP COLUMN {quote(LEGACY_COLUMN)}'
+                )
+            self.stdout.write(self.style.SUCCESS(f'已删除 {LEGACY_COLUMN} 列'))
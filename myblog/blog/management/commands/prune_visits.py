@@ -0,0 +1,52 @@
+"""
+管理命令：清理过期的访问记录
+建议通过定时任务每天执行一次；只删除已经汇总过的记录，应在 update_visit_rollups 之后执行
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import retention
+
+
+class Command(BaseCommand):
+    help = '分批删除超出保留期的访问记录、小时汇总和响应时间记录和慢请求日志，可选先导出访问记录为 CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='每批删除的记录数')
+        parser.add_argument('--days', type=int, default=None,
+                            help='保留天数，默认使用 VISIT_RETENTION_DAYS')
+        parser.add_argument('--archive-dir', default=None,
+                            help='删除前导出 gzip CSV 的目录，默认使用 VISIT_ARCHIVE_DIR')
+        parser.add_argument('--sleep', type=float, default=0, help='每批之间暂停的秒数')
+        parser.add_argument('--dry-run', action='store_true', help='只统计将要删除的记录数')
+        parser.add_argument('--convert-to-partitions', action='store_true',
+                            help='把访问记录表转换为按月分区的表（仅 PostgreSQL，会短暂锁表）')
+
+    def handle(self, *args, **options):
+        if options['convert_to_partitions']:
+            partitions = retention.PostgresPartitions()
+            if not partitions.available():
+                raise CommandError('只有 PostgreSQL 支持分区表')
+            if partitions.convert():
+                self.stdout.write(self.style.SUCCESS('访问记录表已转换为按月分区的表'))
+            else:
+                self.stdout.write('访问记录表已经是分区表')
+
+        archive_dir = options['archive_dir']
+        if archive_dir is None:
+            archive_dir = getattr(settings, 'VISIT_ARCHIVE_DIR', '') or None
+        result = retention.run(
+            batch_size=options['batch_size'],
+            archive_dir=archive_dir,
+            sleep=options['sleep'],
+            dry_run=options['dry_run'],
+            days=options['days'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f"将删除 {result['visits']} 条访问记录")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"已删除 {result['visits']} 条访问记录、{result['hourly_rollups']} 条小时汇总、"
+                f"{result['latency']} 条响应时间记录、{result['slow_requests']} 条慢请求日志"
+            ))
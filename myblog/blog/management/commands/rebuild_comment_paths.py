@@ -0,0 +1,19 @@
+"""
+管理命令：重新计算评论的物化路径
+用于回填历史评论，或在批量导入（绕过 Comment.save）之后修正评论树
+"""
+
+from django.core.management.base import BaseCommand
+
+from ... import comments
+from ...models import Comment
+
+
+class Command(BaseCommand):
+    help = '重新计算所有评论的楼层、层级和路径'
+
+    def handle(self, *args, **options):
+        count = Comment.rebuild_paths()
+        for post_id in Comment.objects.values_list('post_id', flat=True).distinct():
+            comments.invalidate(post_id)
+        self.stdout.write(self.style.SUCCESS(f'已更新 {count} 条评论的路径'))
@@ -0,0 +1,19 @@
+"""
+管理命令：重新计算私聊会话上的冗余字段
+用于回填历史数据（最后消息、预览、未读计数、已读水位线），或在计数出现偏差时修正
+"""
+
+from django.core.management.base import BaseCommand
+
+from ...models import PrivateChatSession
+
+
+class Command(BaseCommand):
+    help = '根据消息表重新计算私聊会话的最后消息和未读计数'
+
+    def handle(self, *args, **options):
+        count = 0
+        for session in PrivateChatSession.objects.select_related('user1', 'user2').iterator():
+            session.refresh_counters()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'已更新 {count} 个会话'))
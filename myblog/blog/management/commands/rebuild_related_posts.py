@@ -0,0 +1,17 @@
+"""
+管理命令：重新计算全部文章的相关文章
+首次部署、批量导入文章或调整 RELATED_POSTS_* 权重后执行；
+开启内容相似度时同时更新增量刷新所需的文档频率
+"""
+
+from django.core.management.base import BaseCommand
+
+from ... import related
+
+
+class Command(BaseCommand):
+    help = '按标签、分类（和内容相似度）重新计算全部文章的相关文章'
+
+    def handle(self, *args, **options):
+        count = related.rebuild_all()
+        self.stdout.write(self.style.SUCCESS(f'已更新 {count} 篇文章的相关文章'))
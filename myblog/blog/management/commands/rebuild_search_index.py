@@ -0,0 +1,22 @@
+"""
+管理命令：重建文章全文索引
+首次部署、切换数据库或修改分词规则后执行
+"""
+
+from django.core.management.base import BaseCommand
+
+from ...search import get_backend, rebuild_index
+
+
+class Command(BaseCommand):
+    help = '删除并重建全部文章的全文索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='每批读取的文章数')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        count = rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'已使用 {backend.__class__.__name__} 为 {count} 篇文章建立索引'
+        ))
@@ -0,0 +1,19 @@
+"""
+管理命令：重新解析用户代理维度表
+修改 blog/agents.py 中的分类规则后执行；汇总表中的浏览器分类需要再执行 update_visit_rollups --rebuild 才会更新
+"""
+
+from django.core.management.base import BaseCommand
+
+from ...agents import reclassify
+
+
+class Command(BaseCommand):
+    help = '按当前规则重新计算每个用户代理的浏览器、操作系统、设备和爬虫分类'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每批更新的行数')
+
+    def handle(self, *args, **options):
+        updated = reclassify(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'已更新 {updated} 个用户代理的分类'))
@@ -0,0 +1,19 @@
+"""
+管理命令：重新统计分类和标签的已发布文章数
+用于回填历史数据，或在批量导入（绕过信号）之后修正计数
+"""
+
+from django.core.management.base import BaseCommand
+
+from ... import caching
+from ...models import Category, Tag
+
+
+class Command(BaseCommand):
+    help = '重新统计所有分类和标签的已发布文章数'
+
+    def handle(self, *args, **options):
+        Category.refresh_post_counts()
+        Tag.refresh_post_counts()
+        caching.bump_version()
+        self.stdout.write(self.style.SUCCESS('分类和标签的文章数已更新'))
@@ -0,0 +1,29 @@
+"""
+管理命令：增量汇总访问统计
+建议通过定时任务定期执行，例如每分钟一次
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...rollups import history_pruned, update_rollups, rebuild_rollups
+from ...visitors import rebuild_visitor_sketches
+
+
+class Command(BaseCommand):
+    help = '将新的访问记录增量汇总到小时表和日表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='每批处理的访问记录数')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='清空汇总表和独立访客草图后从头重新汇总（访问记录清理过之后不可用）')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['rebuild']:
+            if history_pruned():
+                raise CommandError('访问记录已经清理过，重建会丢失清理前的汇总和独立访客统计，已取消')
+            processed = rebuild_rollups(batch_size=batch_size)
+            rebuild_visitor_sketches(batch_size=batch_size)
+        else:
+            processed = update_rollups(batch_size=batch_size)
+        self.stdout.write(self.style.SUCCESS(f'已汇总 {processed} 条访问记录'))
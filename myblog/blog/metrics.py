@@ -0,0 +1,301 @@
+"""
+运行时指标
+进程内的指标注册表（计数器、仪表、直方图），以 Prometheus 文本格式从 /metrics 导出
+
+多个 worker 进程时使用文件后端（METRICS_BACKEND = 'file'）：
+每个进程由后台线程定期把自己的指标快照写入 METRICS_DIR/metrics_<pid>.json，
+导出时合并目录中的全部快照——计数器和直方图按进程相加（已退出进程的计数保留），
+仪表只累加仍在运行的进程。METRICS_DIR 应在每次部署（重启全部 worker）时清空
+"""
+
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+
+from .buffers import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metric:
+    """指标基类，值按标签取值的元组分别保存"""
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 的标签必须是 {self.labelnames}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self.registry.lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.touch()
+
+
+class Gauge(Metric):
+    """可增可减的当前值，多进程时累加仍在运行的进程"""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = value
+        self.registry.touch()
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        self.registry.touch()
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """固定桶直方图，值为 [各桶计数..., 总和]（桶计数不累积，导出时再累积）"""
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            entry[index] += 1
+            entry[-1] += value
+        self.registry.touch()
+
+
+class Registry:
+    """指标注册表，同名指标只注册一次"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._metrics = {}
+        self._writer = None
+        self._backend_checked = False
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        with self.lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(self, name, documentation, labelnames, **kwargs)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    @property
+    def writer(self):
+        """文件后端的快照写入器，内存后端时为 None"""
+        if not self._backend_checked:
+            if getattr(settings, 'METRICS_BACKEND', 'memory') == 'file':
+                self._writer = SnapshotWriter(self, settings.METRICS_DIR)
+            self._backend_checked = True
+        return self._writer
+
+    def reset(self):
+        """清空本进程的指标值（fork 出的子进程不继承父进程的计数，避免与父进程的快照重复累加）"""
+        # fork 时其他线程可能正持有锁，子进程中重新创建
+        self.lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._values = {}
+
+    def touch(self):
+        """指标有更新：文件后端按需启动后台写入线程"""
+        if self.writer is not None:
+            self.writer._ensure_started()
+
+    def snapshot(self):
+        """本进程全部指标的可序列化快照"""
+        with self.lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def collect(self):
+        """
+        合并后的指标值 {name: {标签元组: 值}}
+        文件后端先写出本进程的最新快照，再合并目录中所有进程的快照
+        """
+        if self.writer is None:
+            snapshots = [(True, self.snapshot())]
+        else:
+            self.writer.flush()
+            snapshots = self.writer.read_all()
+
+        with self.lock:
+            metrics = dict(self._metrics)
+        merged = {name: {} for name in metrics}
+        for alive, snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric = metrics.get(name)
+                if metric is None or (metric.type == 'gauge' and not alive):
+                    continue
+                target = merged[name]
+                for key, value in values:
+                    key = tuple(key)
+                    if metric.type == 'histogram':
+                        current = target.get(key)
+                        if current is None or len(current) != len(value):
+                            target[key] = list(value)
+                        else:
+                            target[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        target[key] = target.get(key, 0) + value
+        return metrics, merged
+
+    def render(self):
+        """Prometheus 文本格式"""
+        metrics, merged = self.collect()
+        lines = []
+        for name in sorted(metrics):
+            metric = metrics[name]
+            lines.append(f'# HELP {name} {_escape_help(metric.documentation)}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            values = merged[name]
+            if not values and not metric.labelnames and metric.type != 'histogram':
+                values = {(): 0}
+            for key, value in sorted(values.items()):
+                labels = list(zip(metric.labelnames, key))
+                if metric.type != 'histogram':
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _format_value(bound)
+                    lines.append(f'{name}_bucket{_format_labels(labels + [("le", le)])} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(value[-1])}')
+                lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SnapshotWriter(BackgroundFlusher):
+    """文件后端：定期把本进程的指标快照原子地写入 METRICS_DIR"""
+    thread_name = 'metrics-writer'
+
+    def __init__(self, registry, directory):
+        super().__init__(flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 5))
+        self.registry = registry
+        self.directory = directory
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'metrics_{pid}.json')
+
+    def flush(self):
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(os.getpid())
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as output:
+                json.dump(self.registry.snapshot(), output)
+            os.replace(temp_path, path)
+
+    def read_all(self):
+        """[(进程是否仍在运行, 快照)]"""
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.json')):
+            try:
+                pid = int(os.path.basename(path)[len('metrics_'):-len('.json')])
+                with open(path, encoding='utf-8') as source:
+                    snapshots.append((_pid_alive(pid), json.load(source)))
+            except (OSError, ValueError):
+                logger.warning('读取指标快照失败: %s', path, exc_info=True)
+        return snapshots
+
+
+registry = Registry()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=registry.reset)
+
+# 请求
+http_requests = registry.counter(
+    'blog_http_requests_total', '按视图、请求方法和状态码统计的请求数', ('view', 'method', 'status'))
+http_request_duration = registry.histogram(
+    'blog_http_request_duration_seconds', '请求耗时（秒）', ('view',))
+db_queries = registry.counter(
+    'blog_db_queries_total', '按视图统计的数据库查询次数', ('view',))
+db_query_duration = registry.counter(
+    'blog_db_query_duration_seconds_total', '按视图统计的数据库查询总耗时（秒）', ('view',))
+
+# 缓存（按缓存键前缀区分：page、sidebar、comments 等）
+cache_requests = registry.counter(
+    'blog_cache_requests_total', '缓存读取次数，result 为 hit / stale / miss', ('cache', 'result'))
+
+# 聊天
+chat_messages = registry.counter(
+    'blog_chat_messages_total', '发送的聊天消息数，kind 为 public / private', ('kind',))
+active_polls = registry.gauge(
+    'blog_private_chat_active_polls', '正在等待的私聊长轮询请求数')
+
+# 天气接口
+weather_fetches = registry.counter(
+    'blog_weather_fetches_total', '天气接口请求次数，result 为 success / failure', ('result',))
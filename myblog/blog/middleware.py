@@ -1,72 +1,133 @@
 """
 自定义中间件
-包含访问统计中间件
+包含访问统计中间件和运行时指标中间件
 """
 
+import logging
 import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
+from . import metrics
+from .buffers import visit_buffer
+from .latency import latency_recorder, route_name
 from .models import VisitStatistics
 from .utils import get_client_ip
 
+logger = logging.getLogger(__name__)
+
 class VisitStatisticsMiddleware(MiddlewareMixin):
     """
     访问统计中间件
-    记录每个请求的访问信息
+    记录每个请求的访问信息，写入由后台缓冲区批量完成；
+    同时按路由记录响应时间（包括 API 请求），见 latency.py
     """
 
+    def record_visit(self, request, status_code):
+        """构造访问记录并放入缓冲区"""
+        ip_address = get_client_ip(request)
+        user_agent = request.META.get('HTTP_USER_AGENT', '')
+
+        visit = VisitStatistics(
+            ip_address=ip_address,
+            path=request.path[:500],
+            method=request.method,
+            status_code=status_code,
+            visit_time=timezone.now(),
+        )
+        # 写入前由缓冲区统一换成用户代理维度表的外键
+        visit.raw_user_agent = user_agent[:500]  # 限制长度
+        visit_buffer.add(visit)
+
     def process_request(self, request):
         """在请求开始时记录时间"""
         request.start_time = time.time()
 
     def process_response(self, request, response):
         """在响应时记录访问统计"""
-        # 排除管理后台和静态文件
-        if request.path.startswith('/admin/') or request.path.startswith('/static/'):
-            return response
-
-        # 排除API请求（可选）
-        if request.path.startswith('/api/'):
+        # 排除静态文件和指标抓取（抓取很频繁，不计入访问记录和响应时间）
+        if request.path.startswith('/static/') or request.path == '/metrics':
             return response
 
         try:
-            # 计算响应时间
-            response_time = 0
+            # 计算响应时间，按路由计入直方图
             if hasattr(request, 'start_time'):
                 response_time = time.time() - request.start_time
+                latency_recorder.record(route_name(request), response_time, response.status_code)
+        except Exception:
+            logger.exception('记录响应时间失败')
 
-            # 获取客户端信息
-            ip_address = get_client_ip(request)
-            user_agent = request.META.get('HTTP_USER_AGENT', '')
+        # 排除管理后台
+        if request.path.startswith('/admin/'):
+            return response
 
+        # 排除API请求（可选）
+        if request.path.startswith('/api/'):
+            return response
+
+        try:
             # 记录访问统计
-            VisitStatistics.objects.create(
-                ip_address=ip_address,
-                user_agent=user_agent[:500],  # 限制长度
-                path=request.path[:500],
-                method=request.method,
-                status_code=response.status_code,
-            )
-
-        except Exception as e:
+            self.record_visit(request, response.status_code)
+
+        except Exception:
             # 记录日志但不影响正常请求
-            print(f"记录访问统计失败: {e}")
+            logger.exception('记录访问统计失败')
 
         return response
 
     def process_exception(self, request, exception):
         """处理异常请求"""
         try:
-            ip_address = get_client_ip(request)
-            user_agent = request.META.get('HTTP_USER_AGENT', '')
-
-            VisitStatistics.objects.create(
-                ip_address=ip_address,
-                user_agent=user_agent[:500],
-                path=request.path[:500],
-                method=request.method,
-                status_code=500,  # 服务器错误
-            )
-        except:
-            pass
+            self.record_visit(request, 500)  # 服务器错误
+        except Exception:
+            logger.exception('记录访问统计失败')
 
         return None
+
+
+class _QueryCounter:
+    """数据库 execute_wrapper：累计一个请求的查询次数和耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    运行时指标中间件（METRICS_ENABLED 关闭时不加载）
+    按解析后的 URL 名称统计请求数、耗时、数据库查询次数和查询耗时，见 metrics.py
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        start = time.perf_counter()
+        with connections['default'].execute_wrapper(counter):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        try:
+            view = route_name(request)
+            metrics.http_requests.inc(view=view, method=request.method, status=response.status_code)
+            metrics.http_request_duration.observe(elapsed, view=view)
+            if counter.count:
+                metrics.db_queries.inc(counter.count, view=view)
+                metrics.db_query_duration.inc(counter.duration, view=view)
+        except Exception:
+            logger.exception('记录请求指标失败')
+        return response
@@ -2,16 +2,37 @@
 数据库模型
 """
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 
-class Category(models.Model):
+class PostCountMixin:
+    """冗余的已发布文章数，文章变化时由信号重新统计"""
+
+    @classmethod
+    def post_count_subquery(cls):
+        raise NotImplementedError
+
+    @classmethod
+    def refresh_post_counts(cls, pks=None):
+        """重新统计指定对象（默认全部）的已发布文章数，一条 UPDATE 完成"""
+        queryset = cls.objects.all()
+        if pks is not None:
+            pks = [pk for pk in pks if pk is not None]
+            if not pks:
+                return
+            queryset = queryset.filter(pk__in=pks)
+        queryset.update(post_count=Coalesce(cls.post_count_subquery(), 0))
+
+
+class Category(PostCountMixin, models.Model):
     """文章分类"""
     name = models.CharField('分类名称', max_length=100)
     description = models.TextField('描述', blank=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    post_count = models.PositiveIntegerField('文章数', default=0, editable=False)
 
     class Meta:
         verbose_name = '分类'
@@ -21,11 +42,19 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
-class Tag(models.Model):
+    @classmethod
+    def post_count_subquery(cls):
+        return models.Subquery(
+            Post.objects.filter(category=models.OuterRef('pk'), status='published')
+            .order_by().values('category').annotate(count=models.Count('pk')).values('count')
+        )
+
+class Tag(PostCountMixin, models.Model):
     """文章标签"""
     name = models.CharField('标签名称', max_length=50)
     description = models.TextField('描述', blank=True)
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
+    post_count = models.PositiveIntegerField('文章数', default=0, editable=False)
 
     class Meta:
         verbose_name = '标签'
@@ -35,6 +64,13 @@ class Tag(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def post_count_subquery(cls):
+        return models.Subquery(
+            Post.tags.through.objects.filter(tag=models.OuterRef('pk'), post__status='published')
+            .order_by().values('tag').annotate(count=models.Count('pk')).values('count')
+        )
+
 class Post(models.Model):
     """博客文章"""
     STATUS_CHOICES = (
@@ -61,6 +97,10 @@ class Post(models.Model):
         verbose_name = '文章'
         verbose_name_plural = '文章'
         ordering = ['-created_at']
+        indexes = [
+            # 文章列表的键集分页按 (created_at, id) 定位
+            models.Index(fields=['status', 'created_at', 'id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -69,9 +109,11 @@ class Post(models.Model):
         return reverse('post_detail', args=[str(self.id)])
 
     def increment_view_count(self):
-        """增加浏览数"""
+        """增加浏览数：计入写缓冲，由后台线程批量写回，当前实例立即反映本次浏览"""
+        from .buffers import view_count_buffer
+
+        view_count_buffer.incr(self.pk)
         self.view_count += 1
-        self.save(update_fields=['view_count'])
 
     @property
     def short_content(self):
@@ -88,33 +130,309 @@ class Comment(models.Model):
     is_active = models.BooleanField('是否显示', default=True)
     created_at = models.DateTimeField('创建时间', default=timezone.now)
     updated_at = models.DateTimeField('更新时间', auto_now=True)
+    # 物化路径：从顶层评论到本评论的 ID（定长补零，用 / 分隔），按 (thread_id, path) 排序即为先序遍历，
+    # 一条查询就能按树的顺序读出整篇文章的评论
+    thread_id = models.PositiveBigIntegerField('所属楼层', default=0, editable=False)
+    depth = models.PositiveSmallIntegerField('层级', default=0, editable=False)
+    path = models.CharField('路径', max_length=255, blank=True, editable=False)
+
+    PATH_DIGITS = 10
+    MAX_DEPTH = 20  # 受 path 长度限制，更深的回复挂到允许的最深一层
 
     class Meta:
         verbose_name = '评论'
         verbose_name_plural = '评论'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['post', 'thread_id', 'path']),
+        ]
 
     def __str__(self):
         return f'{self.author.username} 评论了 {self.post.title}'
 
+    def save(self, *args, **kwargs):
+        """新评论保存后根据父评论计算物化路径"""
+        is_new = self.pk is None
+        with transaction.atomic():
+            if is_new and self.parent_id is not None and self.parent.depth >= self.MAX_DEPTH - 1:
+                self.parent_id = self.parent.parent_id
+            super().save(*args, **kwargs)
+            if is_new:
+                self._assign_path(self.parent if self.parent_id is not None else None)
+                Comment.objects.filter(pk=self.pk).update(
+                    thread_id=self.thread_id, depth=self.depth, path=self.path
+                )
+
+    def _assign_path(self, parent):
+        segment = f'{self.pk:0{self.PATH_DIGITS}d}'
+        if parent is None:
+            self.thread_id, self.depth, self.path = self.pk, 0, segment
+        else:
+            self.thread_id, self.depth = parent.thread_id, parent.depth + 1
+            self.path = f'{parent.path}/{segment}'
+
+    @classmethod
+    def rebuild_paths(cls, post_ids=None):
+        """按 ID 顺序重新计算物化路径（用于回填历史数据），返回更新的评论数"""
+        queryset = cls.objects.order_by('post_id', 'id').only('id', 'post_id', 'parent_id')
+        if post_ids is not None:
+            queryset = queryset.filter(post_id__in=post_ids)
+
+        by_id = {}
+        pending = list(queryset)
+        while pending:
+            # 父评论的 ID 一般小于子评论；遇到父评论尚未处理的，留到下一轮
+            deferred = []
+            for comment in pending:
+                if comment.parent_id is None:
+                    comment._assign_path(None)
+                elif comment.parent_id in by_id:
+                    comment._assign_path(by_id[comment.parent_id])
+                else:
+                    deferred.append(comment)
+                    continue
+                by_id[comment.pk] = comment
+            if len(deferred) == len(pending):
+                # 父评论属于其他文章或形成环，作为顶层评论处理
+                for comment in deferred:
+                    comment._assign_path(None)
+                    by_id[comment.pk] = comment
+                break
+            pending = deferred
+
+        cls.objects.bulk_update(list(by_id.values()), ['thread_id', 'depth', 'path'], batch_size=500)
+        return len(by_id)
+
+class RelatedPost(models.Model):
+    """预先计算的相关文章（每篇文章保留得分最高的前 K 篇，见 related.py）"""
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='related_entries', verbose_name='文章')
+    related = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+', verbose_name='相关文章')
+    score = models.FloatField('相关度', default=0)
+    rank = models.PositiveSmallIntegerField('排名')
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '相关文章'
+        verbose_name_plural = '相关文章'
+        ordering = ['post', 'rank']
+        unique_together = ['post', 'rank']
+
+    def __str__(self):
+        return f'{self.post_id} -> {self.related_id} ({self.score:.3f})'
+
+
+class DocumentFrequency(models.Model):
+    """
+    已发布文章的文档频率（相关文章内容相似度使用，见 related.py）
+    由 rebuild_related_posts 批量计算，各进程的增量刷新都从数据库读取
+    """
+    name = models.CharField('名称', max_length=50, unique=True)
+    documents = models.PositiveIntegerField('文档数', default=0)
+    terms = models.JSONField('词元文档频率', default=dict)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '文档频率'
+        verbose_name_plural = '文档频率'
+
+    def __str__(self):
+        return f'{self.name}: {self.documents} 篇文章'
+
+class UserAgent(models.Model):
+    """
+    用户代理维度表
+    每个不同的 User-Agent 只存一行，按 SHA-1 摘要去重；浏览器、系统、设备和爬虫分类在首次出现时计算一次
+    """
+    DEVICE_CHOICES = (
+        ('desktop', '桌面'),
+        ('mobile', '手机'),
+        ('tablet', '平板'),
+        ('bot', '爬虫'),
+        ('other', '其他'),
+    )
+
+    ua_hash = models.CharField('摘要', max_length=40, unique=True)
+    user_agent = models.TextField('用户代理', blank=True)
+    browser_family = models.CharField('浏览器', max_length=20)
+    os_family = models.CharField('操作系统', max_length=20)
+    device_type = models.CharField('设备类型', max_length=10, choices=DEVICE_CHOICES)
+    is_bot = models.BooleanField('爬虫', default=False)
+    first_seen = models.DateTimeField('首次出现', default=timezone.now)
+
+    class Meta:
+        verbose_name = '用户代理'
+        verbose_name_plural = '用户代理'
+
+    def __str__(self):
+        return self.user_agent[:80]
+
+
 class VisitStatistics(models.Model):
     """访问统计"""
     ip_address = models.GenericIPAddressField('IP地址')
-    user_agent = models.TextField('用户代理', blank=True)
+    agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT, null=True, blank=True,
+                              related_name='visits', verbose_name='用户代理')
     path = models.CharField('访问路径', max_length=500)
     method = models.CharField('请求方法', max_length=10)
     status_code = models.IntegerField('状态码')
-    visit_time = models.DateTimeField('访问时间', auto_now_add=True)
+    visit_time = models.DateTimeField('访问时间', default=timezone.now)
 
     class Meta:
         verbose_name = '访问统计'
         verbose_name_plural = '访问统计'
         ordering = ['-visit_time']
+        indexes = [
+            models.Index(fields=['visit_time']),
+        ]
 
     def __str__(self):
         return f'{self.ip_address} - {self.path}'
 
 
+class VisitHourlyRollup(models.Model):
+    """访问统计小时汇总"""
+    hour = models.DateTimeField('小时')
+    path = models.CharField('访问路径', max_length=500)
+    status_code = models.IntegerField('状态码')
+    browser_family = models.CharField('浏览器', max_length=20)
+    visit_count = models.PositiveIntegerField('访问次数', default=0)
+
+    class Meta:
+        verbose_name = '访问小时汇总'
+        verbose_name_plural = '访问小时汇总'
+        ordering = ['-hour']
+        unique_together = ['hour', 'path', 'status_code', 'browser_family']
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+
+    def __str__(self):
+        return f'{self.hour:%Y-%m-%d %H}:00 {self.path} ({self.visit_count})'
+
+
+class VisitDailyRollup(models.Model):
+    """访问统计日汇总"""
+    date = models.DateField('日期')
+    path = models.CharField('访问路径', max_length=500)
+    status_code = models.IntegerField('状态码')
+    browser_family = models.CharField('浏览器', max_length=20)
+    visit_count = models.PositiveIntegerField('访问次数', default=0)
+
+    class Meta:
+        verbose_name = '访问日汇总'
+        verbose_name_plural = '访问日汇总'
+        ordering = ['-date']
+        unique_together = ['date', 'path', 'status_code', 'browser_family']
+        indexes = [
+            models.Index(fields=['date']),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.path} ({self.visit_count})'
+
+
+class DailyVisitorSketch(models.Model):
+    """每日独立访客草图（HyperLogLog）"""
+    date = models.DateField('日期', unique=True)
+    sketch = models.BinaryField('草图')
+    version = models.PositiveIntegerField('版本', default=0)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '每日独立访客'
+        verbose_name_plural = '每日独立访客'
+        ordering = ['-date']
+
+    def __str__(self):
+        return str(self.date)
+
+
+class VisitRollupState(models.Model):
+    """访问汇总进度（已汇总到的最大访问记录ID）"""
+    name = models.CharField('名称', max_length=50, unique=True)
+    last_visit_id = models.BigIntegerField('最后汇总的访问记录ID', default=0)
+    updated_at = models.DateTimeField('更新时间', auto_now=True)
+
+    class Meta:
+        verbose_name = '访问汇总进度'
+        verbose_name_plural = '访问汇总进度'
+
+    def __str__(self):
+        return f'{self.name}: {self.last_visit_id}'
+
+
+class RouteLatency(models.Model):
+    """按路由、按时间段汇总的响应时间直方图（固定桶，可以直接相加合并）"""
+    route = models.CharField('路由', max_length=200)
+    period = models.DateTimeField('时间段')
+    request_count = models.PositiveIntegerField('请求数', default=0)
+    error_count = models.PositiveIntegerField('错误数', default=0)
+    total_ms = models.FloatField('总耗时（毫秒）', default=0)
+    histogram = models.BinaryField('直方图')
+    version = models.PositiveIntegerField('版本', default=0)
+
+    class Meta:
+        verbose_name = '路由响应时间'
+        verbose_name_plural = '路由响应时间'
+        unique_together = ['route', 'period']
+        indexes = [
+            models.Index(fields=['period']),
+        ]
+
+    def __str__(self):
+        return f'{self.route} @ {self.period}'
+
+
+class SlowRequest(models.Model):
+    """慢请求日志（查询分析中间件抽样记录）"""
+    route = models.CharField('路由', max_length=200)
+    path = models.CharField('访问路径', max_length=500)
+    method = models.CharField('请求方法', max_length=10)
+    status_code = models.IntegerField('状态码')
+    duration_ms = models.FloatField('耗时（毫秒）')
+    query_count = models.PositiveIntegerField('查询次数')
+    db_time_ms = models.FloatField('数据库耗时（毫秒）')
+    duplicate_queries = models.JSONField('重复查询', default=list, blank=True)
+    slowest_sql = models.TextField('最慢的查询', blank=True)
+    slowest_ms = models.FloatField('最慢查询耗时（毫秒）', default=0)
+    created_at = models.DateTimeField('记录时间', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = '慢请求'
+        verbose_name_plural = '慢请求'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration_ms:.0f}ms)'
+
+
+class ChatMessage(models.Model):
+    """公共聊天室消息"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='发送者')
+    username = models.CharField('用户名', max_length=150)
+    content = models.TextField('消息内容')
+    created_at = models.DateTimeField('发送时间', default=timezone.now, db_index=True)
+
+    class Meta:
+        verbose_name = '聊天消息'
+        verbose_name_plural = '聊天消息'
+        ordering = ['id']
+
+    def __str__(self):
+        return f'{self.username}: {self.content[:50]}'
+
+    def to_dict(self):
+        """序列化为聊天接口使用的格式"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'username': self.username,
+            'avatar': '',
+            'content': self.content,
+            'timestamp': self.created_at.isoformat(),
+        }
+
+
 # 在 blog/models.py 文件中添加以下模型
 
 class PrivateChatSession(models.Model):
@@ -128,26 +446,214 @@ class PrivateChatSession(models.Model):
     created_at = models.DateTimeField('创建时间', auto_now_add=True)
     updated_at = models.DateTimeField('最后更新时间', auto_now=True)
     is_active = models.BooleanField('是否活跃', default=True)
+    # 已读水位线：各自已读到的最大消息 ID，ID 不大于水位线的消息都已读
+    user1_last_read_id = models.PositiveBigIntegerField('用户1已读到', default=0)
+    user2_last_read_id = models.PositiveBigIntegerField('用户2已读到', default=0)
+    # 冗余的最后一条消息和未读计数，发送和已读时原子更新，会话列表无需扫描消息表
+    last_message = models.ForeignKey('PrivateMessage', on_delete=models.SET_NULL,
+                                     null=True, blank=True, related_name='+',
+                                     verbose_name='最后一条消息')
+    last_message_at = models.DateTimeField('最后消息时间', null=True, blank=True)
+    last_message_preview = models.CharField('最后消息预览', max_length=100, blank=True)
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL,
+                                    null=True, blank=True, related_name='+',
+                                    verbose_name='最后发送者')
+    user1_unread_count = models.PositiveIntegerField('用户1未读数', default=0)
+    user2_unread_count = models.PositiveIntegerField('用户2未读数', default=0)
+
+    PREVIEW_LENGTH = 50
 
     class Meta:
         verbose_name = '私聊会话'
         verbose_name_plural = '私聊会话'
         unique_together = ['user1', 'user2']
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user1', 'last_message_at']),
+            models.Index(fields=['user2', 'last_message_at']),
+        ]
 
     def __str__(self):
         return f"{self.user1.username} 和 {self.user2.username} 的聊天"
 
+    @classmethod
+    def get_or_create_between(cls, user, other_user):
+        """获取或创建两个用户之间的会话（ID 较小的用户作为 user1）"""
+        return cls.objects.get_or_create(
+            user1=user if user.id < other_user.id else other_user,
+            user2=other_user if user.id < other_user.id else user,
+            defaults={'is_active': True}
+        )
+
+    @classmethod
+    def for_user(cls, user):
+        """用户参与的活跃会话，按最后消息时间倒序（单条查询，附带双方用户）"""
+        return cls.objects.filter(
+            models.Q(user1=user) | models.Q(user2=user),
+            is_active=True
+        ).select_related('user1', 'user2').order_by(
+            models.F('last_message_at').desc(nulls_last=True), '-id'
+        )
+
+    @classmethod
+    def total_unread_count(cls, user_id):
+        """用户所有会话的未读消息总数（汇总会话上的计数器）"""
+        totals = cls.objects.filter(
+            models.Q(user1_id=user_id) | models.Q(user2_id=user_id)
+        ).aggregate(total=models.Sum(models.Case(
+            models.When(user1_id=user_id, then='user1_unread_count'),
+            default='user2_unread_count',
+        )))
+        return totals['total'] or 0
+
     def other_user(self, current_user):
         """获取会话中的另一个用户"""
         return self.user2 if current_user == self.user1 else self.user1
 
+    def message_page(self, before=None, limit=50):
+        """
+        按 (created_at, id) 键集分页获取消息，走 (session, created_at) 索引，
+        代价与会话历史长度无关
+        before 为已加载的最早一条消息，None 表示取最新一页
+        返回 (按时间升序的消息列表, 是否还有更早的消息)
+        """
+        queryset = self.messages.select_related('sender')
+        if before is not None:
+            queryset = queryset.filter(
+                models.Q(created_at__lt=before.created_at) |
+                models.Q(created_at=before.created_at, id__lt=before.id)
+            )
+        page = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        page.reverse()
+        return page, has_more
+
+    def unread_field(self, user):
+        """用户对应的未读计数字段名"""
+        return 'user1_unread_count' if user.id == self.user1_id else 'user2_unread_count'
+
+    @classmethod
+    def make_preview(cls, content):
+        """截取消息预览"""
+        if len(content) > cls.PREVIEW_LENGTH:
+            return content[:cls.PREVIEW_LENGTH] + '...'
+        return content
+
+    def send_message(self, sender, content):
+        """
+        发送消息，并在同一事务中更新会话的最后消息和接收方未读计数
+        计数器用 F() 原子递增；最后消息只在比当前记录更新时覆盖，避免并发发送时倒退
+        """
+        receiver = self.other_user(sender)
+        unread_field = self.unread_field(receiver)
+
+        with transaction.atomic():
+            message = PrivateMessage.objects.create(
+                session=self,
+                sender=sender,
+                receiver=receiver,
+                content=content
+            )
+            sessions = PrivateChatSession.objects.filter(pk=self.pk)
+            sessions.update(**{unread_field: models.F(unread_field) + 1})
+            sessions.filter(
+                models.Q(last_message__isnull=True) | models.Q(last_message__lt=message.id)
+            ).update(
+                last_message=message,
+                last_message_at=message.created_at,
+                last_message_preview=self.make_preview(content),
+                last_sender=sender,
+                updated_at=message.created_at,
+            )
+
+        self.last_message = message
+        self.last_message_at = message.created_at
+        self.last_message_preview = self.make_preview(content)
+        self.last_sender = sender
+        self.updated_at = message.created_at
+        return message
+
+    def refresh_counters(self):
+        """根据消息表重新计算冗余字段（用于回填历史数据或修正计数）"""
+        last_message = self.messages.order_by('-id').first()
+        values = {
+            'last_message': last_message,
+            'last_message_at': last_message.created_at if last_message else None,
+            'last_message_preview': self.make_preview(last_message.content) if last_message else '',
+            'last_sender': last_message.sender if last_message else None,
+        }
+        for user, prefix in ((self.user1, 'user1'), (self.user2, 'user2')):
+            received = self.messages.filter(receiver=user)
+            values[f'{prefix}_unread_count'] = received.filter(is_read=False).count()
+            values[f'{prefix}_last_read_id'] = received.filter(is_read=True)\
+                .aggregate(max_id=models.Max('id'))['max_id'] or 0
+        PrivateChatSession.objects.filter(pk=self.pk).update(**values)
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    def last_read_field(self, user):
+        """用户对应的已读水位线字段名"""
+        return 'user1_last_read_id' if user.id == self.user1_id else 'user2_last_read_id'
+
+    def last_read_id_for(self, user):
+        """用户已读到的最大消息 ID"""
+        return getattr(self, self.last_read_field(user))
+
     def unread_count_for_user(self, user):
-        """获取用户未读消息数"""
-        return self.messages.filter(
-            receiver=user,
-            is_read=False
-        ).count()
+        """获取用户未读消息数（读取会话上的计数器）"""
+        return getattr(self, self.unread_field(user))
+
+    def mark_read(self, user, up_to_id=None):
+        """
+        将用户在本会话中收到的消息标记为已读，返回标记的消息数
+        一条 UPDATE 完成批量标记，再推进已读水位线；
+        up_to_id 默认取当前最新消息，之后到达的消息不受影响
+        """
+        if up_to_id is None:
+            up_to_id = self.messages.aggregate(max_id=models.Max('id'))['max_id']
+            if up_to_id is None:
+                return 0
+
+        sessions = PrivateChatSession.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            updated = self.messages.filter(
+                receiver=user,
+                is_read=False,
+                id__lte=up_to_id
+            ).update(is_read=True, read_at=timezone.now())
+
+            if updated:
+                # 按实际标记的条数递减，并发标记时各自只减去自己更新的行
+                unread_field = self.unread_field(user)
+                sessions.update(**{unread_field: Greatest(models.F(unread_field) - updated, 0)})
+                setattr(self, unread_field, max(getattr(self, unread_field) - updated, 0))
+
+            field = self.last_read_field(user)
+            if up_to_id > getattr(self, field):
+                # 条件更新保证水位线只前进不后退
+                sessions.filter(**{f'{field}__lt': up_to_id}).update(**{field: up_to_id})
+                setattr(self, field, up_to_id)
+        return updated
+
+    @classmethod
+    def mark_all_read(cls, user):
+        """将用户的全部未读私聊消息标记为已读，返回标记的消息数"""
+        latest_id = Coalesce(
+            models.Subquery(
+                PrivateMessage.objects.filter(session=models.OuterRef('pk'))
+                .order_by('-id').values('id')[:1]
+            ),
+            0
+        )
+        # 先推进水位线再标记消息，期间到达的新消息最多被多算作已读，不会漏标
+        with transaction.atomic():
+            cls.objects.filter(user1=user).update(user1_last_read_id=latest_id, user1_unread_count=0)
+            cls.objects.filter(user2=user).update(user2_last_read_id=latest_id, user2_unread_count=0)
+            return PrivateMessage.objects.filter(
+                receiver=user,
+                is_read=False
+            ).update(is_read=True, read_at=timezone.now())
 
 
 class PrivateMessage(models.Model):
@@ -178,6 +684,17 @@ class PrivateMessage(models.Model):
     def __str__(self):
         return f"{self.sender.username} -> {self.receiver.username}: {self.content[:50]}"
 
+    def to_dict(self, current_user=None):
+        """序列化为私聊接口使用的格式"""
+        return {
+            'id': self.id,
+            'sender_id': self.sender_id,
+            'sender_username': self.sender.username,
+            'content': self.content,
+            'created_at': self.created_at.isoformat(),
+            'is_own': current_user is not None and self.sender_id == current_user.id,
+        }
+
     def mark_as_read(self):
         """标记消息为已读"""
         if not self.is_read:
@@ -0,0 +1,171 @@
+"""
+文章列表分页
+Django 的 Paginator 每一页都要对过滤后的查询集执行 COUNT(*)，再用 OFFSET 跳到目标页，
+归档越深代价越高。这里提供按 (created_at, id) 的键集分页：
+- 上一页/下一页链接携带边界文章的游标，翻页只读取 per_page + 1 行，代价与页数无关
+- 总数可以由调用方提供（如分类、标签上的冗余文章数），或按内容版本号缓存，不在每次翻页时统计
+
+POST_LIST_PAGINATION = 'page' 时退回传统页码分页；搜索结果按相关度排序且数量有上限，
+始终使用页码分页
+"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.http import urlencode
+
+from . import caching
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+# BIGINT 的上限，更大的 ID 传给数据库会溢出
+MAX_ID = 2 ** 63 - 1
+
+# 分页参数，生成翻页链接时从查询字符串中去掉
+PAGE_PARAMS = ('page', 'after', 'before')
+
+
+def encode_cursor(post):
+    """文章的游标：创建时间的微秒时间戳和 ID，整数运算保证往返无精度损失"""
+    delta = post.created_at - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return f'{micros}.{post.pk}'
+
+
+def decode_cursor(value):
+    """解析游标，返回 (created_at, id)；格式不正确或 ID 超出数据库整数范围时返回 None"""
+    try:
+        micros, pk = value.split('.')
+        created_at, pk = EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (AttributeError, ValueError, OverflowError):
+        return None
+    return (created_at, pk) if 0 < pk <= MAX_ID else None
+
+
+class KeysetPage:
+    """键集分页的一页，可以像 Django 的 Page 一样迭代"""
+    is_keyset = True
+
+    def __init__(self, object_list, has_next, has_previous, paginator, after=None):
+        self.object_list = object_list
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+        self.paginator = paginator
+        self.after = after
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    @property
+    def count(self):
+        """列表总数（可能来自缓存或冗余计数），未提供时为 None"""
+        return self.paginator.count
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1]) if self.has_next_page else None
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous_page:
+            return None
+        # 旧链接翻到的空页没有边界文章，以请求的游标作为上一页的边界
+        return encode_cursor(self.object_list[0]) if self.object_list else self.after
+
+
+class KeysetPaginator:
+    """
+    按 (created_at, id) 倒序的键集分页
+    count 可以是整数、返回整数的函数或 None（不显示总数），只在模板读取时计算一次
+    """
+
+    def __init__(self, queryset, per_page, count=None):
+        self.queryset = queryset
+        self.per_page = per_page
+        self._count = count
+
+    @property
+    def count(self):
+        if callable(self._count):
+            self._count = self._count()
+        return self._count
+
+    def get_page(self, after=None, before=None):
+        """
+        after: 上一页最后一篇文章的游标，取更早的文章
+        before: 下一页第一篇文章的游标，取更新的文章
+        都为空或游标无效时返回第一页
+        """
+        after_cursor = after
+        after = decode_cursor(after) if after else None
+        before = decode_cursor(before) if before else None
+
+        if before is not None:
+            created_at, pk = before
+            rows = list(
+                self.queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+                .order_by('created_at', 'id')[:self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            if not has_previous and len(rows) < self.per_page:
+                # 已经回到最前面且不足一页（期间有文章被删除），直接返回第一页，保证页面边界稳定
+                return self.get_page()
+            return KeysetPage(rows, has_next=True, has_previous=has_previous, paginator=self)
+
+        queryset = self.queryset
+        if after is not None:
+            created_at, pk = after
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        rows = list(queryset.order_by('-created_at', '-id')[:self.per_page + 1])
+        has_next = len(rows) > self.per_page
+        return KeysetPage(rows[:self.per_page], has_next=has_next,
+                          has_previous=after is not None, paginator=self, after=after_cursor)
+
+
+def cached_count(queryset, *key_parts):
+    """
+    按内容版本号缓存查询集的总数，内容变化后自动失效
+    key_parts 用于区分不同的过滤条件
+    """
+    digest = hashlib.md5(repr(key_parts).encode('utf-8')).hexdigest()
+    key = f'post_count:{caching.get_version()}:{digest}'
+    return caching.get_or_build(key, queryset.count, getattr(settings, 'POST_LIST_COUNT_TIMEOUT', 600))
+
+
+def paginate_posts(request, queryset, count=None, keyset=True):
+    """
+    按配置分页文章列表，返回 (page_obj, filter_query)
+    filter_query 是去掉分页参数后的查询字符串，模板用它拼接翻页链接
+    keyset=False 或 POST_LIST_PAGINATION = 'page' 时使用页码分页
+    """
+    per_page = getattr(settings, 'POST_LIST_PAGE_SIZE', 10)
+    filter_query = urlencode([
+        (key, value) for key, values in request.GET.lists() if key not in PAGE_PARAMS
+        for value in values
+    ])
+
+    if keyset and getattr(settings, 'POST_LIST_PAGINATION', 'keyset') == 'keyset':
+        paginator = KeysetPaginator(queryset, per_page, count=count)
+        page_obj = paginator.get_page(request.GET.get('after'), request.GET.get('before'))
+    else:
+        page_obj = Paginator(queryset, per_page).get_page(request.GET.get('page'))
+    return page_obj, filter_query
@@ -0,0 +1,185 @@
+"""
+请求级 ORM 查询分析
+通过数据库连接的 execute_wrapper 统计每个请求的查询次数、数据库耗时、重复查询（N+1 特征）和最慢的 SQL
+
+- profile_queries() 是通用的上下文管理器，可以在视图、管理命令或脚本中单独使用
+- QueryProfilerMiddleware 对每个请求启用分析；超过 QUERY_PROFILER_SLOW_MS 或
+  QUERY_PROFILER_MAX_QUERIES 的请求按 QUERY_PROFILER_SAMPLE_RATE 抽样写入慢请求日志（SlowRequest 表）
+- QUERY_PROFILER_ENABLED 关闭时中间件在启动时就从中间件链中移除，请求路径上没有任何额外开销
+"""
+
+import logging
+import queue
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.models import Avg, Count, Max
+from django.utils import timezone
+
+from .buffers import BackgroundFlusher
+from .latency import route_name
+from .models import SlowRequest
+
+logger = logging.getLogger(__name__)
+
+# 归一化 SQL：IN 列表和字面量替换为占位符，参数不同的同一条查询得到相同的特征
+_IN_LIST = re.compile(r'\bIN \((?:%s|\?)(?:, ?(?:%s|\?))*\)', re.IGNORECASE)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+class QueryProfile:
+    """一次分析的结果，同时作为 execute_wrapper 使用"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_sql = ''
+        self.slowest_duration = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            self.signatures[normalize_sql(sql)] += 1
+            if elapsed > self.slowest_duration:
+                self.slowest_duration = elapsed
+                self.slowest_sql = sql
+
+    def duplicates(self, threshold=None):
+        """重复执行次数达到阈值的查询特征 [(sql, 次数)]，按次数倒序"""
+        threshold = threshold or getattr(settings, 'QUERY_PROFILER_DUPLICATE_THRESHOLD', 3)
+        return [(sql, count) for sql, count in self.signatures.most_common() if count >= threshold]
+
+
+@contextmanager
+def profile_queries(using=None):
+    """
+    分析代码块执行的查询
+    using 为空时包装全部数据库连接；只统计当前线程的查询
+    """
+    profile = QueryProfile()
+    aliases = [using] if using else list(connections)
+    with ExitStack() as stack:
+        for alias in aliases:
+            stack.enter_context(connections[alias].execute_wrapper(profile))
+        yield profile
+
+
+class SlowRequestLog(BackgroundFlusher):
+    """慢请求日志，由后台线程批量写入，写满时丢弃"""
+    thread_name = 'slow-request-log'
+
+    def __init__(self):
+        super().__init__(flush_interval=getattr(settings, 'QUERY_PROFILER_FLUSH_INTERVAL', 10))
+        self._queue = queue.Queue(maxsize=getattr(settings, 'QUERY_PROFILER_MAX_PENDING', 1000))
+
+    def add(self, entry):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            entries = []
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if entries:
+                SlowRequest.objects.bulk_create(entries)
+
+
+slow_request_log = SlowRequestLog()
+
+
+class QueryProfilerMiddleware:
+    """
+    查询分析中间件（QUERY_PROFILER_ENABLED 开启时生效）
+    应放在中间件列表靠前的位置，以便统计到会话、认证等中间件的查询
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_PROFILER_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.slow_ms = getattr(settings, 'QUERY_PROFILER_SLOW_MS', 500)
+        self.max_queries = getattr(settings, 'QUERY_PROFILER_MAX_QUERIES', 30)
+        self.sample_rate = getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with profile_queries() as profile:
+            response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        try:
+            duplicates = profile.duplicates()
+            slow = elapsed_ms >= self.slow_ms or profile.count > self.max_queries or duplicates
+            if slow and random.random() < self.sample_rate:
+                slow_request_log.add(SlowRequest(
+                    route=route_name(request)[:200],
+                    path=request.path[:500],
+                    method=request.method,
+                    status_code=response.status_code,
+                    duration_ms=elapsed_ms,
+                    query_count=profile.count,
+                    db_time_ms=profile.duration * 1000,
+                    duplicate_queries=[{'sql': sql, 'count': count} for sql, count in duplicates[:10]],
+                    slowest_sql=profile.slowest_sql[:5000],
+                    slowest_ms=profile.slowest_duration * 1000,
+                ))
+        except Exception:
+            logger.exception('记录慢请求失败')
+        return response
+
+
+def summarize(days=1, limit=50):
+    """
+    最近 days 天的慢请求汇总
+    返回 (按路由分组的统计, 最近的慢请求)
+    """
+    since = timezone.now() - timedelta(days=days)
+    recent = SlowRequest.objects.filter(created_at__gte=since)
+    routes = recent.values('route').annotate(
+        requests=Count('id'),
+        avg_duration=Avg('duration_ms'),
+        max_duration=Max('duration_ms'),
+        avg_queries=Avg('query_count'),
+        max_queries=Max('query_count'),
+        avg_db_time=Avg('db_time_ms'),
+    ).order_by('-requests')
+    return list(routes), list(recent.order_by('-created_at')[:limit])
+
+
+def prune(days=None):
+    """删除超出保留期的慢请求日志，返回删除的行数"""
+    days = getattr(settings, 'QUERY_PROFILER_RETENTION_DAYS', 7) if days is None else days
+    if not days:
+        return 0
+    count, _ = SlowRequest.objects.filter(created_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return count
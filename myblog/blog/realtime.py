@@ -0,0 +1,182 @@
+"""
+实时消息通知
+为长轮询提供轻量的变更通知：同一进程内通过条件变量立即唤醒，
+跨进程时退化为按间隔查询数据库；
+安装了 channels 时同时通过 channel layer 推送给 WebSocket 连接
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+try:
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+except ImportError:  # 未安装 channels 时只使用 HTTP 轮询
+    get_channel_layer = None
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_CHAT_GROUP = 'chat_public'
+
+
+class Notifier:
+    """
+    进程内变更通知器
+    每个 key 维护一个版本号，notify() 递增版本并唤醒所有等待者
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._versions = {}
+
+    def version(self, key):
+        with self._condition:
+            return self._versions.get(key, 0)
+
+    def notify(self, key):
+        with self._condition:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            self._condition.notify_all()
+
+    def wait(self, key, timeout, since_version=None, check=None, poll_interval=None):
+        """
+        等待 key 的版本号不同于 since_version，最长 timeout 秒
+        调用方应在读取数据之前取得 since_version，避免错过两者之间的通知
+        check 为跨进程的兜底检查函数，每隔 poll_interval 秒调用一次；返回 True 时立即结束
+        返回是否检测到变化
+        """
+        if since_version is None:
+            since_version = self.version(key)
+        deadline = time.monotonic() + timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            wait_for = min(remaining, poll_interval) if poll_interval else remaining
+            with self._condition:
+                changed = self._condition.wait_for(
+                    lambda: self._versions.get(key, 0) != since_version, wait_for
+                )
+            if changed:
+                return True
+            if check is not None and check():
+                return True
+
+
+notifier = Notifier()
+
+
+def private_session_key(session_id):
+    """私聊会话的通知 key"""
+    return f'private_session:{session_id}'
+
+
+def private_session_group(session_id):
+    """私聊会话的 WebSocket 组名"""
+    return f'private_session_{session_id}'
+
+
+def private_user_group(user_id):
+    """用户个人通知（未读数）的 WebSocket 组名"""
+    return f'private_user_{user_id}'
+
+
+def channels_enabled():
+    """是否配置了可用的 channel layer（只在 SERVER_MODE=asgi 时配置，见 settings.CHANNEL_LAYERS）"""
+    return get_channel_layer is not None and get_channel_layer() is not None
+
+
+def group_send(group, event):
+    """向 channel layer 的组广播事件，未配置 channel layer 时忽略"""
+    if not channels_enabled():
+        return
+    try:
+        async_to_sync(get_channel_layer().group_send)(group, event)
+    except Exception:
+        logger.exception('推送 WebSocket 事件失败: %s', group)
+
+
+def unread_count_for(user_id):
+    """用户的私聊未读消息总数"""
+    from .models import PrivateChatSession
+
+    return PrivateChatSession.total_unread_count(user_id)
+
+
+def notify_chat_message(message):
+    """广播公共聊天室的新消息"""
+    metrics.chat_messages.inc(kind='public')
+    group_send(PUBLIC_CHAT_GROUP, {'type': 'chat.message', 'message': message})
+
+
+def notify_private_message(message):
+    """
+    通知会话有新消息：唤醒等待该会话的长轮询，
+    并向会话的 WebSocket 组推送消息、向接收者推送未读数
+    """
+    metrics.chat_messages.inc(kind='private')
+    notifier.notify(private_session_key(message.session_id))
+    if not channels_enabled():
+        return
+    group_send(private_session_group(message.session_id), {
+        'type': 'private.message',
+        'message': message.to_dict(),
+    })
+    notify_unread_count(message.receiver_id)
+
+
+def notify_unread_count(user_id):
+    """向用户推送最新的未读消息总数"""
+    if not channels_enabled():
+        return
+    group_send(private_user_group(user_id), {
+        'type': 'unread.count',
+        'total_unread': unread_count_for(user_id),
+    })
+
+
+def notify_messages_read(session, reader):
+    """推送已读回执（阅读者的已读水位线）给会话中的另一方，并更新阅读者的未读数"""
+    if not channels_enabled():
+        return
+    group_send(private_session_group(session.id), {
+        'type': 'read.receipt',
+        'reader_id': reader.id,
+        'last_read_id': session.last_read_id_for(reader),
+    })
+    notify_unread_count(reader.id)
+
+
+def private_session_version(session_id):
+    """会话当前的通知版本号，在查询消息之前获取"""
+    return notifier.version(private_session_key(session_id))
+
+
+def wait_for_private_messages(session, last_id, timeout, since_version=None):
+    """
+    等待会话中出现 ID 大于 last_id 的消息
+    PRIVATE_CHAT_LONG_POLL_DB_INTERVAL 为 0 时只依赖进程内通知（单进程部署）
+    """
+    poll_interval = getattr(settings, 'PRIVATE_CHAT_LONG_POLL_DB_INTERVAL', 2)
+
+    def has_new_messages():
+        return session.messages.filter(id__gt=last_id).exists()
+
+    metrics.active_polls.inc()
+    try:
+        return notifier.wait(
+            private_session_key(session.id),
+            timeout,
+            since_version=since_version,
+            check=has_new_messages if poll_interval else None,
+            poll_interval=poll_interval or None,
+        )
+    finally:
+        metrics.active_polls.dec()
@@ -0,0 +1,258 @@
+"""
+相关文章
+每篇文章的前 K 篇相关文章预先计算并存入 RelatedPost 表，详情页按 (post, rank) 一次索引读取
+
+相关度由三部分加权求和：
+- 标签：共同标签按稀有程度加权（log(1 + 已发布文章数 / 标签文章数)），冷门标签比热门标签更能说明相关
+- 分类：同一分类加上固定权重
+- 内容（可选）：标题、摘要、正文的 TF-IDF 向量余弦相似度，只用于给有共同标签或分类的候选文章排序
+
+刷新方式：
+- 增量：文章标签、分类或状态变化时（见 signals.py）重新计算该文章以及原先、现在与它相关的文章
+- 批量：python manage.py rebuild_related_posts 在内存中一次算完全部文章，并更新内容相似度所需的文档频率
+  （存入 DocumentFrequency 表，所有 worker 进程的增量刷新共用）
+"""
+
+import heapq
+import math
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import DocumentFrequency, Post, RelatedPost, Tag
+from .search import tokenize
+
+DF_NAME = 'related_posts'
+
+
+def _setting(name, default):
+    return getattr(settings, f'RELATED_POSTS_{name}', default)
+
+
+class Corpus:
+    """计算相关度所需的文章数据：分类、标签、创建时间，以及可选的内容向量"""
+
+    def __init__(self, total_posts):
+        self.total_posts = max(total_posts, 1)
+        self.category = {}
+        self.created_at = {}
+        self.tags = defaultdict(set)
+        self.tag_posts = defaultdict(set)
+        self.category_posts = defaultdict(set)
+        self.tag_counts = {}
+        self.vectors = {}
+
+    def add_post(self, post_id, category_id, created_at):
+        self.category[post_id] = category_id
+        self.created_at[post_id] = created_at
+        if category_id is not None:
+            self.category_posts[category_id].add(post_id)
+
+    def add_tag(self, post_id, tag_id):
+        self.tags[post_id].add(tag_id)
+        self.tag_posts[tag_id].add(post_id)
+
+    def tag_weight(self, tag_id):
+        count = self.tag_counts.get(tag_id) or len(self.tag_posts[tag_id]) or 1
+        return math.log(1 + self.total_posts / count)
+
+    def candidates(self, post_id):
+        """有共同标签或同一分类的已发布文章"""
+        found = set()
+        for tag_id in self.tags.get(post_id, ()):
+            found |= self.tag_posts[tag_id]
+        category_id = self.category.get(post_id)
+        if category_id is not None:
+            found |= self.category_posts[category_id]
+        found.discard(post_id)
+        return found & self.created_at.keys()
+
+    def score(self, post_id, other_id):
+        tag_weight = _setting('TAG_WEIGHT', 1.0)
+        category_weight = _setting('CATEGORY_WEIGHT', 0.5)
+        content_weight = _setting('CONTENT_WEIGHT', 0.0)
+
+        shared = self.tags.get(post_id, set()) & self.tags.get(other_id, set())
+        score = tag_weight * sum(self.tag_weight(tag_id) for tag_id in shared)
+        category_id = self.category.get(post_id)
+        if category_id is not None and category_id == self.category.get(other_id):
+            score += category_weight
+        if content_weight and post_id in self.vectors and other_id in self.vectors:
+            score += content_weight * cosine(self.vectors[post_id], self.vectors[other_id])
+        return score
+
+    def top_k(self, post_id, k):
+        """得分最高的 k 篇文章，得分相同时较新的文章优先；返回 [(related_id, score)]"""
+        scored = (
+            (self.score(post_id, other_id), self.created_at[other_id], other_id)
+            for other_id in self.candidates(post_id)
+        )
+        return [(other_id, score) for score, _, other_id in heapq.nlargest(k, scored) if score > 0]
+
+
+def term_frequencies(post):
+    """文章的词频，标题和摘要的词元额外计入，权重高于正文"""
+    counts = Counter(tokenize(post.content))
+    for token in tokenize(f'{post.title} {post.summary}'):
+        counts[token] += 3
+    return counts
+
+
+def tfidf_vector(counts, document_frequency, total_documents, max_terms):
+    """TF-IDF 向量（只保留权重最高的 max_terms 个词元），已归一化为单位长度"""
+    length = sum(counts.values()) or 1
+    weights = {
+        token: (count / length) * math.log((1 + total_documents) / (1 + document_frequency.get(token, 0)))
+        for token, count in counts.items()
+    }
+    top = heapq.nlargest(max_terms, weights.items(), key=lambda item: item[1])
+    norm = math.sqrt(sum(weight * weight for _, weight in top)) or 1
+    return {token: weight / norm for token, weight in top if weight > 0}
+
+
+def cosine(left, right):
+    """两个单位向量的余弦相似度"""
+    if len(left) > len(right):
+        left, right = right, left
+    return sum(weight * right.get(token, 0) for token, weight in left.items())
+
+
+def _published():
+    return Post.objects.filter(status='published')
+
+
+def _load_vectors(corpus, post_ids, document_frequency):
+    """为指定文章计算内容向量"""
+    max_terms = _setting('CONTENT_TERMS', 50)
+    posts = _published().filter(pk__in=post_ids).only('id', 'title', 'summary', 'content')
+    for post in posts.iterator(chunk_size=200):
+        corpus.vectors[post.pk] = tfidf_vector(
+            term_frequencies(post), document_frequency['terms'], document_frequency['documents'], max_terms
+        )
+
+
+def _save(post_id, neighbours):
+    """替换一篇文章的相关文章列表"""
+    with transaction.atomic():
+        RelatedPost.objects.filter(post_id=post_id).delete()
+        RelatedPost.objects.bulk_create([
+            RelatedPost(post_id=post_id, related_id=related_id, score=score, rank=rank)
+            for rank, (related_id, score) in enumerate(neighbours)
+        ])
+
+
+def refresh_posts(post_ids):
+    """
+    增量刷新指定文章的相关文章
+    只读取这些文章的候选范围（共同标签或分类的文章）；内容相似度使用批量计算时保存的文档频率，
+    还没有执行过批量计算时只按标签和分类计算
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+
+    k = _setting('COUNT', 5)
+    published = _published()
+    corpus = Corpus(published.count())
+
+    # 这些文章自身的分类和标签（未发布的文章清空列表）
+    own = {row['id']: row for row in Post.objects.filter(pk__in=post_ids).values('id', 'category_id', 'status')}
+    tag_rows = Post.tags.through.objects.filter(post_id__in=post_ids).values_list('post_id', 'tag_id')
+    tag_ids = set()
+    for post_id, tag_id in tag_rows:
+        corpus.add_tag(post_id, tag_id)
+        tag_ids.add(tag_id)
+    category_ids = {row['category_id'] for row in own.values() if row['category_id'] is not None}
+    for row in own.values():
+        corpus.category[row['id']] = row['category_id']
+
+    # 候选文章：有共同标签或分类的已发布文章
+    candidate_filter = published.filter(tags__in=tag_ids).values_list('pk', flat=True)
+    candidates = set(candidate_filter) | set(
+        published.filter(category_id__in=category_ids).values_list('pk', flat=True)
+    )
+    for row in published.filter(pk__in=candidates).values('id', 'category_id', 'created_at'):
+        corpus.add_post(row['id'], row['category_id'], row['created_at'])
+    for post_id, tag_id in Post.tags.through.objects.filter(post_id__in=candidates, tag_id__in=tag_ids)\
+            .values_list('post_id', 'tag_id'):
+        corpus.add_tag(post_id, tag_id)
+    corpus.tag_counts = dict(Tag.objects.filter(pk__in=tag_ids).values_list('pk', 'post_count'))
+
+    if _setting('CONTENT_WEIGHT', 0.0):
+        document_frequency = load_document_frequency()
+        if document_frequency is not None:
+            _load_vectors(corpus, candidates | post_ids, document_frequency)
+
+    for post_id in post_ids:
+        if own.get(post_id, {}).get('status') != 'published':
+            _save(post_id, [])
+        else:
+            _save(post_id, corpus.top_k(post_id, k))
+
+
+def listing_posts(post_id):
+    """当前把该文章列为相关文章的文章"""
+    return set(RelatedPost.objects.filter(related_id=post_id).values_list('post_id', flat=True))
+
+
+def refresh_around(post_ids):
+    """
+    文章的标签、分类或状态变化后刷新：文章自身，原先把它们列为相关文章的文章，
+    以及它们现在的相关文章（相关度是对称的，这些文章最可能需要把它们加入列表）；
+    其余文章的排名由批量命令修正
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    affected = set(RelatedPost.objects.filter(related_id__in=post_ids).values_list('post_id', flat=True))
+    refresh_posts(post_ids)
+    affected.update(RelatedPost.objects.filter(post_id__in=post_ids).values_list('related_id', flat=True))
+    refresh_posts(affected - post_ids)
+
+
+def rebuild_all():
+    """在内存中重新计算全部已发布文章的相关文章，返回处理的文章数"""
+    k = _setting('COUNT', 5)
+    published = _published()
+    rows = list(published.values('id', 'category_id', 'created_at'))
+    corpus = Corpus(len(rows))
+    for row in rows:
+        corpus.add_post(row['id'], row['category_id'], row['created_at'])
+    for post_id, tag_id in Post.tags.through.objects.filter(post__status='published')\
+            .values_list('post_id', 'tag_id'):
+        corpus.add_tag(post_id, tag_id)
+
+    if _setting('CONTENT_WEIGHT', 0.0):
+        document_frequency = build_document_frequency()
+        _load_vectors(corpus, corpus.created_at.keys(), document_frequency)
+
+    for post_id in corpus.created_at:
+        _save(post_id, corpus.top_k(post_id, k))
+    # 未发布文章不展示相关文章
+    RelatedPost.objects.exclude(post__status='published').delete()
+    return len(rows)
+
+
+def load_document_frequency():
+    """读取批量计算保存的文档频率，没有时返回 None"""
+    return DocumentFrequency.objects.filter(name=DF_NAME).values('terms', 'documents').first()
+
+
+def build_document_frequency():
+    """统计已发布文章的文档频率并存入数据库，供各进程的增量刷新计算 TF-IDF"""
+    terms = Counter()
+    documents = 0
+    for post in _published().only('id', 'title', 'summary', 'content').iterator(chunk_size=200):
+        terms.update(term_frequencies(post).keys())
+        documents += 1
+    document_frequency = {'terms': dict(terms), 'documents': documents}
+    DocumentFrequency.objects.update_or_create(name=DF_NAME, defaults=document_frequency)
+    return document_frequency
+
+
+def get_related_posts(post, limit=3):
+    """读取预先计算的相关文章，一条查询"""
+    entries = RelatedPost.objects.filter(post=post, related__status='published')\
+        .select_related('related').order_by('rank')[:limit]
+    return [entry.related for entry in entries]
@@ -0,0 +1,326 @@
+"""
+访问统计保留策略
+原始访问记录只保留 VISIT_RETENTION_DAYS 天，小时汇总保留 VISIT_HOURLY_ROLLUP_RETENTION_DAYS 天，
+日汇总和每日独立访客草图体积很小，默认永久保留
+
+删除按主键范围分批进行，每批一个短事务，不会长时间锁表；
+只删除已经汇总过的记录（ID 不大于汇总进度），汇总积压时不会丢数据。
+可选在删除前把每一批导出为 gzip 压缩的 CSV 文件
+
+PostgreSQL 上可以把访问记录表转换为按月分区的表（convert_to_partitions），
+之后过期数据按整个分区 DETACH + DROP，不再逐行删除；超出已建分区范围的记录落入 DEFAULT 分区，
+其中的过期记录按行删除
+
+删除访问记录前会写入清理标记，之后 update_visit_rollups --rebuild 拒绝执行（见 rollups.history_pruned）
+"""
+
+import csv
+import gzip
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from .latency import prune as prune_latency
+from .profiling import prune as prune_slow_requests
+from .models import UserAgent, VisitHourlyRollup, VisitRollupState, VisitStatistics
+from .rollups import PRUNED_STATE_NAME, STATE_NAME
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FIELDS = ('id', 'ip_address', 'agent__user_agent', 'path', 'method', 'status_code', 'visit_time')
+
+
+def visit_cutoff(days=None):
+    """访问记录的保留截止时间，保留天数为空时返回 None（不清理）"""
+    days = getattr(settings, 'VISIT_RETENTION_DAYS', 90) if days is None else days
+    if not days:
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+def _rolled_up_id():
+    """已经汇总到的最大访问记录 ID"""
+    state = VisitRollupState.objects.filter(name=STATE_NAME).values_list('last_visit_id', flat=True).first()
+    return state or 0
+
+
+def _mark_pruned(last_id):
+    """记录访问记录已被清理（删除前写入，删除中途失败也不会漏记）"""
+    VisitRollupState.objects.update_or_create(name=PRUNED_STATE_NAME, defaults={'last_visit_id': last_id})
+
+
+def archive_rows(queryset, archive_dir, name):
+    """把查询集导出为 gzip 压缩的 CSV 文件，写入完成并落盘后才返回文件路径"""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f'{name}.csv.gz')
+    temp_path = f'{path}.tmp'
+    with gzip.open(temp_path, 'wt', encoding='utf-8', newline='') as archive:
+        writer = csv.writer(archive)
+        writer.writerow([field.rsplit('__', 1)[-1] for field in ARCHIVE_FIELDS])
+        for row in queryset.order_by('id').values_list(*ARCHIVE_FIELDS).iterator(chunk_size=2000):
+            writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+    with open(temp_path, 'rb') as archive:
+        os.fsync(archive.fileno())
+    os.replace(temp_path, path)
+    return path
+
+
+def prune_visits(cutoff, batch_size=5000, archive_dir=None, sleep=0, dry_run=False):
+    """
+    分批删除早于 cutoff 且已经汇总过的访问记录，返回删除的记录数
+    每批按主键范围 [start, start + batch_size) 删除；archive_dir 不为空时先导出再删除
+    """
+    expired = VisitStatistics.objects.filter(visit_time__lt=cutoff, id__lte=_rolled_up_id())
+    bounds = expired.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return 0
+    if dry_run:
+        return expired.count()
+
+    _mark_pruned(bounds['high'])
+    deleted = 0
+    start = bounds['low']
+    while start <= bounds['high']:
+        end = min(start + batch_size, bounds['high'] + 1)
+        batch = expired.filter(id__gte=start, id__lt=end)
+        with transaction.atomic():
+            if archive_dir and batch.exists():
+                archive_rows(batch, archive_dir, f'visits_{start}_{end - 1}')
+            count, _ = batch.delete()
+        deleted += count
+        start = end
+        if sleep:
+            # 让出数据库，避免清理大量积压数据时影响线上请求
+            time.sleep(sleep)
+    return deleted
+
+
+def prune_hourly_rollups(days=None, batch_size=5000):
+    """删除超出保留期的小时汇总，返回删除的行数"""
+    days = getattr(settings, 'VISIT_HOURLY_ROLLUP_RETENTION_DAYS', 90) if days is None else days
+    if not days:
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        ids = list(VisitHourlyRollup.objects.filter(hour__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        count, _ = VisitHourlyRollup.objects.filter(id__in=ids).delete()
+        deleted += count
+
+
+class PostgresPartitions:
+    """
+    PostgreSQL 按月分区的访问记录表
+    分区名为 <表名>_pYYYYMM，范围为 [月初, 下月初)（UTC）；
+    时间超出已建分区范围的记录（如时钟异常）写入 <表名>_default 分区，而不是插入失败。
+    新建月分区时 PostgreSQL 会检查 DEFAULT 分区中有没有属于该月的记录，有则建分区失败，
+    因此月分区按 VISIT_PARTITION_MONTHS_AHEAD 提前创建
+    """
+
+    def __init__(self):
+        self.table = VisitStatistics._meta.db_table
+
+    @staticmethod
+    def available():
+        return connection.vendor == 'postgresql'
+
+    def is_partitioned(self):
+        if not self.available():
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid '
+                'WHERE c.relname = %s AND pg_table_is_visible(c.oid)',
+                [self.table]
+            )
+            return cursor.fetchone() is not None
+
+    @staticmethod
+    def _month_start(value):
+        return date(value.year, value.month, 1)
+
+    @staticmethod
+    def _next_month(value):
+        return date(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+    def partition_name(self, month):
+        return f'{self.table}_p{month:%Y%m}'
+
+    @property
+    def default_partition(self):
+        return f'{self.table}_default'
+
+    def ensure_partitions(self, start, months_ahead=None):
+        """创建从 start 所在月份到当前月份之后 months_ahead 个月的分区（幂等）"""
+        months_ahead = getattr(settings, 'VISIT_PARTITION_MONTHS_AHEAD', 2) if months_ahead is None else months_ahead
+        month = self._month_start(start)
+        last = self._month_start(timezone.now().date())
+        for _ in range(months_ahead):
+            last = self._next_month(last)
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {quote(self.default_partition)} '
+                f'PARTITION OF {quote(self.table)} DEFAULT'
+            )
+            while month <= last:
+                upper = self._next_month(month)
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {quote(self.partition_name(month))} '
+                    f'PARTITION OF {quote(self.table)} '
+                    f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{upper.isoformat()} 00:00:00+00')"
+                )
+                month = upper
+
+    def partitions(self):
+        """现有分区 [(名称, 月初)]，按时间排序"""
+        prefix = f'{self.table}_p'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT c.relname FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent '
+                'WHERE p.relname = %s ORDER BY c.relname',
+                [self.table]
+            )
+            names = [row[0] for row in cursor.fetchall()]
+        result = []
+        for name in names:
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and len(suffix) == 6 and suffix.isdigit():
+                result.append((name, date(int(suffix[:4]), int(suffix[4:]), 1)))
+        return result
+
+    def drop_expired(self, cutoff, archive_dir=None, dry_run=False):
+        """
+        删除整个月都早于 cutoff 且已经汇总过的分区，以及 DEFAULT 分区中的过期记录，返回删除的记录数
+        archive_dir 不为空时先把分区导出
+        """
+        quote = connection.ops.quote_name
+        rolled_up_id = _rolled_up_id()
+        deleted = 0
+        # DEFAULT 分区中的记录很少，按行删除（较早转换的表在 ensure_partitions 之前可能还没有 DEFAULT 分区）
+        expired_ids = []
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [self.default_partition])
+            if cursor.fetchone()[0] is not None:
+                cursor.execute(
+                    f'SELECT id FROM {quote(self.default_partition)} WHERE visit_time < %s AND id <= %s',
+                    [cutoff, rolled_up_id]
+                )
+                expired_ids = [row[0] for row in cursor.fetchall()]
+        if expired_ids and not dry_run:
+            _mark_pruned(max(expired_ids))
+            rows = VisitStatistics.objects.filter(id__in=expired_ids, visit_time__lt=cutoff)
+            with transaction.atomic():
+                if archive_dir:
+                    archive_rows(rows, archive_dir, f'{self.default_partition}_{min(expired_ids)}_{max(expired_ids)}')
+                rows.delete()
+        deleted += len(expired_ids)
+
+        for name, month in self.partitions():
+            upper = self._next_month(month)
+            upper_time = datetime(upper.year, upper.month, 1, tzinfo=dt_timezone.utc)
+            if upper_time > cutoff:
+                break
+            rows = VisitStatistics.objects.filter(
+                visit_time__gte=datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc),
+                visit_time__lt=upper_time,
+            )
+            if rows.filter(id__gt=rolled_up_id).exists():
+                # 分区中还有未汇总的记录，等汇总追上之后再删除
+                break
+            count = rows.count()
+            if dry_run:
+                deleted += count
+                continue
+            if count:
+                _mark_pruned(rows.aggregate(last=Max('id'))['last'])
+            if archive_dir and count:
+                archive_rows(rows, archive_dir, name)
+            with connection.cursor() as cursor:
+                cursor.execute(f'ALTER TABLE {quote(self.table)} DETACH PARTITION {quote(name)}')
+                cursor.execute(f'DROP TABLE {quote(name)}')
+            deleted += count
+        return deleted
+
+    def convert(self):
+        """
+        把现有的访问记录表转换为按月分区的表（一次性操作，在一个事务中完成）
+        分区表的主键必须包含分区键，因此主键改为 (id, visit_time)；ID 序列从现有最大值继续，
+        用户代理外键和 visit_time、agent_id 索引在新表上重新创建
+        """
+        if not self.available():
+            raise RuntimeError('只有 PostgreSQL 支持分区表')
+        if self.is_partitioned():
+            return False
+        quote = connection.ops.quote_name
+        table = quote(self.table)
+        old = quote(f'{self.table}_unpartitioned')
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+            cursor.execute(f'SELECT min(visit_time) FROM {table}')
+            oldest = cursor.fetchone()[0] or timezone.now()
+            cursor.execute(f'ALTER TABLE {table} RENAME TO {old}')
+            cursor.execute(
+                "SELECT attidentity FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'id'",
+                [f'{self.table}_unpartitioned']
+            )
+            is_identity = bool(cursor.fetchone()[0])
+            cursor.execute(
+                f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY) '
+                f'PARTITION BY RANGE (visit_time)'
+            )
+            if not is_identity:
+                # serial 列的序列归旧表所有，删除旧表前转给新表
+                cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [f'{self.table}_unpartitioned'])
+                cursor.execute(f'ALTER SEQUENCE {cursor.fetchone()[0]} OWNED BY {table}.id')
+            # 旧表的主键约束名仍被占用，新主键使用不同的名称
+            cursor.execute(
+                f'ALTER TABLE {table} ADD CONSTRAINT {quote(self.table + "_partitioned_pkey")} '
+                f'PRIMARY KEY (id, visit_time)'
+            )
+            # LIKE 不复制外键和索引，按模型重新创建；外键约束名同样与旧表冲突
+            cursor.execute(f'CREATE INDEX ON {table} (visit_time)')
+            cursor.execute(f'CREATE INDEX ON {table} (agent_id)')
+            cursor.execute(
+                f'ALTER TABLE {table} ADD CONSTRAINT {quote(self.table + "_partitioned_agent_id_fk")} '
+                f'FOREIGN KEY (agent_id) REFERENCES {quote(UserAgent._meta.db_table)} (id) '
+                f'DEFERRABLE INITIALLY DEFERRED'
+            )
+            self.ensure_partitions(oldest)
+            cursor.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                f'(SELECT coalesce(max(id), 0) + 1 FROM {table}), false)',
+                [self.table]
+            )
+            cursor.execute(f'DROP TABLE {old}')
+        return True
+
+
+def run(batch_size=5000, archive_dir=None, sleep=0, dry_run=False, days=None):
+    """执行一次完整的清理，返回 {'visits': n, 'hourly_rollups': n, 'latency': n, 'slow_requests': n}"""
+    result = {'visits': 0, 'hourly_rollups': 0, 'latency': 0, 'slow_requests': 0}
+    cutoff = visit_cutoff(days)
+    if cutoff is not None:
+        partitions = PostgresPartitions()
+        if partitions.is_partitioned():
+            if not dry_run:
+                partitions.ensure_partitions(timezone.now())
+            result['visits'] = partitions.drop_expired(cutoff, archive_dir=archive_dir, dry_run=dry_run)
+        else:
+            result['visits'] = prune_visits(cutoff, batch_size=batch_size, archive_dir=archive_dir,
+                                            sleep=sleep, dry_run=dry_run)
+    if not dry_run:
+        result['hourly_rollups'] = prune_hourly_rollups(batch_size=batch_size)
+        result['latency'] = prune_latency()
+        result['slow_requests'] = prune_slow_requests()
+    return result
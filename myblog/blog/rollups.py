@@ -0,0 +1,185 @@
+"""
+访问统计汇总
+将原始访问记录增量汇总到小时表和日表，统计面板只读取汇总表
+"""
+
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, Sum
+from django.utils import timezone
+
+from .models import VisitStatistics, VisitHourlyRollup, VisitDailyRollup, VisitRollupState
+from .agents import OTHER
+
+logger = logging.getLogger(__name__)
+
+STATE_NAME = 'visits'
+# 清理过期访问记录时写入的标记，last_visit_id 为删除到的最大记录ID
+PRUNED_STATE_NAME = 'pruned'
+
+# 本进程上次尝试增量汇总的时间
+_last_refresh = 0.0
+
+
+def _fetch_batch(last_id, batch_size):
+    """
+    读取下一批待汇总的访问记录
+    只处理超过延迟窗口的记录，避免跳过尚未提交的较小ID
+    """
+    lag = getattr(settings, 'VISIT_ROLLUP_LAG', 60)
+    cutoff = timezone.now() - timedelta(seconds=lag)
+    rows = list(
+        VisitStatistics.objects.filter(id__gt=last_id)
+        .order_by('id')
+        .values_list('id', 'visit_time', 'path', 'status_code', 'agent__browser_family')[:batch_size]
+    )
+    for index, row in enumerate(rows):
+        if row[1] >= cutoff:
+            return rows[:index]
+    return rows
+
+
+def _aggregate(rows):
+    """
+    按小时/日期、路径、状态码和浏览器分组计数
+    独立访客由 visitors.py 的每日草图单独统计，汇总表只保存访问次数
+    """
+    hourly = defaultdict(int)
+    daily = defaultdict(int)
+
+    for _, visit_time, path, status_code, browser in rows:
+        local_time = timezone.localtime(visit_time)
+        hour = local_time.replace(minute=0, second=0, microsecond=0)
+        # 浏览器分类在用户代理维度表中已经算好
+        browser = browser or OTHER
+
+        hourly[(hour, path, status_code, browser)] += 1
+        daily[(local_time.date(), path, status_code, browser)] += 1
+
+    return hourly, daily
+
+
+def _upsert(model, time_field, groups):
+    """将分组结果合并进汇总表"""
+    if not groups:
+        return
+
+    existing = model.objects.filter(
+        **{f'{time_field}__in': {key[0] for key in groups}},
+        path__in={key[1] for key in groups},
+    )
+    to_update = []
+    for row in existing:
+        key = (getattr(row, time_field), row.path, row.status_code, row.browser_family)
+        count = groups.pop(key, None)
+        if count is None:
+            continue
+        row.visit_count += count
+        to_update.append(row)
+
+    if to_update:
+        model.objects.bulk_update(to_update, ['visit_count'])
+
+    model.objects.bulk_create([
+        model(**{time_field: key[0]}, path=key[1], status_code=key[2], browser_family=key[3],
+              visit_count=count)
+        for key, count in groups.items()
+    ])
+
+
+def update_rollups(batch_size=5000, max_batches=None):
+    """
+    增量汇总新的访问记录
+    通过条件更新汇总进度来抢占批次，多个进程同时运行时不会重复计数
+    返回本次汇总的记录数
+    """
+    state, _ = VisitRollupState.objects.get_or_create(name=STATE_NAME)
+    processed = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            last_id = VisitRollupState.objects.values_list('last_visit_id', flat=True).get(pk=state.pk)
+            rows = _fetch_batch(last_id, batch_size)
+            if not rows:
+                break
+
+            claimed = VisitRollupState.objects.filter(pk=state.pk, last_visit_id=last_id)\
+                .update(last_visit_id=rows[-1][0], updated_at=timezone.now())
+            if not claimed:
+                # 其他进程已经处理了这一批
+                break
+
+            hourly, daily = _aggregate(rows)
+            _upsert(VisitHourlyRollup, 'hour', hourly)
+            _upsert(VisitDailyRollup, 'date', daily)
+
+        processed += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+
+    return processed
+
+
+def refresh_rollups():
+    """
+    在读取汇总表前按需做一次小批量增量汇总
+    每个进程最多每 VISIT_ROLLUP_REFRESH_INTERVAL 秒执行一次，积压较多时交给管理命令处理
+    """
+    global _last_refresh
+
+    interval = getattr(settings, 'VISIT_ROLLUP_REFRESH_INTERVAL', 60)
+    now = time.monotonic()
+    if _last_refresh and now - _last_refresh < interval:
+        return 0
+    _last_refresh = now
+
+    try:
+        return update_rollups(max_batches=1)
+    except Exception:
+        logger.exception('访问统计增量汇总失败')
+        return 0
+
+
+def history_pruned():
+    """
+    汇总表中是否有已经无法从原始访问记录重建的数据
+    清理过访问记录，或日汇总早于最早的访问记录（标记出现之前的清理）时返回 True
+    """
+    if VisitRollupState.objects.filter(name=PRUNED_STATE_NAME).exists():
+        return True
+    first_rollup = VisitDailyRollup.objects.aggregate(first=Min('date'))['first']
+    if first_rollup is None:
+        return False
+    first_visit = VisitStatistics.objects.aggregate(first=Min('visit_time'))['first']
+    return first_visit is None or first_rollup < timezone.localtime(first_visit).date()
+
+
+def rebuild_rollups(batch_size=5000):
+    """
+    清空汇总表并从原始访问记录重新汇总
+    访问记录清理过之后，清理前的统计只保存在汇总表中，此时拒绝重建
+    """
+    if history_pruned():
+        raise RuntimeError('访问记录已经清理过，重建会丢失清理前的统计数据')
+    with transaction.atomic():
+        VisitHourlyRollup.objects.all().delete()
+        VisitDailyRollup.objects.all().delete()
+        VisitRollupState.objects.update_or_create(name=STATE_NAME, defaults={'last_visit_id': 0})
+    return update_rollups(batch_size=batch_size)
+
+
+def total_visits(start_date=None, end_date=None):
+    """日期范围内的访问总数"""
+    queryset = VisitDailyRollup.objects.all()
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    return queryset.aggregate(total=Sum('visit_count'))['total'] or 0
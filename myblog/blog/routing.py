@@ -0,0 +1,12 @@
+"""
+WebSocket 路由配置
+"""
+
+from django.urls import path
+from . import consumers
+
+websocket_urlpatterns = [
+    path('ws/chat/', consumers.ChatConsumer.as_asgi()),
+    path('ws/private-chat/<int:user_id>/', consumers.PrivateChatConsumer.as_asgi()),
+    path('ws/notifications/', consumers.NotificationConsumer.as_asgi()),
+]
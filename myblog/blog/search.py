@@ -0,0 +1,268 @@
+"""
+文章全文检索
+倒排索引存放在独立的表中，文章保存和删除时通过信号同步：
+- PostgreSQL：tsvector 列 + GIN 索引，按 ts_rank_cd 排序
+- SQLite：FTS5 虚拟表，按 bm25 排序
+- 其他数据库或 FTS5 不可用时退回 LIKE 查询
+
+PostgreSQL 和 FTS5 的内置分词器都不会切分中文，这里先在 Python 中分词：
+连续的中日韩字符切成重叠的二元组，其他文字按单词切分并转为小写，
+再把空格分隔的词元交给数据库建索引
+"""
+
+import logging
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Case, IntegerField, Q, When
+
+logger = logging.getLogger(__name__)
+
+CJK_RANGES = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'  # 假名、中日韩统一表意文字、谚文
+TOKEN_RE = re.compile(rf'[{CJK_RANGES}]+|[^\W{CJK_RANGES}]+')
+CJK_RE = re.compile(rf'[{CJK_RANGES}]')
+
+MAX_QUERY_TOKENS = 32
+
+
+def tokenize(text):
+    """将文本切分为索引词元：中日韩字符取二元组，其他单词转小写"""
+    tokens = []
+    for match in TOKEN_RE.finditer(text or ''):
+        run = match.group()
+        if CJK_RE.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def tokenize_query(query):
+    """
+    将搜索词切分为 (词元, 是否前缀匹配) 列表
+    单个中文字符在索引中只会作为二元组的一部分出现，因此按前缀匹配
+    """
+    terms = []
+    seen = set()
+    for token in tokenize(query):
+        if token in seen:
+            continue
+        seen.add(token)
+        terms.append((token, len(token) == 1 and bool(CJK_RE.match(token))))
+    return terms[:MAX_QUERY_TOKENS]
+
+
+def _document(post):
+    """文章各字段的分词结果"""
+    return (
+        ' '.join(tokenize(post.title)),
+        ' '.join(tokenize(post.summary)),
+        ' '.join(tokenize(post.content)),
+    )
+
+
+class BaseSearchBackend:
+    """检索后端基类"""
+
+    def ensure_index(self):
+        """创建索引表（幂等）"""
+
+    def drop_index(self):
+        """删除索引表"""
+
+    def index_post(self, post):
+        """写入或更新一篇文章的索引"""
+
+    def remove_post(self, post_id):
+        """删除一篇文章的索引"""
+
+    def search(self, terms, limit):
+        """返回按相关度排序的文章 ID 列表；返回 None 表示不支持索引检索"""
+        return None
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """PostgreSQL tsvector + GIN 索引，标题、摘要、正文分别加权 A/B/C"""
+    table = 'blog_post_search'
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} ('
+                f'post_id bigint PRIMARY KEY REFERENCES blog_post (id) ON DELETE CASCADE, '
+                f'document tsvector NOT NULL)'
+            )
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {self.table}_document_gin '
+                f'ON {self.table} USING gin (document)'
+            )
+
+    def drop_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.table} (post_id, document) VALUES (%s, '
+                f"setweight(to_tsvector('simple', %s), 'A') || "
+                f"setweight(to_tsvector('simple', %s), 'B') || "
+                f"setweight(to_tsvector('simple', %s), 'C')) "
+                f'ON CONFLICT (post_id) DO UPDATE SET document = EXCLUDED.document',
+                [post.pk, *_document(post)]
+            )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE post_id = %s', [post_id])
+
+    def search(self, terms, limit):
+        # 词元只包含单词字符，可以安全地直接拼入 tsquery
+        tsquery = ' & '.join(f"'{token}'" + (':*' if prefix else '') for token, prefix in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT post_id FROM {self.table}, to_tsquery('simple', %s) query "
+                f'WHERE document @@ query '
+                f'ORDER BY ts_rank_cd(document, query) DESC, post_id DESC LIMIT %s',
+                [tsquery, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    """SQLite FTS5 虚拟表，rowid 即文章 ID"""
+    table = 'blog_post_fts'
+
+    def ensure_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f"USING fts5(title, summary, content, tokenize = 'unicode61')"
+            )
+
+    def drop_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+    def index_post(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, summary, content) VALUES (%s, %s, %s, %s)',
+                [post.pk, *_document(post)]
+            )
+
+    def remove_post(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post_id])
+
+    def search(self, terms, limit):
+        match = ' '.join(f'"{token}"' + ('*' if prefix else '') for token, prefix in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, 10.0, 5.0, 1.0), rowid DESC LIMIT %s',
+                [match, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+_backend = None
+
+
+def get_backend():
+    """按当前数据库选择检索后端，索引表不可用时退回 LIKE 查询"""
+    global _backend
+    if _backend is None:
+        if not getattr(settings, 'SEARCH_INDEX_ENABLED', True):
+            backend = BaseSearchBackend()
+        elif connection.vendor == 'postgresql':
+            backend = PostgresSearchBackend()
+        elif connection.vendor == 'sqlite':
+            backend = SqliteSearchBackend()
+        else:
+            backend = BaseSearchBackend()
+
+        try:
+            backend.ensure_index()
+        except DatabaseError:
+            logger.exception('创建全文索引失败，搜索退回 LIKE 查询')
+            backend = BaseSearchBackend()
+        _backend = backend
+    return _backend
+
+
+def _call(method, *args):
+    """
+    在保存点中调用后端方法
+    建表语句可能随所在的事务一起被回滚，表不存在时重新建表后重试一次
+    """
+    backend = get_backend()
+    try:
+        with transaction.atomic():
+            return getattr(backend, method)(*args)
+    except DatabaseError:
+        with transaction.atomic():
+            backend.ensure_index()
+            return getattr(backend, method)(*args)
+
+
+def index_post(post):
+    """更新文章索引（由 post_save 信号调用）"""
+    _call('index_post', post)
+
+
+def remove_post(post_id):
+    """删除文章索引（由 post_delete 信号调用）"""
+    _call('remove_post', post_id)
+
+
+def rebuild_index(batch_size=500):
+    """删除并重建全部文章的索引，返回索引的文章数"""
+    from .models import Post
+
+    backend = get_backend()
+    backend.drop_index()
+    backend.ensure_index()
+
+    count = 0
+    posts = Post.objects.only('id', 'title', 'summary', 'content').order_by('pk')
+    for post in posts.iterator(chunk_size=batch_size):
+        backend.index_post(post)
+        count += 1
+    return count
+
+
+def search_posts(queryset, query):
+    """
+    在 queryset 范围内搜索文章，结果按相关度排序
+    索引最多返回 SEARCH_MAX_RESULTS 条，后续的分页和过滤只在这些文章中进行
+    """
+    terms = tokenize_query(query)
+    if not terms:
+        return queryset.none()
+
+    post_ids = None
+    try:
+        post_ids = _call('search', terms, getattr(settings, 'SEARCH_MAX_RESULTS', 500))
+    except DatabaseError:
+        logger.exception('全文检索失败，退回 LIKE 查询')
+
+    if post_ids is None:
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(content__icontains=query) |
+            Q(summary__icontains=query)
+        )
+    if not post_ids:
+        return queryset.none()
+
+    rank = Case(
+        *[When(pk=post_id, then=position) for position, post_id in enumerate(post_ids)],
+        output_field=IntegerField()
+    )
+    return queryset.filter(pk__in=post_ids).annotate(search_rank=rank).order_by('search_rank')
@@ -0,0 +1,34 @@
+"""
+侧边栏数据
+分类、标签的文章数和热门文章整体缓存为一个条目，任何视图都可以通过一次缓存读取拿到全部数据；
+文章数是 Category/Tag 上的冗余列（由 signals.py 维护），缓存未命中时也只需几条简单查询
+缓存键带有内容版本号，内容变化时随页面缓存一起失效
+"""
+
+from django.conf import settings
+
+from . import caching
+from .models import Category, Post, Tag
+
+
+def _build():
+    """从数据库读取侧边栏数据，只保留模板需要的字段"""
+    popular_count = getattr(settings, 'SIDEBAR_POPULAR_POSTS', 5)
+    return {
+        'categories': list(Category.objects.values('id', 'name', 'post_count')),
+        'tags': list(Tag.objects.values('id', 'name', 'post_count')),
+        'popular_posts': list(
+            Post.objects.filter(status='published')
+            .order_by('-view_count')
+            .values('id', 'title', 'view_count')[:popular_count]
+        ),
+    }
+
+
+def get_sidebar_data():
+    """
+    获取侧边栏数据：{'categories': [...], 'tags': [...], 'popular_posts': [...]}
+    各项为字典列表，模板中的用法与模型实例相同（category.id / category.name / category.post_count）
+    """
+    key = f'sidebar:{caching.get_version()}'
+    return caching.get_or_build(key, _build, getattr(settings, 'SIDEBAR_CACHE_TIMEOUT', 600))
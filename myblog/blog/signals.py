@@ -0,0 +1,204 @@
+"""
+信号处理
+模型变化时同步派生数据
+"""
+
+import logging
+import threading
+
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import caching, comments, related, search
+from .models import Category, Comment, Post, Tag
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Post)
+def update_post_search_index(sender, instance, raw=False, **kwargs):
+    """文章保存后更新全文索引"""
+    if raw:
+        return
+    try:
+        search.index_post(instance)
+    except Exception:
+        logger.exception('更新文章 %s 的全文索引失败', instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_search_index(sender, instance, **kwargs):
+    """文章删除后移除全文索引"""
+    try:
+        search.remove_post(instance.pk)
+    except Exception:
+        logger.exception('删除文章 %s 的全文索引失败', instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, raw=False, **kwargs):
+    """记录保存前的分类和状态，保存后据此判断是否需要重新统计文章数"""
+    instance._previous_state = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_state = Post.objects.filter(pk=instance.pk)\
+        .values('category_id', 'status').first()
+
+
+@receiver(post_save, sender=Post)
+def update_post_counts_on_save(sender, instance, created, raw=False, **kwargs):
+    """分类或发布状态变化时重新统计相关分类和标签的文章数"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if previous is None:
+        previous = {'category_id': None, 'status': None}
+
+    if previous['category_id'] != instance.category_id or previous['status'] != instance.status:
+        Category.refresh_post_counts({previous['category_id'], instance.category_id})
+    if not created and previous['status'] != instance.status:
+        Tag.refresh_post_counts(list(instance.tags.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Post)
+def remember_post_tags(sender, instance, **kwargs):
+    """删除前记录文章的标签，删除后关联行已不存在"""
+    instance._deleted_tag_ids = list(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Post)
+def update_post_counts_on_delete(sender, instance, **kwargs):
+    """文章删除后重新统计所属分类和标签的文章数"""
+    Category.refresh_post_counts([instance.category_id])
+    Tag.refresh_post_counts(getattr(instance, '_deleted_tag_ids', []))
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_tag_post_counts(sender, instance, action, reverse, pk_set, **kwargs):
+    """文章标签变化后重新统计受影响标签的文章数"""
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_tag_ids = [instance.pk]
+        else:
+            instance._cleared_tag_ids = list(instance.tags.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        Tag.refresh_post_counts(getattr(instance, '_cleared_tag_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        Tag.refresh_post_counts([instance.pk] if reverse else pk_set)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_tree(sender, instance, raw=False, **kwargs):
+    """评论变化后使所属文章的评论树缓存失效；等事务提交后再失效，避免并发请求把旧数据重新写回缓存"""
+    if raw:
+        return
+    post_id = instance.post_id
+
+    def invalidate():
+        try:
+            comments.invalidate(post_id)
+        except Exception:
+            logger.exception('使文章 %s 的评论缓存失效失败', post_id)
+
+    transaction.on_commit(invalidate)
+
+
+# 等待事务提交后刷新相关文章的文章ID（按线程，提交回调与保存在同一线程中执行）
+_pending_related = threading.local()
+
+
+def _flush_related():
+    post_ids = getattr(_pending_related, 'post_ids', None)
+    if not post_ids:
+        return
+    _pending_related.post_ids = set()
+    try:
+        related.refresh_around(post_ids)
+    except Exception:
+        logger.exception('刷新文章 %s 的相关文章失败', sorted(post_ids))
+
+
+def _refresh_related(post_ids):
+    """
+    事务提交后刷新相关文章，避免读到之后回滚的数据
+    一次保存会先后触发 post_save 和标签的 clear、add，同一事务内涉及的文章合并，由第一个提交回调一次刷新完
+    （事务回滚时残留的文章ID会在下一次提交时顺带刷新，刷新读取的是已提交的数据，不影响结果）
+    """
+    post_ids = set(post_ids)
+    if not post_ids:
+        return
+    if not hasattr(_pending_related, 'post_ids'):
+        _pending_related.post_ids = set()
+    _pending_related.post_ids.update(post_ids)
+    transaction.on_commit(_flush_related)
+
+
+@receiver(post_save, sender=Post)
+def update_related_posts_on_save(sender, instance, created, raw=False, **kwargs):
+    """新文章、分类或发布状态变化时刷新相关文章（标签变化由 m2m_changed 处理）"""
+    if raw:
+        return
+    previous = getattr(instance, '_previous_state', None)
+    if created or previous is None or \
+            previous['category_id'] != instance.category_id or previous['status'] != instance.status:
+        _refresh_related([instance.pk])
+
+
+@receiver(m2m_changed, sender=Post.tags.through)
+def update_related_posts_on_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    """文章标签变化后刷新相关文章；从标签一侧修改时刷新涉及的文章"""
+    if action == 'pre_clear' and reverse:
+        instance._cleared_post_ids = list(instance.post_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        _refresh_related(getattr(instance, '_cleared_post_ids', []) if reverse else [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        _refresh_related(pk_set if reverse else [instance.pk])
+
+
+@receiver(pre_delete, sender=Post)
+def remember_related_listings(sender, instance, **kwargs):
+    """删除前记录把该文章列为相关文章的文章，删除后为它们补上新的相关文章"""
+    instance._listing_post_ids = related.listing_posts(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def update_related_posts_on_delete(sender, instance, **kwargs):
+    post_id = instance.pk
+    listing_post_ids = getattr(instance, '_listing_post_ids', set()) - {post_id}
+
+    def refresh():
+        try:
+            related.refresh_posts(listing_post_ids)
+        except Exception:
+            logger.exception('刷新文章 %s 删除后的相关文章失败', post_id)
+
+    transaction.on_commit(refresh)
+
+
+# 缓存失效放在统计更新之后注册，保证重建的缓存读到的是新计数
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(m2m_changed, sender=Post.tags.through)
+def invalidate_page_cache(sender, **kwargs):
+    """
+    内容变化后递增版本号，使页面缓存和侧边栏片段缓存失效
+    与评论树一样等事务提交后再失效，避免提交前的并发请求按新版本号缓存旧内容
+    """
+    if kwargs.get('raw'):
+        return
+
+    def invalidate():
+        try:
+            caching.bump_version()
+        except Exception:
+            logger.exception('使页面缓存失效失败')
+
+    transaction.on_commit(invalidate)
@@ -0,0 +1,146 @@
+"""
+基数估计草图
+使用 HyperLogLog 估算独立访客数，草图之间可以合并
+"""
+
+import hashlib
+import math
+import zlib
+
+
+def precision_for_error(error_rate):
+    """根据期望的标准误差计算所需精度：error ≈ 1.04 / sqrt(2^p)"""
+    if not 0 < error_rate < 1:
+        raise ValueError('error_rate 必须在 0 到 1 之间')
+    precision = math.ceil(math.log2((1.04 / error_rate) ** 2))
+    return max(HyperLogLog.MIN_PRECISION, min(HyperLogLog.MAX_PRECISION, precision))
+
+
+class HyperLogLog:
+    """
+    HyperLogLog 基数估计
+    precision 为寄存器位数 p，寄存器数量 m = 2^p，标准误差约为 1.04 / sqrt(m)
+    """
+    MIN_PRECISION = 4
+    MAX_PRECISION = 16
+
+    def __init__(self, precision=12, registers=None):
+        if not self.MIN_PRECISION <= precision <= self.MAX_PRECISION:
+            raise ValueError(f'precision 必须在 {self.MIN_PRECISION} 到 {self.MAX_PRECISION} 之间')
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = bytearray(self.m)
+        elif len(registers) != self.m:
+            raise ValueError('寄存器数量与精度不匹配')
+        self.registers = bytearray(registers)
+
+    @staticmethod
+    def _hash(value):
+        """64 位哈希"""
+        if not isinstance(value, bytes):
+            value = str(value).encode('utf-8')
+        return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        """添加一个元素"""
+        h = self._hash(value)
+        index = h >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        w = h & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - w.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """批量添加元素"""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """合并另一个草图（逐寄存器取最大值），精度不同时需先降低精度"""
+        if other.precision != self.precision:
+            raise ValueError('只能合并精度相同的草图')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    @property
+    def error_rate(self):
+        """理论标准误差"""
+        return 1.04 / math.sqrt(self.m)
+
+    def reduce_precision(self, precision):
+        """
+        降低精度，返回新的草图
+        被移出索引的低位拼接到剩余哈希位之前，重新计算前导零位置
+        """
+        if precision > self.precision:
+            raise ValueError('只能降低精度')
+        if precision == self.precision:
+            return HyperLogLog(self.precision, self.registers)
+
+        shift = self.precision - precision
+        result = HyperLogLog(precision)
+        for index, rank in enumerate(self.registers):
+            if not rank:
+                continue
+            dropped = index & ((1 << shift) - 1)
+            if dropped:
+                new_rank = shift - dropped.bit_length() + 1
+            else:
+                new_rank = shift + rank
+            new_index = index >> shift
+            if new_rank > result.registers[new_index]:
+                result.registers[new_index] = new_rank
+        return result
+
+    def count(self):
+        """估算基数"""
+        m = self.m
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # 小基数时使用线性计数修正
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    def to_bytes(self):
+        """序列化：1 字节精度 + 压缩后的寄存器"""
+        return bytes([self.precision]) + zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """从 to_bytes() 的结果恢复草图"""
+        data = bytes(data)
+        return cls(precision=data[0], registers=zlib.decompress(data[1:]))
+
+    @classmethod
+    def merge_all(cls, sketches, precision):
+        """
+        合并多个草图，sketches 可以是 HyperLogLog 实例或序列化后的字节
+        精度高于 precision 的草图会先降低精度；出现更低精度时整体降到该精度
+        """
+        result = cls(precision=precision)
+        for sketch in sketches:
+            if not sketch:
+                continue
+            if not isinstance(sketch, cls):
+                sketch = cls.from_bytes(sketch)
+            if sketch.precision > result.precision:
+                sketch = sketch.reduce_precision(result.precision)
+            elif sketch.precision < result.precision:
+                result = result.reduce_precision(sketch.precision)
+            result.merge(sketch)
+        return result
@@ -181,28 +181,67 @@ const BlogUtils = {
 // 在 main.js 末尾添加以下代码
 
 // 私聊功能 - 更新未读消息计数
+function setPrivateChatUnreadBadge(totalUnread) {
+    const unreadBadge = document.querySelector('.private-chat-unread');
+    if (unreadBadge) {
+        if (totalUnread > 0) {
+            unreadBadge.textContent = totalUnread;
+            unreadBadge.style.display = 'inline';
+        } else {
+            unreadBadge.style.display = 'none';
+        }
+    }
+}
+
 function updatePrivateChatUnreadCount() {
     fetch('/api/private-chat/summary/')
         .then(response => response.json())
-        .then(data => {
-            const unreadBadge = document.querySelector('.private-chat-unread');
-            if (unreadBadge) {
-                if (data.total_unread > 0) {
-                    unreadBadge.textContent = data.total_unread;
-                    unreadBadge.style.display = 'inline';
-                } else {
-                    unreadBadge.style.display = 'none';
-                }
-            }
-        })
+        .then(data => setPrivateChatUnreadBadge(data.total_unread))
         .catch(error => console.error('获取私聊摘要失败:', error));
 }
 
+// 未读计数优先通过 WebSocket 推送，服务端未启用 WebSocket 或连接不可用时每分钟轮询一次
+let unreadPollingInterval = null;
+
+function startUnreadPolling() {
+    if (unreadPollingInterval) return;
+    updatePrivateChatUnreadCount();
+    unreadPollingInterval = setInterval(updatePrivateChatUnreadCount, 60000);
+}
+
+function connectNotificationSocket() {
+    if (!WEBSOCKET_ENABLED || !('WebSocket' in window)) {
+        startUnreadPolling();
+        return;
+    }
+
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    let socket;
+    try {
+        socket = new WebSocket(`${protocol}://${window.location.host}/ws/notifications/`);
+    } catch (error) {
+        startUnreadPolling();
+        return;
+    }
+
+    socket.addEventListener('open', () => {
+        if (unreadPollingInterval) {
+            clearInterval(unreadPollingInterval);
+            unreadPollingInterval = null;
+        }
+    });
+    socket.addEventListener('message', (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'unread_count') {
+            setPrivateChatUnreadBadge(data.total_unread);
+        }
+    });
+    socket.addEventListener('close', startUnreadPolling);
+}
+
 // 页面加载时更新未读计数
 if (document.querySelector('.private-chat-unread')) {
-    updatePrivateChatUnreadCount();
-    // 每分钟更新一次
-    setInterval(updatePrivateChatUnreadCount, 60000);
+    connectNotificationSocket();
 }
 
 // 用户在线状态（简化版）
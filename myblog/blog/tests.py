@@ -0,0 +1,597 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import caching, comments, realtime, related, signals
+from .agents import interner
+from .buffers import view_count_buffer, visit_buffer
+from .chat_backends import DatabaseChatBackend, MemoryChatBackend
+from .forms import CommentForm
+from .latency import latency_recorder
+from .models import (Category, Comment, DocumentFrequency, Post, RelatedPost, Tag, UserAgent, VisitDailyRollup, VisitHourlyRollup,
+                     VisitRollupState, VisitStatistics)
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .retention import prune_visits
+from .rollups import PRUNED_STATE_NAME, STATE_NAME, update_rollups
+from .sketches import HyperLogLog, precision_for_error
+from .utils import CircuitBreaker, CircuitOpenError, HttpClient
+
+
+def synthetic_ips(start, count):
+    """生成 count 个不重复的 IPv4 地址（10.0.0.0/8 网段内按序号分配）"""
+    return [f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}' for n in range(start, start + count)]
+
+
+class HyperLogLogTests(SimpleTestCase):
+    """HyperLogLog 的估算误差应落在 precision_for_error 给出的误差范围内"""
+
+    error_rate = 0.01
+
+    def assertWithinError(self, sketch, actual):
+        # 标准误差是一个标准差，取 3 倍作为断言的上界
+        bound = 3 * sketch.error_rate * actual
+        self.assertLessEqual(abs(sketch.count() - actual), bound)
+
+    def test_precision_matches_error_rate(self):
+        precision = precision_for_error(self.error_rate)
+        self.assertLessEqual(HyperLogLog(precision).error_rate, self.error_rate)
+        self.assertGreater(HyperLogLog(precision - 1).error_rate, self.error_rate)
+
+    def test_estimate_within_error(self):
+        precision = precision_for_error(self.error_rate)
+        for size in (1000, 20000, 100000):
+            with self.subTest(size=size):
+                sketch = HyperLogLog(precision)
+                sketch.update(synthetic_ips(0, size))
+                self.assertWithinError(sketch, size)
+
+    def test_duplicates_not_counted(self):
+        sketch = HyperLogLog(precision_for_error(self.error_rate))
+        ips = synthetic_ips(0, 5000)
+        for _ in range(3):
+            sketch.update(ips)
+        self.assertWithinError(sketch, 5000)
+
+    def test_merge_is_union(self):
+        precision = precision_for_error(self.error_rate)
+        first = HyperLogLog(precision)
+        second = HyperLogLog(precision)
+        # 两组地址有 10000 个重叠，并集共 50000 个
+        first.update(synthetic_ips(0, 30000))
+        second.update(synthetic_ips(20000, 30000))
+        merged = HyperLogLog.from_bytes(first.to_bytes()).merge(second)
+        self.assertWithinError(merged, 50000)
+
+    def test_merge_all_reduces_precision(self):
+        high = HyperLogLog(precision_for_error(self.error_rate))
+        low = HyperLogLog(10)
+        high.update(synthetic_ips(0, 30000))
+        low.update(synthetic_ips(20000, 30000))
+        merged = HyperLogLog.merge_all([high.to_bytes(), low, None], precision=high.precision)
+        self.assertEqual(merged.precision, 10)
+        self.assertWithinError(merged, 50000)
+
+    def test_merge_rejects_different_precision(self):
+        with self.assertRaises(ValueError):
+            HyperLogLog(10).merge(HyperLogLog(12))
+
+
+# 视图名称 -> (路径模板, 查询次数, 是否需要登录)
+# 查询次数按缓存全部未命中的最坏情况计算，且不应随数据量变化
+QUERY_BUDGETS = {
+    'home': ('/', 5, False),
+    'home_search': ('/?q=文章', 8, False),
+    'home_next_page': ('/?after={cursor}', 5, False),
+    'category': ('/category/{category_id}/', 5, False),
+    'tag': ('/tag/{tag_id}/', 5, False),
+    'post_detail': ('/post/{post_id}/', 10, False),
+    'my_posts': ('/my-posts/', 7, True),
+    'profile': ('/profile/', 9, True),
+}
+
+
+@override_settings(PAGE_CACHE_ENABLED=False, ALLOWED_HOSTS=['testserver'])
+class QueryBudgetTests(TestCase):
+    """各视图的查询次数固定，不随文章数和评论数增长（没有 N+1）"""
+
+    def setUp(self):
+        # 访问记录和响应时间不在测试中记录；浏览计数同步写入，随测试事务回滚
+        for patcher in (
+            mock.patch.object(visit_buffer, 'add'),
+            mock.patch.object(latency_recorder, 'enabled', False),
+            mock.patch.object(view_count_buffer, 'enabled', False),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='query_budget', password='unused')
+        self.categories = [Category.objects.create(name=f'分类{i}') for i in range(3)]
+        self.tags = [Tag.objects.create(name=f'标签{i}') for i in range(5)]
+        self.posts = []
+
+    def _seed(self, size):
+        """补足到 size 篇带分类和标签的文章，第一篇文章下补足到 size 条评论（一半是回复）"""
+        for i in range(len(self.posts), size):
+            post = Post.objects.create(
+                title=f'文章 {i}',
+                content=f'测试文章 {i} 的内容',
+                author=self.user,
+                category=self.categories[i % len(self.categories)],
+                status='published',
+            )
+            post.tags.add(self.tags[i % len(self.tags)], self.tags[(i + 1) % len(self.tags)])
+            self.posts.append(post)
+
+        first = self.posts[0]
+        existing = list(first.comments.order_by('id'))
+        for i in range(len(existing), size):
+            parent = existing[i // 2] if i % 2 and existing else None
+            existing.append(Comment.objects.create(
+                post=first, author=self.user, parent=parent, content=f'评论 {i}'))
+
+    def _check_budgets(self):
+        post = self.posts[0]
+        for name, (path, budget, login) in QUERY_BUDGETS.items():
+            url = path.format(
+                post_id=post.pk,
+                cursor=encode_cursor(post),
+                category_id=post.category_id,
+                tag_id=post.tags.values_list('pk', flat=True)[0],
+            )
+            if login:
+                self.client.force_login(self.user)
+            else:
+                self.client.logout()
+            # 每次请求前清空缓存，按最坏情况计数
+            cache.clear()
+            with self.subTest(view=name, posts=len(self.posts)):
+                with self.assertNumQueries(budget):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+
+    def test_query_counts_do_not_grow_with_data(self):
+        for size in (1, 25):
+            self._seed(size)
+            self._check_budgets()
+
+
+def _response(status):
+    response = requests.Response()
+    response.status_code = status
+    response.url = 'http://weather.invalid/now'
+    response._content = b'{}'
+    return response
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """半开状态的探测请求无论以何种请求错误结束，都要让熔断器离开半开状态"""
+
+    def test_unexpected_request_error_reopens_breaker(self):
+        client = HttpClient(retries=0, failure_threshold=1, reset_timeout=0)
+        url = 'http://weather.invalid/now'
+        breaker = client.breaker(url)
+        for error in (requests.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                      requests.TooManyRedirects, requests.exceptions.InvalidURL):
+            with self.subTest(error=error.__name__):
+                with mock.patch.object(client.session, 'get', side_effect=error('boom')):
+                    with self.assertRaises(error):
+                        client.get_json(url)
+                self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_overload_status_counts_as_failure(self):
+        """重试用尽后仍是 429 或 5xx 计为失败，其他 4xx 不计入熔断"""
+        url = 'http://weather.invalid/now'
+        for status, state in ((429, CircuitBreaker.OPEN), (503, CircuitBreaker.OPEN),
+                              (404, CircuitBreaker.CLOSED)):
+            with self.subTest(status=status):
+                client = HttpClient(retries=0, failure_threshold=1, reset_timeout=0)
+                with mock.patch.object(client.session, 'get', return_value=_response(status)):
+                    with self.assertRaises(requests.HTTPError):
+                        client.get_json(url)
+                self.assertEqual(client.breaker(url).state, state)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """替身服务器：按 responses 队列依次返回状态码，队列为空时返回 200"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.connections.add(self.client_address)
+            status = server.responses.pop(0) if server.responses else 200
+        body = json.dumps({'status': status, 'count': server.requests}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HttpClientTests(SimpleTestCase):
+    """用本地替身服务器检查对外 HTTP 客户端的连接复用、重试和熔断，不访问外部网络"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.server.lock = threading.Lock()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/weather'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests = 0
+        self.server.connections = set()
+        self.server.responses = []
+        self.client = HttpClient(retries=2, backoff=0.01, failure_threshold=2, reset_timeout=60)
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            self.client.get_json(self.url)
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_retries_server_errors(self):
+        self.server.responses = [503, 502]
+        data = self.client.get_json(self.url)
+        self.assertEqual(data['status'], 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_open_breaker_fails_fast_with_last_good_result(self):
+        """连续失败后熔断，熔断期间不发请求，有上次成功的结果时返回该结果，否则直接失败"""
+        self.client.get_json(self.url, cache_key='weather')
+        self.server.responses = [500] * 6
+        for _ in range(2):
+            data = self.client.get_json(self.url, cache_key='weather')
+            self.assertEqual(data['status'], 200)
+        self.assertEqual(self.client.breaker(self.url).state, CircuitBreaker.OPEN)
+
+        before = self.server.requests
+        self.assertEqual(self.client.get_json(self.url, cache_key='weather')['status'], 200)
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_json(self.url)
+        self.assertEqual(self.server.requests, before)
+
+    def test_breaker_recovers_after_reset_timeout(self):
+        self.server.responses = [500] * 6
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                self.client.get_json(self.url)
+        breaker = self.client.breaker(self.url)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        # 熔断时间已过，放行的探测请求成功后恢复
+        breaker.opened_at -= breaker.reset_timeout
+        self.server.responses = []
+        self.assertEqual(self.client.get_json(self.url)['status'], 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+
+@override_settings(METRICS_TOKEN='', METRICS_ALLOWED_IPS=('127.0.0.1',), ALLOWED_HOSTS=['testserver'])
+class MetricsViewTests(TestCase):
+    """/metrics 按连接的对端地址放行，抓取本身不计入访问统计"""
+
+    def test_forwarded_for_header_is_ignored(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5', HTTP_X_FORWARDED_FOR='127.0.0.1')
+        self.assertEqual(response.status_code, 403)
+
+    def test_allowed_remote_addr(self):
+        with mock.patch.object(visit_buffer, 'add') as add, \
+                mock.patch.object(latency_recorder, 'record') as record:
+            response = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+        add.assert_not_called()
+        record.assert_not_called()
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').status_code, 403)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+
+class PageCacheInvalidationTests(TestCase):
+    """内容变化时页面缓存版本号在事务提交后才递增"""
+
+    def test_version_bumped_on_commit(self):
+        before = caching.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='新分类')
+            self.assertEqual(caching.get_version(), before)
+        self.assertGreater(caching.get_version(), before)
+
+
+class RollupUpdateTests(TestCase):
+    """增量汇总按小时和日期累加访问次数，重复执行不会重复计数"""
+
+    def test_counts_accumulate_across_batches(self):
+        visit_time = timezone.now() - timedelta(hours=2)
+        for i in range(5):
+            VisitStatistics.objects.create(
+                ip_address=f'10.0.0.{i}', path='/', method='GET', status_code=200, visit_time=visit_time)
+        self.assertEqual(update_rollups(batch_size=2), 5)
+        self.assertEqual(update_rollups(batch_size=2), 0)
+        self.assertEqual(VisitHourlyRollup.objects.get().visit_count, 5)
+        self.assertEqual(VisitDailyRollup.objects.get().visit_count, 5)
+
+
+class RollupRebuildTests(TestCase):
+    """访问记录清理过之后拒绝重建汇总表，避免丢失清理前的统计"""
+
+    def setUp(self):
+        now = timezone.now()
+        self.old = VisitStatistics.objects.create(
+            ip_address='10.0.0.1', path='/', method='GET', status_code=200, visit_time=now - timedelta(days=100))
+        self.recent = VisitStatistics.objects.create(
+            ip_address='10.0.0.2', path='/', method='GET', status_code=200, visit_time=now - timedelta(days=1))
+        VisitRollupState.objects.create(name=STATE_NAME, last_visit_id=self.recent.pk)
+        VisitDailyRollup.objects.create(
+            date=timezone.localtime(self.old.visit_time).date(), path='/', status_code=200,
+            browser_family='其他', visit_count=1)
+
+    def test_rebuild_refused_after_prune(self):
+        self.assertEqual(prune_visits(timezone.now() - timedelta(days=90)), 1)
+        self.assertTrue(VisitRollupState.objects.filter(name=PRUNED_STATE_NAME).exists())
+        with self.assertRaises(CommandError):
+            call_command('update_visit_rollups', '--rebuild')
+        self.assertEqual(VisitDailyRollup.objects.count(), 1)
+
+    def test_rebuild_refused_when_rollups_predate_visits(self):
+        # 没有清理标记（标记出现之前清理过）时，按日汇总早于最早的访问记录判断
+        self.old.delete()
+        with self.assertRaises(CommandError):
+            call_command('update_visit_rollups', '--rebuild')
+
+
+class InternUserAgentsTests(TestCase):
+    """旧版 user_agent 列中的字符串回填到维度表"""
+
+    CHROME = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36'
+
+    def test_backfill_and_drop_legacy_column(self):
+        # 进程内的摘要缓存会指向随测试回滚的行
+        self.addCleanup(interner.clear)
+        table = VisitStatistics._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN user_agent varchar(500) NOT NULL DEFAULT ''")
+        for i, user_agent in enumerate([self.CHROME, self.CHROME, 'curl/8.0', '']):
+            visit = VisitStatistics.objects.create(ip_address=f'10.0.0.{i}', path='/', method='GET', status_code=200)
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {table} SET user_agent = %s WHERE id = %s', [user_agent, visit.pk])
+
+        call_command('intern_user_agents', '--batch-size', '3', '--drop-column', stdout=StringIO())
+
+        self.assertFalse(VisitStatistics.objects.filter(agent=None).exists())
+        self.assertEqual(UserAgent.objects.count(), 3)
+        self.assertEqual(UserAgent.objects.get(user_agent=self.CHROME).visits.count(), 2)
+        self.assertTrue(UserAgent.objects.get(user_agent='curl/8.0').is_bot)
+        with self.assertRaises(CommandError):
+            call_command('intern_user_agents', stdout=StringIO())
+
+
+class ChatBackendReadTests(TestCase):
+    """带游标读取时从最早的消息开始分页，has_more 时继续读取不会跳过积压的消息"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='chatter', password='unused')
+
+    def check_backend(self, backend):
+        sent = [backend.append(self.user, f'消息 {i}')['id'] for i in range(7)]
+
+        latest, has_more = backend.read(limit=3)
+        self.assertEqual([message['id'] for message in latest], sent[-3:])
+        self.assertFalse(has_more)
+
+        received = []
+        cursor = sent[0]
+        while True:
+            page, has_more = backend.read(since_id=cursor, limit=3)
+            received.extend(message['id'] for message in page)
+            if not has_more:
+                break
+            cursor = page[-1]['id']
+        self.assertEqual(received, sent[1:])
+
+    def test_memory_backend(self):
+        self.check_backend(MemoryChatBackend())
+
+    def test_database_backend(self):
+        self.check_backend(DatabaseChatBackend())
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class WebSocketToggleTests(TestCase):
+    """默认的 WSGI 部署不配置 channel layer：页面不尝试连接 WebSocket，发送消息时也不推送"""
+
+    def setUp(self):
+        # 首页会被整页缓存
+        cache.clear()
+
+    def test_disabled_without_asgi(self):
+        self.assertFalse(realtime.channels_enabled())
+        with mock.patch.object(visit_buffer, 'add'):
+            response = self.client.get('/')
+        self.assertContains(response, 'const WEBSOCKET_ENABLED = false;')
+
+    def test_no_push_queries_when_disabled(self):
+        user = User.objects.create_user(username='reader', password='unused')
+        with self.assertNumQueries(0):
+            realtime.notify_unread_count(user.pk)
+
+    def test_enabled_flag_rendered(self):
+        with mock.patch.object(realtime, 'channels_enabled', return_value=True), \
+                mock.patch.object(visit_buffer, 'add'):
+            response = self.client.get('/')
+        self.assertContains(response, 'const WEBSOCKET_ENABLED = true;')
+
+
+@override_settings(RELATED_POSTS_CONTENT_WEIGHT=1.0)
+class RelatedPostsContentTests(TestCase):
+    """内容相似度使用保存在数据库中的文档频率，不依赖进程内缓存"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='unused')
+        category = Category.objects.create(name='分类')
+        self.posts = [
+            Post.objects.create(title=title, content=content, author=self.user, category=category, status='published')
+            for title, content in (
+                ('django cache', 'django cache version invalidation'),
+                ('cache again', 'django cache version keys'),
+                ('gardening', 'tomato garden soil'),
+            )
+        ]
+
+    def test_incremental_refresh_uses_stored_document_frequency(self):
+        related.build_document_frequency()
+        cache.clear()
+        self.assertEqual(DocumentFrequency.objects.get().documents, 3)
+
+        first = self.posts[0]
+        related.refresh_posts([first.pk])
+        ranked = list(RelatedPost.objects.filter(post=first).order_by('rank').values_list('related_id', flat=True))
+        # 只按分类计算时得分相同，较新的文章排在前面；内容相似的文章应排在第一
+        self.assertEqual(ranked[0], self.posts[1].pk)
+
+
+class RelatedPostsSignalTests(TestCase):
+    """保存文章时相关文章在事务提交后刷新，同一事务内的多次变化只刷新一次"""
+
+    def setUp(self):
+        # 其他测试的事务回滚后残留的待刷新文章
+        signals._pending_related.post_ids = set()
+
+    def test_single_refresh_after_commit(self):
+        user = User.objects.create_user(username='author', password='unused')
+        category = Category.objects.create(name='分类')
+        tags = [Tag.objects.create(name=f'标签{i}') for i in range(2)]
+        with mock.patch.object(related, 'refresh_around') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                # 与管理后台保存文章相同：保存文章后清空并重新设置标签
+                with transaction.atomic():
+                    post = Post.objects.create(
+                        title='文章', content='内容', author=user, category=category, status='published')
+                    post.tags.clear()
+                    post.tags.add(*tags)
+                    post.save()
+                refresh.assert_not_called()
+        refresh.assert_called_once_with({post.pk})
+
+
+class CommentTreeTests(TestCase):
+    """评论的物化路径、回复校验和按树的顺序读出"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='commenter', password='unused')
+        self.post = Post.objects.create(title='文章', content='内容', author=self.user, status='published')
+
+    def comment(self, parent=None, post=None):
+        return Comment.objects.create(post=post or self.post, author=self.user, content='评论', parent=parent)
+
+    def test_reply_past_max_depth_attaches_to_deepest_level(self):
+        parent = None
+        for _ in range(Comment.MAX_DEPTH):
+            parent = self.comment(parent)
+        self.assertEqual(parent.depth, Comment.MAX_DEPTH - 1)
+
+        reply = self.comment(parent)
+        reply.refresh_from_db()
+        self.assertEqual(reply.parent_id, parent.parent_id)
+        self.assertEqual(reply.depth, Comment.MAX_DEPTH - 1)
+        self.assertEqual(reply.path, f'{parent.parent.path}/{reply.pk:0{Comment.PATH_DIGITS}d}')
+        self.assertLessEqual(len(reply.path), Comment._meta.get_field('path').max_length)
+
+    def test_form_rejects_parent_from_other_post(self):
+        other = Post.objects.create(title='其他文章', content='内容', author=self.user, status='published')
+        foreign = self.comment(post=other)
+        form = CommentForm({'content': '回复', 'parent': foreign.pk}, post=self.post)
+        self.assertFalse(form.is_valid())
+        self.assertIn('parent', form.errors)
+
+        local = self.comment()
+        self.assertTrue(CommentForm({'content': '回复', 'parent': local.pk}, post=self.post).is_valid())
+
+    def test_tree_order(self):
+        """楼层按新到旧排列，楼层内按先序遍历，回复按发表顺序"""
+        first = self.comment()
+        second = self.comment()
+        first_a = self.comment(first)
+        second_a = self.comment(second)
+        first_b = self.comment(first)
+        first_a_a = self.comment(first_a)
+
+        rows = comments.load_comments(self.post.pk)
+        self.assertEqual([row['id'] for row in rows],
+                         [second.pk, second_a.pk, first.pk, first_a.pk, first_a_a.pk, first_b.pk])
+        roots, total = comments.build_tree(rows)
+        self.assertEqual(total, 6)
+        self.assertEqual([root['id'] for root in roots], [second.pk, first.pk])
+        self.assertEqual([reply['id'] for reply in roots[1]['replies']], [first_a.pk, first_b.pk])
+        self.assertEqual([reply['id'] for reply in roots[1]['replies'][0]['replies']], [first_a_a.pk])
+
+
+class KeysetPaginatorTests(TestCase):
+    """键集分页在创建时间相同的文章之间按 ID 稳定翻页，无效游标回到第一页"""
+
+    def setUp(self):
+        user = User.objects.create_user(username='author', password='unused')
+        created_at = timezone.now()
+        self.posts = [
+            Post.objects.create(title=f'文章{i}', content='内容', author=user, status='published',
+                                created_at=created_at if i < 4 else created_at - timedelta(hours=1))
+            for i in range(5)
+        ]
+        self.paginator = KeysetPaginator(Post.objects.all(), per_page=2)
+
+    def ids(self, page):
+        return [post.pk for post in page]
+
+    def test_pages_across_equal_created_at(self):
+        expected = [post.pk for post in reversed(self.posts[:4])] + [self.posts[4].pk]
+        pages = [self.paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(self.paginator.get_page(after=pages[-1].next_cursor))
+        self.assertEqual([pk for page in pages for pk in self.ids(page)], expected)
+        self.assertFalse(pages[0].has_previous())
+
+        # 从最后一页往回翻，得到同样的页面
+        for page, previous in zip(reversed(pages[1:]), reversed(pages[:-1])):
+            back = self.paginator.get_page(before=page.previous_cursor)
+            self.assertEqual(self.ids(back), self.ids(previous))
+            self.assertEqual(back.has_previous(), previous.has_previous())
+
+    def test_before_cursor_on_first_page_returns_first_page(self):
+        first = self.paginator.get_page()
+        page = self.paginator.get_page(before=encode_cursor(first.object_list[0]))
+        self.assertEqual(self.ids(page), self.ids(first))
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_invalid_cursor_returns_first_page(self):
+        first = self.ids(self.paginator.get_page())
+        for cursor in ('abc', '1.2.3', '.', '1.x', '9' * 30 + '.1', '-' + '9' * 30 + '.1',
+                       '1.' + '9' * 30, '1.-' + '9' * 30):
+            for key in ('after', 'before'):
+                with self.subTest(cursor=cursor, key=key):
+                    self.assertIsNone(decode_cursor(cursor))
+                    page = self.paginator.get_page(**{key: cursor})
+                    self.assertEqual(self.ids(page), first)
@@ -24,7 +24,10 @@ urlpatterns = [
 
     # 统计功能
     path('statistics/', views.statistics_view, name='statistics'),
+    path('statistics/queries/', views.query_profile_view, name='query_profile'),
     path('api/visit-stats/', views.api_visit_stats, name='api_visit_stats'),
+    path('api/latency-stats/', views.api_latency_stats, name='api_latency_stats'),
+    path('metrics', views.metrics_view, name='metrics'),
 
     # 聊天功能
     path('chat/', views.chat_view, name='chat'),
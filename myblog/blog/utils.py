@@ -1,16 +1,197 @@
 """
 工具函数
-包含天气API等功能
+包含对外 HTTP 客户端、天气API等功能
 """
 
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
 import requests
 import os
 from django.conf import settings
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+from datetime import datetime
+from requests.adapters import HTTPAdapter
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(requests.RequestException):
+    """熔断器打开，请求未发出"""
+
+
+class CircuitBreaker:
+    """
+    熔断器
+    连续失败达到阈值后打开，reset_timeout 秒内的请求直接失败；
+    之后进入半开状态，只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """是否放行本次请求"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class HttpClient:
+    """
+    对外 HTTP 请求客户端
+    - 复用 keep-alive 连接池，每个主机最多 pool_size 个连接，超出时排队等待
+    - 连接和读取分别设置较短的超时
+    - 连接错误、超时、429 和 5xx 按指数退避加随机抖动重试
+    - 每个主机一个熔断器，打开期间直接失败，有上次成功的结果时返回该结果
+    """
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, connect_timeout=2, read_timeout=3, retries=2, backoff=0.2,
+                 pool_size=4, failure_threshold=5, reset_timeout=30):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._last_good = {}
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            connect_timeout=getattr(settings, 'OUTBOUND_HTTP_CONNECT_TIMEOUT', 2),
+            read_timeout=getattr(settings, 'OUTBOUND_HTTP_READ_TIMEOUT', 3),
+            retries=getattr(settings, 'OUTBOUND_HTTP_RETRIES', 2),
+            backoff=getattr(settings, 'OUTBOUND_HTTP_BACKOFF', 0.2),
+            pool_size=getattr(settings, 'OUTBOUND_HTTP_POOL_SIZE', 4),
+            failure_threshold=getattr(settings, 'OUTBOUND_HTTP_BREAKER_THRESHOLD', 5),
+            reset_timeout=getattr(settings, 'OUTBOUND_HTTP_BREAKER_RESET', 30),
+        )
+
+    @property
+    def session(self):
+        """进程内共享的会话（fork 之后重新创建，不与父进程共用连接）"""
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, pool_block=True)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def breaker(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self._breakers[host]
+
+    def _sleep_before_retry(self, attempt):
+        """全抖动退避：在 [0, backoff * 2^attempt] 之间随机等待"""
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def get_json(self, url, params=None, cache_key=None):
+        """
+        GET 请求并解析 JSON
+        cache_key 不为空时记住成功的结果，熔断或请求失败时返回该结果；没有可用结果时抛出异常
+        """
+        breaker = self.breaker(url)
+        try:
+            if not breaker.allow():
+                raise CircuitOpenError(f'{urlsplit(url).netloc} 熔断中')
+            data = self._get_json_with_retry(url, params, breaker)
+        except requests.RequestException:
+            if cache_key is not None and cache_key in self._last_good:
+                return self._last_good[cache_key]
+            raise
+        if cache_key is not None:
+            self._last_good[cache_key] = data
+        return data
+
+    def _get_json_with_retry(self, url, params, breaker):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+                if response.status_code in self.RETRY_STATUS and attempt < self.retries:
+                    response.close()
+                    self._sleep_before_retry(attempt)
+                    continue
+                response.raise_for_status()
+                data = response.json()
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt < self.retries:
+                    self._sleep_before_retry(attempt)
+                    continue
+                breaker.record_failure()
+                raise
+            except requests.HTTPError as exc:
+                # 429 和 5xx 说明对方过载或故障，重试用尽后计为失败；其他 4xx 是请求本身的问题，不计入熔断
+                status = exc.response.status_code if exc.response is not None else None
+                if status is None or status in self.RETRY_STATUS or status >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                raise
+            except requests.RequestException:
+                # 其他请求错误（如 ChunkedEncodingError、TooManyRedirects、InvalidURL）同样计为失败，
+                # 否则半开状态的探测请求既不成功也不失败，熔断器会一直停在半开状态；
+                # 新版 requests 的 JSONDecodeError 也在这里处理
+                breaker.record_failure()
+                raise
+            except ValueError as exc:
+                breaker.record_failure()
+                raise requests.RequestException(f'响应不是有效的 JSON: {exc}') from exc
+            breaker.record_success()
+            return data
+
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """进程内共享的对外 HTTP 客户端"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = HttpClient.from_settings()
+    return _http_client
+
 def get_weather_data(location=None, use_ip=True):
     """
     获取天气数据
@@ -42,11 +223,10 @@ def get_weather_data(location=None, use_ip=True):
         else:
             params['location'] = os.getenv('WEATHER_CITY', 'beijing')
 
-        url = 'https://api.seniverse.com/v3/weather/daily.json'
+        url = getattr(settings, 'SENIVERSE_API_URL', 'https://api.seniverse.com/v3/weather/daily.json')
 
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        # 熔断或请求失败时返回该位置上次成功的结果（缓存键不包含 API 密钥）
+        data = get_http_client().get_json(url, params=params, cache_key=('seniverse', params['location']))
 
         if 'results' not in data or not data['results']:
             return None
@@ -93,61 +273,25 @@ def get_weather_data(location=None, use_ip=True):
 
         return weather_info
     except (requests.RequestException, KeyError, ValueError) as e:
-        print(f"获取天气数据失败: {e}")
+        logger.warning('获取天气数据失败: %s', e)
         return None
 
 def get_client_weather(request):
     """
-    根据客户端信息获取天气
-    优先使用IP定位，失败则使用默认城市
+    获取天气（读取共享缓存，不会等待外部接口）
+    心知天气的 IP 定位按服务器出口 IP 解析，所有访客共用同一份数据，失败时退回默认城市
     """
-    # 尝试从客户端IP获取位置
-    client_ip = get_client_ip(request)
+    from .weather import weather_cache
 
-    # 这里可以添加IP定位服务，例如使用心知天气的IP定位API
-    # 但需要另外的API密钥，这里简化处理
-
-    # 尝试使用IP自动定位
-    weather_data = get_weather_data(location=None, use_ip=True)
-
-    # 如果IP定位失败，使用默认城市
-    if not weather_data:
-        default_city = os.getenv('WEATHER_CITY', 'beijing')
-        weather_data = get_weather_data(location=default_city, use_ip=False)
-
-    return weather_data
+    return weather_cache.get()
 
 def weather_context(request):
     """
     天气上下文处理器
-    将天气数据添加到所有模板上下文中
+    将天气数据添加到所有模板上下文中；数据由后台线程刷新，缓存为空时返回 None
     """
-    # 使用缓存避免频繁调用API
-    cache_key = f'weather_data_{get_client_ip(request)}'
-    weather_data = None
-
-    # 检查是否已有缓存的天气数据（这里简化，实际应使用Django缓存）
-    # 我们可以使用session来存储天气数据
-    if 'weather_data' in request.session:
-        weather_data = request.session['weather_data']
-        last_update = request.session.get('weather_last_update')
-
-        # 检查是否过期（1小时过期）
-        if last_update:
-            last_update_time = datetime.fromisoformat(last_update)
-            if datetime.now() - last_update_time < timedelta(hours=1):
-                return {'weather': weather_data}
-
-    # 获取新的天气数据
-    weather_data = get_client_weather(request)
-
-    if weather_data:
-        # 保存到session
-        request.session['weather_data'] = weather_data
-        request.session['weather_last_update'] = datetime.now().isoformat()
-
     return {
-        'weather': weather_data,
+        'weather': get_client_weather(request),
     }
 
 def format_date(value, format_string='Y年m月d日 H:i'):
@@ -186,4 +330,4 @@ def get_client_ip(request):
         ip = x_forwarded_for.split(',')[0]
     else:
         ip = request.META.get('REMOTE_ADDR')
-    return ip
\ No newline at end of file
+    return ip
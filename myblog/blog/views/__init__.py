@@ -23,7 +23,10 @@ from .auth import (
 
 from .stats import (
     statistics_view,
-    api_visit_stats
+    api_visit_stats,
+    api_latency_stats,
+    query_profile_view,
+    metrics_view
 )
 
 from .chat import (
@@ -62,6 +65,9 @@ __all__ = [
     # 统计视图
     'statistics_view',
     'api_visit_stats',
+    'api_latency_stats',
+    'query_profile_view',
+    'metrics_view',
 
     # 聊天视图
     'chat_view',
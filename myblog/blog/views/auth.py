@@ -8,6 +8,7 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.db.models import Count, Sum
 from ..forms import CustomUserCreationForm, ProfileForm
 
 def register_view(request):
@@ -87,14 +88,19 @@ def profile_view(request):
     else:
         form = ProfileForm(instance=request.user)
 
-    # 获取用户统计信息
-    user_posts = request.user.post_set.filter(status='published')
+    # 获取用户统计信息（文章数和总浏览量一次聚合）
+    user_posts = request.user.post_set.filter(status='published').order_by('-created_at')
+    post_stats = user_posts.aggregate(count=Count('pk'), total_views=Sum('view_count'))
     user_comments = request.user.comment_set.count()
+    recent_comments = request.user.comment_set.select_related('post').order_by('-created_at')[:5]
 
     context = {
         'form': form,
         'user_posts': user_posts,
+        'user_post_count': post_stats['count'],
+        'user_total_views': post_stats['total_views'] or 0,
         'user_comments': user_comments,
+        'recent_comments': recent_comments,
     }
 
     return render(request, 'blog/profile.html', context)
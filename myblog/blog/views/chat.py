@@ -5,16 +5,11 @@
 
 import json
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponseNotModified
 from django.contrib.auth.decorators import login_required
-from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
-from django.utils import timezone
-from datetime import timedelta
-
-# 简单的内存存储（生产环境应使用数据库或Redis）
-chat_messages = []
-MAX_MESSAGES = 60  # 最大消息存储数
+from .. import realtime
+from ..chat_backends import get_chat_backend
 
 @login_required
 def chat_view(request):
@@ -33,19 +28,38 @@ def chat_view(request):
 def chat_messages_api(request):
     """
     API: 获取聊天消息
+    支持 since_id / last_id 游标，只返回更新的消息，每次最多 50 条（从最早的开始），
+    has_more 时客户端以返回的 last_id 继续获取；
+    请求带 If-None-Match 且没有新消息时返回 304
     """
-    # 清理旧消息（超过1小时）
-    global chat_messages
-    one_hour_ago = timezone.now() - timedelta(hours=1)
-    chat_messages = [
-        msg for msg in chat_messages
-        if parse_datetime(msg.get('timestamp', timezone.now().isoformat())) > one_hour_ago
-    ]
-
-    return JsonResponse({
-        'messages': chat_messages[-50:],  # 返回最近50条消息
-        'count': len(chat_messages),
+    backend = get_chat_backend()
+
+    # 解析游标
+    cursor = request.GET.get('since_id') or request.GET.get('last_id')
+    try:
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        cursor = None
+
+    if cursor is not None and request.headers.get('If-None-Match'):
+        latest_id = backend.latest_id()
+        etag = f'"chat-{latest_id}"'
+        if latest_id <= cursor and request.headers['If-None-Match'] == etag:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+    messages, has_more = backend.read(since_id=cursor, limit=50)
+    last_id = messages[-1]['id'] if messages else (cursor or 0)
+
+    response = JsonResponse({
+        'messages': messages,
+        'count': len(messages),
+        'last_id': last_id,
+        'has_more': has_more,
     })
+    response['ETag'] = f'"chat-{last_id}"'
+    return response
 
 @csrf_exempt
 @login_required
@@ -63,22 +77,11 @@ def send_message_api(request):
         if not message_content:
             return JsonResponse({'error': '消息内容不能为空'}, status=400)
 
-        # 创建消息对象
-        message = {
-            'id': len(chat_messages) + 1,
-            'user_id': request.user.id,
-            'username': request.user.username,
-            'avatar': '',  # 可以添加头像URL
-            'content': message_content,
-            'timestamp': timezone.now().isoformat(),
-        }
-
-        # 添加消息到存储
-        chat_messages.append(message)
-
-        # 限制消息数量
-        if len(chat_messages) > MAX_MESSAGES:
-            chat_messages.pop(0)
+        # 保存消息（过期清理和数量限制由存储后端处理）
+        message = get_chat_backend().append(request.user, message_content)
+
+        # 推送给 WebSocket 连接
+        realtime.notify_chat_message(message)
 
         return JsonResponse({
             'success': True,
@@ -6,13 +6,18 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q, Count
 from django.utils import timezone
+from django.db.models import Count, Q
 from django.http import JsonResponse
+from .. import comments as comment_tree
+from .. import related, search
+from ..buffers import view_count_buffer
+from ..caching import cache_anonymous_page
+from ..pagination import cached_count, paginate_posts
 from ..models import Post, Category, Tag, Comment
 from ..forms import PostForm, CommentForm
 
+@cache_anonymous_page()
 def home_view(request):
     """
     首页视图
@@ -25,15 +30,12 @@ def home_view(request):
     featured = request.GET.get('featured')
 
     # 基础查询集
-    posts = Post.objects.filter(status='published').order_by('-created_at')
+    posts = Post.objects.filter(status='published')\
+        .select_related('author', 'category').order_by('-created_at')
 
-    # 应用过滤
+    # 应用过滤（搜索走全文索引，结果按相关度排序）
     if query:
-        posts = posts.filter(
-            Q(title__icontains=query) |
-            Q(content__icontains=query) |
-            Q(summary__icontains=query)
-        )
+        posts = search.search_posts(posts, query)
 
     if category_id:
         posts = posts.filter(category_id=category_id)
@@ -44,49 +46,54 @@ def home_view(request):
     if featured:
         posts = posts.filter(is_featured=True)
 
-    # 分页
-    paginator = Paginator(posts, 10)  # 每页10篇文章
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # 分页：列表按 (created_at, id) 键集翻页，总数按过滤条件缓存；
+    # 搜索结果按相关度排序且数量有上限，使用页码分页
+    page_obj, filter_query = paginate_posts(
+        request, posts,
+        count=lambda: cached_count(posts, 'home', category_id, tag_id, bool(featured)),
+        keyset=not query,
+    )
+    view_count_buffer.merge_pending(page_obj)
 
-    # 获取分类和标签用于筛选
-    categories = Category.objects.annotate(post_count=Count('post'))
-    tags = Tag.objects.annotate(post_count=Count('post'))
-
-    # 热门文章
-    popular_posts = Post.objects.filter(status='published')\
-        .order_by('-view_count')[:5]
+    # 分类、标签和热门文章由 sidebar 上下文处理器统一提供（见 sidebar.py）
 
     context = {
         'page_obj': page_obj,
-        'categories': categories,
-        'tags': tags,
-        'popular_posts': popular_posts,
         'query': query,
         'category_id': category_id,
         'tag_id': tag_id,
         'featured': featured,
+        'filter_query': filter_query,
     }
 
     return render(request, 'blog/home.html', context)
 
+def _count_cached_view(request, pk):
+    """页面缓存命中时仍然计入浏览数"""
+    view_count_buffer.incr(pk)
+
+@cache_anonymous_page(on_hit=_count_cached_view)
 def post_detail_view(request, pk):
     """
     文章详情视图
     """
-    post = get_object_or_404(Post, pk=pk)
+    post = get_object_or_404(
+        Post.objects.select_related('author', 'category').prefetch_related('tags'),
+        pk=pk
+    )
 
     # 检查文章状态
     if post.status != 'published' and not request.user.is_staff:
         messages.error(request, '这篇文章暂时不可用。')
         return redirect('home')
 
-    # 增加浏览数
+    # 增加浏览数（先合并本进程尚未写回的增量，再计入本次浏览）
+    view_count_buffer.merge_pending([post])
     post.increment_view_count()
 
     # 处理评论提交
     if request.method == 'POST' and request.user.is_authenticated:
-        comment_form = CommentForm(request.POST)
+        comment_form = CommentForm(request.POST, post=post)
         if comment_form.is_valid():
             comment = comment_form.save(commit=False)
             comment.post = post
@@ -95,20 +102,18 @@ def post_detail_view(request, pk):
             messages.success(request, '评论发布成功！')
             return redirect('post_detail', pk=post.pk)
     else:
-        comment_form = CommentForm()
+        comment_form = CommentForm(post=post)
 
-    # 获取评论
-    comments = post.comments.filter(is_active=True).order_by('-created_at')
+    # 评论树：一条查询（或一次缓存读取）取出全部评论，按楼层分页
+    comment_page, comment_count = comment_tree.get_comment_page(post.pk, request.GET.get('cpage'))
 
-    # 获取相关文章
-    related_posts = Post.objects.filter(
-        status='published',
-        tags__in=post.tags.all()
-    ).exclude(pk=post.pk).distinct()[:3]
+    # 相关文章：读取预先计算的结果（见 related.py），一条索引查询
+    related_posts = related.get_related_posts(post, 3)
 
     context = {
         'post': post,
-        'comments': comments,
+        'comment_page': comment_page,
+        'comment_count': comment_count,
         'comment_form': comment_form,
         'related_posts': related_posts,
     }
@@ -196,15 +201,16 @@ def my_posts_view(request):
     """
     我的文章视图
     """
-    posts = Post.objects.filter(author=request.user).order_by('-created_at')
+    posts = Post.objects.filter(author=request.user)\
+        .select_related('category').order_by('-created_at')
 
-    # 统计信息
-    stats = {
-        'total': posts.count(),
-        'published': posts.filter(status='published').count(),
-        'draft': posts.filter(status='draft').count(),
-        'archived': posts.filter(status='archived').count(),
-    }
+    # 统计信息（一次聚合查询）
+    stats = posts.aggregate(
+        total=Count('pk'),
+        published=Count('pk', filter=Q(status='published')),
+        draft=Count('pk', filter=Q(status='draft')),
+        archived=Count('pk', filter=Q(status='archived')),
+    )
 
     context = {
         'posts': posts,
@@ -213,32 +219,44 @@ def my_posts_view(request):
 
     return render(request, 'blog/my_posts.html', context)
 
+@cache_anonymous_page()
 def category_posts_view(request, category_id):
     """
     分类文章列表视图
     """
     category = get_object_or_404(Category, pk=category_id)
     posts = Post.objects.filter(category=category, status='published')\
-        .order_by('-created_at')
+        .select_related('author', 'category').order_by('-created_at')
+
+    # 总数直接使用分类上的冗余文章数
+    page_obj, filter_query = paginate_posts(request, posts, count=category.post_count)
+    view_count_buffer.merge_pending(page_obj)
 
     context = {
         'category': category,
-        'posts': posts,
+        'page_obj': page_obj,
+        'filter_query': filter_query,
     }
 
     return render(request, 'blog/category_posts.html', context)
 
+@cache_anonymous_page()
 def tag_posts_view(request, tag_id):
     """
     标签文章列表视图
     """
     tag = get_object_or_404(Tag, pk=tag_id)
     posts = Post.objects.filter(tags=tag, status='published')\
-        .order_by('-created_at')
+        .select_related('author', 'category').order_by('-created_at')
+
+    # 总数直接使用标签上的冗余文章数
+    page_obj, filter_query = paginate_posts(request, posts, count=tag.post_count)
+    view_count_buffer.merge_pending(page_obj)
 
     context = {
         'tag': tag,
-        'posts': posts,
+        'page_obj': page_obj,
+        'filter_query': filter_query,
     }
 
     return render(request, 'blog/tag_posts.html', context)
@@ -6,11 +6,13 @@ from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models import Q, Count, Max
+from django.db.models import Q
 from django.utils import timezone
+from django.conf import settings
 from datetime import datetime, timedelta
 
-from ..models import PrivateChatSession, PrivateMessage
+from .. import realtime
+from ..models import PrivateChatSession
 from ..forms_private_chat import PrivateMessageForm, UserSearchForm
 
 
@@ -18,19 +20,12 @@ from ..forms_private_chat import PrivateMessageForm, UserSearchForm
 def private_chat_list_view(request):
     """私聊会话列表视图"""
     # 获取用户的私聊会话
-    sessions = PrivateChatSession.objects.filter(
-        Q(user1=request.user) | Q(user2=request.user),
-        is_active=True
-    ).annotate(
-        last_message_time=Max('messages__created_at'),
-        unread_count=Count('messages', filter=Q(
-            messages__receiver=request.user,
-            messages__is_read=False
-        ))
-    ).order_by('-last_message_time')
+    # 最后消息和未读数都冗余在会话上，一条查询即可取得列表
+    sessions = list(PrivateChatSession.for_user(request.user))
 
     # 为每个会话添加另一个用户的信息
     for session in sessions:
+        session.unread_count = session.unread_count_for_user(request.user)
         if session.user1 == request.user:
             session.other_user = session.user2
         else:
@@ -60,42 +55,30 @@ def private_chat_detail_view(request, user_id):
     other_user = get_object_or_404(User, pk=user_id)
 
     # 获取或创建私聊会话
-    session, created = PrivateChatSession.objects.get_or_create(
-        user1=request.user if request.user.id < other_user.id else other_user,
-        user2=other_user if request.user.id < other_user.id else request.user,
-        defaults={'is_active': True}
-    )
+    session, created = PrivateChatSession.get_or_create_between(request.user, other_user)
 
     if created:
         # 如果是新创建的会话，激活它
         session.is_active = True
         session.save()
 
-    # 获取消息
-    messages = session.messages.all().order_by('created_at')
-
-    # 标记当前用户收到的未读消息为已读
-    unread_messages = messages.filter(
-        receiver=request.user,
-        is_read=False
+    # 只渲染最新一页消息，更早的历史通过 before_id 接口向前翻页
+    messages, has_more = session.message_page(
+        limit=getattr(settings, 'PRIVATE_CHAT_PAGE_SIZE', 50)
     )
 
-    for msg in unread_messages:
-        msg.mark_as_read()
+    # 标记当前用户收到的未读消息为已读
+    if session.mark_read(request.user):
+        realtime.notify_messages_read(session, request.user)
 
     # 处理消息发送
     if request.method == 'POST':
         form = PrivateMessageForm(request.POST)
         if form.is_valid():
-            message = form.save(commit=False)
-            message.session = session
-            message.sender = request.user
-            message.receiver = other_user
-            message.save()
+            message = session.send_message(request.user, form.cleaned_data['content'])
 
-            # 更新会话时间
-            session.updated_at = timezone.now()
-            session.save()
+            # 唤醒等待该会话的长轮询
+            realtime.notify_private_message(message)
 
             return redirect('private_chat_detail', user_id=user_id)
     else:
@@ -105,7 +88,9 @@ def private_chat_detail_view(request, user_id):
         'session': session,
         'other_user': other_user,
         'messages': messages,
+        'has_more': has_more,
         'form': form,
+        'long_poll_timeout': getattr(settings, 'PRIVATE_CHAT_LONG_POLL_TIMEOUT', 25),
     }
     return render(request, 'blog/private_chat_detail.html', context)
 
@@ -136,50 +121,73 @@ def api_private_messages(request, user_id):
     except PrivateChatSession.DoesNotExist:
         return JsonResponse({'error': '会话不存在'}, status=404)
 
-    # 获取最后消息ID（用于增量获取）
-    last_id = request.GET.get('last_id')
+    page_size = getattr(settings, 'PRIVATE_CHAT_PAGE_SIZE', 50)
+
+    # 向前翻页：按 (created_at, id) 键集分页返回 before_id 之前的历史消息，不标记已读
+    try:
+        before_id = int(request.GET.get('before_id'))
+    except (TypeError, ValueError):
+        before_id = None
+
+    if before_id is not None:
+        before = session.messages.filter(pk=before_id).only('id', 'created_at').first()
+        if before is None:
+            return JsonResponse({'error': '消息不存在'}, status=404)
+        messages, has_more = session.message_page(before=before, limit=page_size)
+        return JsonResponse({
+            'messages': [msg.to_dict(request.user) for msg in messages],
+            'has_more': has_more,
+            'session_id': session.id,
+        })
 
-    # 构建查询
-    messages_query = session.messages.all()
+    # 获取最后消息ID（用于增量获取）
+    try:
+        last_id = int(request.GET.get('last_id'))
+    except (TypeError, ValueError):
+        last_id = None
 
-    if last_id:
+    if last_id is None:
+        # 没有游标时只返回最新一页
+        messages, has_more = session.message_page(limit=page_size)
+    else:
+        # 长轮询：没有新消息时挂起请求，直到有新消息或超时
         try:
-            messages_query = messages_query.filter(id__gt=int(last_id))
+            wait = min(float(request.GET.get('wait', 0)),
+                       getattr(settings, 'PRIVATE_CHAT_LONG_POLL_TIMEOUT', 25))
         except ValueError:
-            pass
-
-    # 限制消息数量
-    messages = messages_query.order_by('created_at')
-
-    # 标记未读消息为已读
-    unread_messages = messages.filter(
-        receiver=request.user,
-        is_read=False
-    )
-
-    for msg in unread_messages:
-        msg.mark_as_read()
+            wait = 0
+
+        messages_query = session.messages.filter(id__gt=last_id).order_by('created_at', 'id')
+
+        if wait > 0:
+            # 先取通知版本号再查询，避免错过两者之间到达的消息
+            since_version = realtime.private_session_version(session.id)
+            if not messages_query.exists():
+                if not realtime.wait_for_private_messages(session, last_id, wait, since_version):
+                    return JsonResponse({
+                        'messages': [],
+                        'session_id': session.id,
+                        'timeout': True,
+                    })
+
+        # 每次最多返回一页，has_more 时客户端以新的 last_id 继续获取
+        messages = list(messages_query.select_related('sender')[:page_size + 1])
+        has_more = len(messages) > page_size
+        messages = messages[:page_size]
 
     # 序列化消息
-    messages_data = []
-    for msg in messages:
-        messages_data.append({
-            'id': msg.id,
-            'sender_id': msg.sender.id,
-            'sender_username': msg.sender.username,
-            'content': msg.content,
-            'created_at': msg.created_at.isoformat(),
-            'is_own': msg.sender == request.user,
-        })
+    messages_data = [msg.to_dict(request.user) for msg in messages]
+
+    # 标记已返回的消息为已读
+    if messages_data and session.mark_read(request.user, up_to_id=messages_data[-1]['id']):
+        realtime.notify_messages_read(session, request.user)
 
     # 获取未读消息总数
-    total_unread = PrivateMessage.objects.filter(
-        receiver=request.user,
-        is_read=False
-    ).count()
+    total_unread = PrivateChatSession.total_unread_count(request.user.id)
 
     return JsonResponse({
         'messages': messages_data,
+        'has_more': has_more,
         'total_unread': total_unread,
         'session_id': session.id,
     })
@@ -209,23 +217,13 @@ def api_send_private_message(request, user_id):
             return JsonResponse({'error': '消息内容过长'}, status=400)
 
         # 获取或创建会话
-        session, created = PrivateChatSession.objects.get_or_create(
-            user1=request.user if request.user.id < other_user.id else other_user,
-            user2=other_user if request.user.id < other_user.id else request.user,
-            defaults={'is_active': True}
-        )
+        session, created = PrivateChatSession.get_or_create_between(request.user, other_user)
 
-        # 创建消息
-        message = PrivateMessage.objects.create(
-            session=session,
-            sender=request.user,
-            receiver=other_user,
-            content=content
-        )
+        # 创建消息，同时更新会话的最后消息和对方的未读数
+        message = session.send_message(request.user, content)
 
-        # 更新会话时间
-        session.updated_at = timezone.now()
-        session.save()
+        # 唤醒等待该会话的长轮询
+        realtime.notify_private_message(message)
 
         return JsonResponse({
             'success': True,
@@ -243,35 +241,21 @@ def api_send_private_message(request, user_id):
 def api_private_chat_summary(request):
     """API: 获取私聊摘要信息（用于导航栏显示）"""
     # 获取未读消息总数
-    total_unread = PrivateMessage.objects.filter(
-        receiver=request.user,
-        is_read=False
-    ).count()
-
-    # 获取最近活跃的会话
-    recent_sessions = PrivateChatSession.objects.filter(
-        Q(user1=request.user) | Q(user2=request.user),
-        is_active=True
-    ).annotate(
-        last_message_time=Max('messages__created_at'),
-        unread_count=Count('messages', filter=Q(
-            messages__receiver=request.user,
-            messages__is_read=False
-        ))
-    ).order_by('-last_message_time')[:5]
+    total_unread = PrivateChatSession.total_unread_count(request.user.id)
+
+    # 获取最近活跃的会话（最后消息、预览和未读数都读自会话本身）
+    recent_sessions = PrivateChatSession.for_user(request.user)[:5]
 
     sessions_data = []
     for session in recent_sessions:
         other_user = session.other_user(request.user)
-        last_message = session.messages.last()
 
         sessions_data.append({
             'user_id': other_user.id,
             'username': other_user.username,
-            'unread_count': session.unread_count,
-            'last_message': last_message.content[:50] + '...' if last_message and len(last_message.content) > 50 else
-            last_message.content if last_message else '',
-            'last_message_time': last_message.created_at.isoformat() if last_message else None,
+            'unread_count': session.unread_count_for_user(request.user),
+            'last_message': session.last_message_preview,
+            'last_message_time': session.last_message_at.isoformat() if session.last_message_at else None,
         })
 
     return JsonResponse({
@@ -287,15 +271,10 @@ def api_mark_all_as_read(request):
         return JsonResponse({'error': '只支持POST请求'}, status=400)
 
     # 标记当前用户的所有未读消息为已读
-    unread_messages = PrivateMessage.objects.filter(
-        receiver=request.user,
-        is_read=False
-    )
-
-    updated_count = unread_messages.count()
+    updated_count = PrivateChatSession.mark_all_read(request.user)
 
-    for msg in unread_messages:
-        msg.mark_as_read()
+    if updated_count:
+        realtime.notify_unread_count(request.user.id)
 
     return JsonResponse({
         'success': True,
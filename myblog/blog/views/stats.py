@@ -3,14 +3,18 @@
 处理访问统计和数据分析
 """
 
+from django.conf import settings
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse
-from django.db.models import Count, Q
+from django.http import HttpResponse, JsonResponse
+from django.db.models import Q, Sum
 from django.utils import timezone
 from datetime import timedelta
+import hmac
 import json
-from ..models import VisitStatistics, Post
+from .. import latency, metrics, profiling, rollups, visitors
+from ..buffers import visit_buffer, view_count_buffer
+from ..models import VisitHourlyRollup, VisitDailyRollup, Post
 
 def is_staff_user(user):
     """检查用户是否是员工"""
@@ -24,25 +28,20 @@ def statistics_view(request):
     只有管理员可以访问
     """
     # 时间范围
-    today = timezone.now().date()
+    today = timezone.localdate()
     week_ago = today - timedelta(days=7)
     month_ago = today - timedelta(days=30)
 
-    # 访问统计
-    total_visits = VisitStatistics.objects.count()
-    today_visits = VisitStatistics.objects.filter(
-        visit_time__date=today
-    ).count()
-    week_visits = VisitStatistics.objects.filter(
-        visit_time__date__gte=week_ago
-    ).count()
-    month_visits = VisitStatistics.objects.filter(
-        visit_time__date__gte=month_ago
-    ).count()
+    # 访问统计（读取汇总表）
+    rollups.refresh_rollups()
+    total_visits = rollups.total_visits()
+    today_visits = rollups.total_visits(start_date=today)
+    week_visits = rollups.total_visits(start_date=week_ago)
+    month_visits = rollups.total_visits(start_date=month_ago)
 
     # 热门页面
-    popular_pages = VisitStatistics.objects.values('path')\
-        .annotate(count=Count('id'))\
+    popular_pages = VisitDailyRollup.objects.values('path')\
+        .annotate(count=Sum('visit_count'))\
         .order_by('-count')[:10]
 
     # 文章统计
@@ -89,6 +88,34 @@ def statistics_view(request):
 
     return render(request, 'blog/statistics.html', context)
 
+@login_required
+@user_passes_test(is_staff_user)
+def query_profile_view(request):
+    """
+    慢请求汇总
+    展示查询分析中间件记录的慢请求：按路由汇总，以及最近的慢请求明细
+    """
+    day_choices = [(1, '1天'), (3, '3天'), (7, '7天')]
+    try:
+        days = int(request.GET.get('days', 1))
+    except ValueError:
+        days = 1
+    if days not in dict(day_choices):
+        days = 1
+
+    routes, recent = profiling.summarize(days=days)
+    context = {
+        'routes': routes,
+        'recent': recent,
+        'days': days,
+        'day_choices': day_choices,
+        'enabled': getattr(settings, 'QUERY_PROFILER_ENABLED', False),
+        'slow_ms': getattr(settings, 'QUERY_PROFILER_SLOW_MS', 500),
+        'max_queries': getattr(settings, 'QUERY_PROFILER_MAX_QUERIES', 30),
+        'sample_rate': getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 1.0),
+    }
+    return render(request, 'blog/query_profile.html', context)
+
 def api_visit_stats(request):
     """
     API: 获取访问统计数据
@@ -97,51 +124,101 @@ def api_visit_stats(request):
     if not request.user.is_staff:
         return JsonResponse({'error': '权限不足'}, status=403)
 
+    rollups.refresh_rollups()
+
     # 过去30天的访问数据
-    end_date = timezone.now().date()
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=30)
 
-    visits_by_date = VisitStatistics.objects.filter(
-        visit_time__date__range=[start_date, end_date]
-    ).values('visit_time__date')\
-     .annotate(count=Count('id'))\
-     .order_by('visit_time__date')
+    visits_by_date = VisitDailyRollup.objects.filter(
+        date__range=[start_date, end_date]
+    ).values('date')\
+     .annotate(count=Sum('visit_count'))\
+     .order_by('date')
 
     # 格式化数据
     dates = []
     counts = []
 
     for item in visits_by_date:
-        dates.append(item['visit_time__date'].strftime('%m-%d'))
+        dates.append(item['date'].strftime('%m-%d'))
         counts.append(item['count'])
 
+    # 过去24小时的访问数据
+    visits_by_hour = VisitHourlyRollup.objects.filter(
+        hour__gte=timezone.now() - timedelta(hours=24)
+    ).values('hour')\
+     .annotate(count=Sum('visit_count'))\
+     .order_by('hour')
+
+    hours = []
+    hourly_counts = []
+
+    for item in visits_by_hour:
+        hours.append(timezone.localtime(item['hour']).strftime('%H:00'))
+        hourly_counts.append(item['count'])
+
     # 热门访问路径
-    popular_paths = VisitStatistics.objects.values('path')\
-        .annotate(count=Count('id'))\
+    popular_paths = VisitDailyRollup.objects.values('path')\
+        .annotate(count=Sum('visit_count'))\
         .order_by('-count')[:15]
 
     # 浏览器统计
-    browsers = {}
-    for stat in VisitStatistics.objects.all()[:1000]:  # 限制样本数量
-        user_agent = stat.user_agent or ''
-        if 'Chrome' in user_agent:
-            browsers['Chrome'] = browsers.get('Chrome', 0) + 1
-        elif 'Firefox' in user_agent:
-            browsers['Firefox'] = browsers.get('Firefox', 0) + 1
-        elif 'Safari' in user_agent:
-            browsers['Safari'] = browsers.get('Safari', 0) + 1
-        elif 'Edge' in user_agent:
-            browsers['Edge'] = browsers.get('Edge', 0) + 1
-        else:
-            browsers['其他'] = browsers.get('其他', 0) + 1
+    browsers = {
+        item['browser_family']: item['count']
+        for item in VisitDailyRollup.objects.values('browser_family')
+                                           .annotate(count=Sum('visit_count'))
+    }
 
     data = {
         'dates': dates,
         'counts': counts,
+        'hours': hours,
+        'hourly_counts': hourly_counts,
         'popular_paths': list(popular_paths),
         'browsers': browsers,
-        'total_visits': VisitStatistics.objects.count(),
-        'unique_ips': VisitStatistics.objects.values('ip_address').distinct().count(),
+        'total_visits': rollups.total_visits(),
+        'unique_ips': visitors.unique_visitors(),
+        'visit_buffer': visit_buffer.get_stats(),
+        'view_count_buffer': view_count_buffer.get_stats(),
     }
 
     return JsonResponse(data)
+
+def metrics_view(request):
+    """
+    Prometheus 指标导出
+    配置了 METRICS_TOKEN 时需要 Authorization: Bearer <token>；
+    否则只允许 METRICS_ALLOWED_IPS 中的地址和管理员访问
+    地址取连接的对端地址 REMOTE_ADDR，不信任可以伪造的 X-Forwarded-For；
+    经反向代理部署时对端总是代理本身，应配置 METRICS_TOKEN
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token:
+        allowed = hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', '').encode(), f'Bearer {token}'.encode())
+    else:
+        allowed = request.user.is_staff or \
+            request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if not allowed:
+        return HttpResponse('权限不足', status=403, content_type='text/plain; charset=utf-8')
+
+    return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+def api_latency_stats(request):
+    """
+    API: 各路由的响应时间分位数
+    window 参数可选 1h / 6h / 24h / 7d，耗时单位为毫秒
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': '权限不足'}, status=403)
+
+    window = request.GET.get('window', latency.DEFAULT_WINDOW)
+    if window not in latency.WINDOWS:
+        return JsonResponse({'error': '不支持的时间窗口'}, status=400)
+
+    return JsonResponse({
+        'window': window,
+        'windows': list(latency.WINDOWS),
+        'routes': latency.summarize(window),
+        'recorder': latency.latency_recorder.get_stats(),
+    })
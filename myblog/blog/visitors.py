@@ -0,0 +1,91 @@
+"""
+独立访客统计
+按天维护 HyperLogLog 草图，访问记录写入时同步更新，查询任意日期范围时合并草图
+"""
+
+import logging
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import DailyVisitorSketch, VisitStatistics
+from .sketches import HyperLogLog, precision_for_error
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+
+
+def get_precision():
+    """根据 VISIT_UNIQUE_ERROR_RATE 计算草图精度"""
+    return precision_for_error(getattr(settings, 'VISIT_UNIQUE_ERROR_RATE', 0.01))
+
+
+def _merge_day(date, sketch):
+    """
+    将草图合并进某一天的记录
+    使用版本号做乐观并发控制，HyperLogLog 合并是幂等的，冲突时重试即可
+    """
+    for _ in range(MAX_RETRIES):
+        row = DailyVisitorSketch.objects.filter(date=date).values_list('sketch', 'version').first()
+        if row is None:
+            try:
+                with transaction.atomic():
+                    DailyVisitorSketch.objects.create(date=date, sketch=sketch.to_bytes())
+                return True
+            except IntegrityError:
+                continue
+
+        stored, version = row
+        merged = HyperLogLog.merge_all([stored, sketch], min(sketch.precision, stored[0]))
+        updated = DailyVisitorSketch.objects.filter(date=date, version=version)\
+            .update(sketch=merged.to_bytes(), version=version + 1, updated_at=timezone.now())
+        if updated:
+            return True
+
+    logger.warning('更新 %s 的独立访客草图失败：并发冲突过多', date)
+    return False
+
+
+def record_visitors(visits):
+    """将一批访问记录中的 IP 计入对应日期的草图"""
+    precision = get_precision()
+    sketches = defaultdict(lambda: HyperLogLog(precision))
+    for visit in visits:
+        date = timezone.localtime(visit.visit_time).date()
+        sketches[date].add(visit.ip_address)
+
+    for date, sketch in sketches.items():
+        _merge_day(date, sketch)
+
+
+def unique_visitors(start_date=None, end_date=None):
+    """估算日期范围内的独立访客数（包含两端）"""
+    queryset = DailyVisitorSketch.objects.all()
+    if start_date:
+        queryset = queryset.filter(date__gte=start_date)
+    if end_date:
+        queryset = queryset.filter(date__lte=end_date)
+    sketches = queryset.values_list('sketch', flat=True).iterator()
+    return HyperLogLog.merge_all(sketches, get_precision()).count()
+
+
+def rebuild_visitor_sketches(batch_size=5000):
+    """清空草图并从原始访问记录重新计算，返回处理的记录数"""
+    DailyVisitorSketch.objects.all().delete()
+    processed = 0
+    last_id = 0
+    while True:
+        visits = list(
+            VisitStatistics.objects.filter(id__gt=last_id)
+            .order_by('id')
+            .only('id', 'ip_address', 'visit_time')[:batch_size]
+        )
+        if not visits:
+            break
+        record_visitors(visits)
+        processed += len(visits)
+        last_id = visits[-1].id
+    return processed
@@ -0,0 +1,216 @@
+"""
+天气缓存
+天气数据按位置缓存在进程内和共享缓存（Django cache）中，所有访客、所有 worker 共用：
+- 新鲜期（WEATHER_CACHE_TIMEOUT）内直接返回
+- 过期后继续返回旧数据（最长 WEATHER_STALE_TIMEOUT），同时通知后台线程刷新
+- 没有任何数据时返回 None，页面不显示天气组件，绝不在请求中等待外部接口
+
+刷新只在后台线程中进行，多个 worker 之间通过共享缓存中的锁保证同一位置同时只有一个在请求接口；
+请求失败时保留旧数据，WEATHER_RETRY_INTERVAL 秒后再重试
+
+数据来源由 WEATHER_PROVIDER 指定，StubWeatherProvider 返回固定数据，用于本地开发和测试
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .buffers import BackgroundFlusher
+
+logger = logging.getLogger(__name__)
+
+# 使用心知天气的 IP 定位（按服务器出口 IP），失败时退回 WEATHER_CITY
+DEFAULT_LOCATION = 'ip'
+
+
+class BaseWeatherProvider:
+    """天气数据来源基类"""
+
+    def fetch(self, location):
+        """返回天气字典，获取失败时返回 None"""
+        raise NotImplementedError
+
+
+class SeniverseWeatherProvider(BaseWeatherProvider):
+    """心知天气接口"""
+
+    def fetch(self, location):
+        from .utils import get_weather_data
+
+        if location == DEFAULT_LOCATION:
+            return get_weather_data(location=None, use_ip=True) or \
+                get_weather_data(location=getattr(settings, 'WEATHER_CITY', 'beijing'), use_ip=False)
+        return get_weather_data(location=location, use_ip=False)
+
+
+class StubWeatherProvider(BaseWeatherProvider):
+    """不访问网络的固定天气数据，用于本地开发和测试"""
+
+    def fetch(self, location):
+        today = timezone.localdate()
+        city = getattr(settings, 'WEATHER_CITY', '北京') if location == DEFAULT_LOCATION else location
+        return {
+            'city': city,
+            'temperature': '25',
+            'low_temperature': '15',
+            'description': '晴',
+            'icon': '0',
+            'wind_speed': '10',
+            'wind_direction': '北',
+            'humidity': '40',
+            'precipitation': 0.0,
+            'rainfall': '0.00',
+            'date': today.isoformat(),
+            'text_day': '晴',
+            'text_night': '晴',
+            'updated_at': timezone.now().isoformat(),
+            'local_time': timezone.localtime().strftime('%H:%M'),
+        }
+
+
+class WeatherCache(BackgroundFlusher):
+    """
+    按位置缓存天气数据，过期后由后台线程刷新
+    后台线程每隔 WEATHER_REFRESH_INTERVAL 秒醒来一次，提前刷新最近被访问过、即将过期的位置
+    """
+    thread_name = 'weather-refresher'
+
+    def __init__(self):
+        super().__init__(flush_interval=getattr(settings, 'WEATHER_REFRESH_INTERVAL', 60))
+        self.timeout = getattr(settings, 'WEATHER_CACHE_TIMEOUT', 3600)
+        self.stale_timeout = getattr(settings, 'WEATHER_STALE_TIMEOUT', 86400)
+        self.retry_interval = getattr(settings, 'WEATHER_RETRY_INTERVAL', 300)
+        self.lock_timeout = getattr(settings, 'WEATHER_REFRESH_LOCK_TIMEOUT', 30)
+        self._provider = None
+        self._lock = threading.Lock()
+        self._local = {}
+        self._accessed = {}
+        self._pending = set()
+
+    @property
+    def provider(self):
+        if self._provider is None:
+            self._provider = import_string(
+                getattr(settings, 'WEATHER_PROVIDER', 'blog.weather.SeniverseWeatherProvider')
+            )()
+        return self._provider
+
+    @staticmethod
+    def _key(location):
+        digest = hashlib.md5(location.encode('utf-8')).hexdigest()
+        return f'weather:{digest}'
+
+    def get(self, location=None):
+        """
+        读取天气数据，不会等待外部接口
+        数据过期或缺失时通知后台刷新，期间返回旧数据或 None
+        """
+        location = location or DEFAULT_LOCATION
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(location)
+            self._accessed[location] = now
+        if entry is not None and entry['fresh_until'] > now:
+            return entry['data']
+        if entry is not None and now - entry['fetched_at'] > self.timeout + self.stale_timeout:
+            entry = None
+
+        # 本进程的数据过期，先看其他 worker 是否已经刷新过
+        try:
+            shared = cache.get(self._key(location))
+        except Exception:
+            logger.exception('读取天气缓存失败')
+            shared = None
+        if shared is not None:
+            with self._lock:
+                self._local[location] = shared
+            entry = shared
+            if shared['fresh_until'] > now:
+                return shared['data']
+
+        self.request_refresh(location)
+        return entry['data'] if entry is not None else None
+
+    def request_refresh(self, location=None):
+        """通知后台线程刷新指定位置"""
+        with self._lock:
+            self._pending.add(location or DEFAULT_LOCATION)
+        self._ensure_started()
+        self.wakeup()
+
+    def flush(self):
+        """刷新待刷新的位置，以及最近被访问过、即将过期的位置"""
+        now = time.time()
+        with self._lock:
+            locations = self._pending
+            self._pending = set()
+            for location, entry in self._local.items():
+                recently_used = now - self._accessed.get(location, 0) < self.timeout
+                if recently_used and entry['fresh_until'] - now < self.flush_interval:
+                    locations.add(location)
+        for location in locations:
+            self.refresh(location)
+
+    def refresh(self, location=None):
+        """
+        请求接口并写入缓存，返回最新数据
+        其他 worker 正在刷新同一位置时跳过，返回 None
+        """
+        location = location or DEFAULT_LOCATION
+        key = self._key(location)
+        if not cache.add(f'{key}:lock', 1, self.lock_timeout):
+            return None
+        try:
+            try:
+                data = self.provider.fetch(location)
+            except Exception:
+                logger.exception('获取 %s 的天气数据失败', location)
+                data = None
+
+            metrics.weather_fetches.inc(result='failure' if data is None else 'success')
+            now = time.time()
+            if data is not None:
+                entry = {'data': data, 'fetched_at': now, 'fresh_until': now + self.timeout}
+            else:
+                # 获取失败：保留旧数据（获取时间不变，超过可用期限后自然失效），稍后重试
+                with self._lock:
+                    previous = self._local.get(location)
+                entry = {
+                    'data': previous['data'] if previous is not None else None,
+                    'fetched_at': previous['fetched_at'] if previous is not None else now,
+                    'fresh_until': now + self.retry_interval,
+                }
+            cache.set(key, entry, self.timeout + self.stale_timeout)
+            with self._lock:
+                self._local[location] = entry
+            return data
+        finally:
+            cache.delete(f'{key}:lock')
+
+    def clear(self):
+        """清空本进程的缓存（共享缓存不受影响）"""
+        with self._lock:
+            self._local.clear()
+            self._accessed.clear()
+            self._pending.clear()
+
+    def shutdown(self, timeout=5):
+        """停止后台线程；退出时不再请求接口"""
+        if self._pid != os.getpid():
+            return
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+weather_cache = WeatherCache()
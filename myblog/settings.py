@@ -10,6 +10,7 @@ from pathlib import Path
 from dotenv import load_dotenv
 load_dotenv()
 WSGI_APPLICATION = 'myblog.wsgi.application'
+ASGI_APPLICATION = 'myblog.asgi.application'
 # 基础路径
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,12 +31,14 @@ if RENDER_EXTERNAL_HOSTNAME:
 
 # 应用定义
 INSTALLED_APPS = [
+    'daphne',  # 必须在 staticfiles 之前，使 runserver 以 ASGI 方式运行
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'channels',
     'blog.apps.BlogConfig'
 ]
 
@@ -43,6 +46,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # WhiteNoise必须在SecurityMiddleware之后
+    'blog.middleware.MetricsMiddleware',  # 运行时指标，METRICS_ENABLED 关闭时不加载
+    'blog.profiling.QueryProfilerMiddleware',  # 查询分析，QUERY_PROFILER_ENABLED 关闭时不加载
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,6 +68,9 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'blog.context_processors.sidebar',
+                'blog.context_processors.websocket',
+                'blog.utils.weather_context',
             ],
         },
     },
@@ -187,7 +195,168 @@ LOGGING = {
 # 天气API配置
 SENIVERSE_API_KEY = os.getenv('SENIVERSE_API_KEY', '')
 WEATHER_CITY = os.getenv('WEATHER_CITY', '北京')
-WEATHER_CACHE_TIMEOUT = 3600
+WEATHER_CACHE_TIMEOUT = 3600  # 天气数据新鲜期（秒），过期后后台刷新，期间继续返回旧数据
+WEATHER_STALE_TIMEOUT = 86400  # 过期数据最长可继续使用的时间（秒）
+WEATHER_RETRY_INTERVAL = 300  # 接口请求失败后的重试间隔（秒）
+WEATHER_REFRESH_INTERVAL = 60  # 后台线程检查即将过期数据的间隔（秒）
+WEATHER_REFRESH_LOCK_TIMEOUT = 30  # 跨 worker 刷新锁的最长持有时间（秒）
+WEATHER_PROVIDER = os.getenv('WEATHER_PROVIDER', 'blog.weather.SeniverseWeatherProvider')  # 本地开发可用 blog.weather.StubWeatherProvider
+SENIVERSE_API_URL = os.getenv('SENIVERSE_API_URL', 'https://api.seniverse.com/v3/weather/daily.json')
+
+# 对外 HTTP 请求配置（blog.utils.HttpClient）
+OUTBOUND_HTTP_CONNECT_TIMEOUT = 2  # 连接超时（秒）
+OUTBOUND_HTTP_READ_TIMEOUT = 3  # 读取超时（秒）
+OUTBOUND_HTTP_RETRIES = 2  # 连接错误、超时、429/5xx 的重试次数
+OUTBOUND_HTTP_BACKOFF = 0.2  # 重试退避基数（秒），第 n 次重试前随机等待 0 ~ backoff * 2^n
+OUTBOUND_HTTP_POOL_SIZE = 4  # 每个主机的最大连接数
+OUTBOUND_HTTP_BREAKER_THRESHOLD = 5  # 连续失败多少次后熔断
+OUTBOUND_HTTP_BREAKER_RESET = 30  # 熔断持续时间（秒），之后放行一个探测请求
+
+# 访问统计缓冲写入配置
+VISIT_BUFFER_ENABLED = os.getenv('VISIT_BUFFER_ENABLED', 'True') == 'True'
+VISIT_BUFFER_MAX_SIZE = 10000  # 缓冲区最多容纳的记录数
+VISIT_BUFFER_BATCH_SIZE = 500  # 累积到该数量时立即批量写入
+VISIT_BUFFER_FLUSH_INTERVAL = 5  # 最长写入间隔（秒）
+VISIT_BUFFER_FULL_POLICY = os.getenv('VISIT_BUFFER_FULL_POLICY', 'drop')  # 缓冲区满时：drop 丢弃 / block 阻塞等待
+VISIT_BUFFER_BLOCK_TIMEOUT = 1  # block 策略下的最长等待时间（秒），超时后丢弃
+AGENT_CACHE_SIZE = 10000  # 进程内缓存的用户代理摘要到维度表ID的映射数量
+
+# 文章浏览数缓冲写入配置
+VIEW_COUNT_BUFFER_ENABLED = os.getenv('VIEW_COUNT_BUFFER_ENABLED', 'True') == 'True'
+VIEW_COUNT_FLUSH_INTERVAL = 10  # 浏览数增量写回间隔（秒）
+VIEW_COUNT_MAX_PENDING = 1000  # 待写回的文章数达到该值时立即写回
+VIEW_COUNT_MERGE_PENDING = True  # 读取时合并本进程尚未写回的增量
+
+# 访问统计汇总配置
+VISIT_ROLLUP_REFRESH_INTERVAL = 60  # 统计页面触发增量汇总的最小间隔（秒）
+VISIT_ROLLUP_LAG = 60  # 只汇总早于该秒数的访问记录，避免遗漏尚未提交的写入
+VISIT_UNIQUE_ERROR_RATE = 0.01  # 每日独立访客估算的目标标准误差，决定 HyperLogLog 精度
+
+# 访问统计保留配置（python manage.py prune_visits，建议每天执行一次）
+# 日汇总和独立访客草图不受清理影响；清理过之后 update_visit_rollups --rebuild 会拒绝执行，
+# 避免清空汇总表后只能重建保留期内的数据
+VISIT_RETENTION_DAYS = int(os.getenv('VISIT_RETENTION_DAYS', '90'))  # 原始访问记录保留天数，0 表示不清理
+VISIT_HOURLY_ROLLUP_RETENTION_DAYS = 90  # 小时汇总保留天数，0 表示不清理
+VISIT_PARTITION_MONTHS_AHEAD = 2  # PostgreSQL 分区表提前创建的月份数
+VISIT_ARCHIVE_DIR = os.getenv('VISIT_ARCHIVE_DIR', '')  # 删除前导出 CSV 的目录，为空时不导出
+
+# 路由响应时间统计配置（统计面板“响应时间”）
+LATENCY_ENABLED = os.getenv('LATENCY_ENABLED', 'True') == 'True'
+LATENCY_PERIOD = 300  # 直方图时间段长度（秒），也是统计窗口的最小粒度
+LATENCY_FLUSH_INTERVAL = 10  # 进程内直方图合并进数据库的间隔（秒）
+LATENCY_RETENTION_DAYS = 7  # 响应时间记录保留天数（随 prune_visits 清理），应不小于最大统计窗口
+
+# 查询分析配置（统计面板“慢请求”）
+QUERY_PROFILER_ENABLED = os.getenv('QUERY_PROFILER_ENABLED', 'False') == 'True'
+QUERY_PROFILER_SLOW_MS = 500  # 请求耗时超过该值（毫秒）时记录
+QUERY_PROFILER_MAX_QUERIES = 30  # 查询次数超过该值时记录
+QUERY_PROFILER_DUPLICATE_THRESHOLD = 3  # 同一条查询（忽略参数）执行达到该次数视为 N+1
+QUERY_PROFILER_SAMPLE_RATE = float(os.getenv('QUERY_PROFILER_SAMPLE_RATE', '1.0'))  # 慢请求的记录比例
+QUERY_PROFILER_FLUSH_INTERVAL = 10  # 慢请求日志写入间隔（秒）
+QUERY_PROFILER_MAX_PENDING = 1000  # 等待写入的慢请求上限，超出时丢弃
+QUERY_PROFILER_RETENTION_DAYS = 7  # 慢请求日志保留天数（随 prune_visits 清理）
+
+# 运行时指标配置（Prometheus 文本格式，从 /metrics 导出）
+# 多个 worker 进程时使用 file 后端，METRICS_DIR 应在每次部署时清空
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_BACKEND = os.getenv('METRICS_BACKEND', 'memory')  # memory（单进程）/ file（多进程共享）
+METRICS_DIR = os.getenv('METRICS_DIR', str(BASE_DIR / 'metrics'))
+METRICS_FLUSH_INTERVAL = 5  # file 后端写出本进程快照的间隔（秒）
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # 设置后抓取时需要 Authorization: Bearer <token>
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')  # 未设置 METRICS_TOKEN 时允许访问的对端地址（REMOTE_ADDR，不读取 X-Forwarded-For），管理员也可访问
+
+# 缓存配置：CACHE_BACKEND 可选 locmem（默认，进程内）/ file / db
+# 多个 worker 进程时请使用 file 或 db，保证内容变更后各进程的缓存同时失效
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'locmem')
+if CACHE_BACKEND == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+        }
+    }
+elif CACHE_BACKEND == 'db':
+    # 需要先执行 python manage.py createcachetable
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': os.getenv('CACHE_LOCATION', 'blog_cache'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'myblog',
+        }
+    }
+
+# 页面缓存配置（仅对匿名用户生效，内容变更时通过信号整体失效）
+PAGE_CACHE_ENABLED = os.getenv('PAGE_CACHE_ENABLED', 'True') == 'True'
+PAGE_CACHE_TIMEOUT = 300  # 页面缓存有效期（秒）
+PAGE_CACHE_STALE_TIMEOUT = 60  # 过期后仍可作为旧值返回的时间（秒），期间由一个请求负责重建
+PAGE_CACHE_LOCK_TIMEOUT = 10  # 重建锁的最长持有时间（秒）
+PAGE_CACHE_LOCK_WAIT = 2  # 冷启动时等待其他请求重建的最长时间（秒）
+SIDEBAR_CACHE_TIMEOUT = 600  # 侧边栏片段缓存有效期（秒）
+SIDEBAR_POPULAR_POSTS = 5  # 侧边栏热门文章数量
+
+# 全文检索配置（PostgreSQL 使用 tsvector + GIN，SQLite 使用 FTS5）
+# 首次启用或修改分词规则后执行 python manage.py rebuild_search_index
+SEARCH_INDEX_ENABLED = True
+SEARCH_MAX_RESULTS = 500  # 单次搜索最多返回的结果数
+
+# 文章列表分页：keyset 按 (created_at, id) 翻页，不执行 COUNT(*)，代价与页数无关；page 为传统页码分页
+POST_LIST_PAGINATION = os.getenv('POST_LIST_PAGINATION', 'keyset')
+POST_LIST_PAGE_SIZE = 10
+POST_LIST_COUNT_TIMEOUT = 600  # 首页总数缓存有效期（秒），内容变化时随版本号失效
+
+# 评论树：按物化路径一次读出整篇文章的评论，按文章缓存；历史评论需先执行 python manage.py rebuild_comment_paths
+COMMENT_THREADS_PER_PAGE = 20  # 每页显示的顶层评论数
+COMMENT_CACHE_TIMEOUT = 600  # 评论树缓存有效期（秒），新评论提交后立即失效
+
+# 相关文章：预先计算每篇文章的前 K 篇，标签/分类变化时增量刷新；
+# 首次部署或调整权重后执行 python manage.py rebuild_related_posts
+RELATED_POSTS_COUNT = 5  # 每篇文章保存的相关文章数
+RELATED_POSTS_TAG_WEIGHT = 1.0  # 共同标签的权重（再乘以标签的稀有程度）
+RELATED_POSTS_CATEGORY_WEIGHT = 0.5  # 同一分类的权重
+RELATED_POSTS_CONTENT_WEIGHT = 0.0  # 内容 TF-IDF 相似度的权重，0 表示不计算
+RELATED_POSTS_CONTENT_TERMS = 50  # 每篇文章内容向量保留的词元数
+
+# 聊天室配置
+CHAT_BACKEND = os.getenv('CHAT_BACKEND', 'blog.chat_backends.DatabaseChatBackend')  # 单进程开发可用 MemoryChatBackend
+CHAT_MESSAGE_TTL = 3600  # 消息保留时间（秒）
+CHAT_MAX_MESSAGES = 60  # 最多保留的消息数
+CHAT_EXPIRE_INTERVAL = 60  # 过期清理的最小间隔（秒）
+
+# WebSocket 配置：只有以 ASGI 方式部署（SERVER_MODE=asgi，start.sh 用 Daphne 启动）时才启用；
+# 默认的 gunicorn（WSGI）部署没有 WebSocket 路由，不配置 channel layer，页面直接使用 HTTP 轮询，
+# 发送消息时也不再推送事件。本地开发用 runserver 调试 WebSocket 时同样需要设置 SERVER_MODE=asgi
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')  # wsgi / asgi
+if SERVER_MODE == 'asgi':
+    if os.getenv('CHANNEL_REDIS_URL'):
+        # 多个 Daphne 进程时必须使用共享的 Redis channel layer（需要安装 channels-redis）
+        CHANNEL_LAYERS = {
+            'default': {
+                'BACKEND': 'channels_redis.core.RedisChannelLayer',
+                'CONFIG': {'hosts': [os.getenv('CHANNEL_REDIS_URL')]},
+            },
+        }
+    else:
+        # 内存 channel layer 只能在同一进程内投递事件，只适用于单进程部署
+        CHANNEL_LAYERS = {
+            'default': {
+                'BACKEND': 'channels.layers.InMemoryChannelLayer',
+            },
+        }
+
+# 私聊长轮询配置
+# 长轮询会占用一个处理线程直到超时，部署时请使用多线程 worker（gunicorn --threads）；
+# ASGI 部署时客户端优先使用 WebSocket，连接失败才退回长轮询
+PRIVATE_CHAT_LONG_POLL_TIMEOUT = int(os.getenv('PRIVATE_CHAT_LONG_POLL_TIMEOUT', 25))  # 最长挂起时间（秒），0 表示关闭
+PRIVATE_CHAT_LONG_POLL_DB_INTERVAL = 2  # 跨进程兜底查询间隔（秒），单进程部署可设为 0
+
+# 私聊消息分页：详情页只渲染最新一页，更早的消息按 before_id 向前翻页加载
+PRIVATE_CHAT_PAGE_SIZE = 50
 
 # 创建必要的目录（在应用启动时）
 def ensure_directories_exist():
@@ -22,7 +22,15 @@ python manage.py collectstatic --noinput
 # 4. 运行数据库迁移
 echo "运行数据库迁移..."
 python manage.py migrate
+# CACHE_BACKEND=db 时创建缓存表（其他缓存后端下不做任何操作）
+python manage.py createcachetable
+
+# 5. 启动服务器（SERVER_MODE=asgi 时使用 Daphne 以支持 WebSocket；
+#    多个 Daphne 进程时需设置 CHANNEL_REDIS_URL 使用共享的 Redis channel layer）
+if [ "$SERVER_MODE" = "asgi" ]; then
+    echo "启动Daphne服务器..."
+    exec daphne -b 0.0.0.0 -p $PORT myblog.asgi:application
+fi
 
-# 5. 启动Gunicorn服务器
 echo "启动Gunicorn服务器..."
-exec gunicorn myblog.wsgi:application --bind 0.0.0.0:$PORT
+exec gunicorn myblog.wsgi:application --bind 0.0.0.0:$PORT --threads ${GUNICORN_THREADS:-8}